@@ -0,0 +1,741 @@
+"""
+Benchmarks del ensamblador de una pasada
+
+Uso:
+    python benchmark.py referencias [n1 n2 ...]   (por defecto 10000 100000 1000000)
+        Escalamiento de la resolución de referencias hacia adelante
+        (call/jmp/jcc a etiquetas aún no definidas).
+
+    python benchmark.py memoria [n]               (por defecto 1000000)
+        Memoria del buffer de código (bytearray + array de inicios) contra la
+        representación anterior de lista de (direccion, [bytes]).
+
+    python benchmark.py cache [n]                 (por defecto 200000)
+        Líneas por segundo y tasa de aciertos del cache de codificación con
+        distintas capacidades (0 = sin cache), sobre código repetitivo, sobre
+        saltos a etiquetas únicas (que nunca se guardan en el cache), sobre
+        el programa de la suite y sobre
+        líneas todas distintas (donde el cache se suspende solo).
+
+    python benchmark.py paralelo [n]              (por defecto 500000)
+        Ensamblado en serie contra el modo paralelo con 1..CPUs procesos,
+        verificando que la salida sea idéntica byte por byte.
+
+    python benchmark.py relajacion [n1 n2 ...]    (por defecto 10000 100000)
+        Tiempo de la relajación de saltos con n saltos, una parte de ellos
+        fuera del rango de rel8, y cuántos quedan cortos y cercanos; también
+        con una cadena en la que cada salto que crece saca de rango al
+        anterior (debe crecer linealmente con n).
+
+    python benchmark.py salida [n]                (por defecto 1000000)
+        Tiempo y MB/s de cada formato de salida (texto hex, binario plano,
+        Intel HEX, ELF ejecutable y reubicable) sobre el mismo código.
+
+    python benchmark.py incremental [n]           (por defecto 200000)
+        Ensamblado completo contra el modo incremental con el cache vacío, sin
+        cambios y con una línea editada, comparado con solo leer el archivo.
+
+    python benchmark.py api [n]                   (por defecto 20000)
+        Fragmentos por segundo de la API en memoria (ensamblar_codigo) creando
+        un ensamblador por llamada, reutilizando uno y con PoolEnsambladores
+        desde varios hilos.
+
+    python benchmark.py macros [n]                (por defecto 100000)
+        El mismo programa de n repeticiones desenrollado en el archivo contra
+        escrito con equ, %macro y %rep: tamaño del archivo, tiempo y memoria.
+
+    python benchmark.py datos [n]                 (por defecto 1000000)
+        Tabla de n valores en .data: un valor por línea contra listas de 16 y
+        de 1000 valores por línea (emisión en bloque), y cadenas con db.
+
+    python benchmark.py mirilla [n1 n2 ...]       (por defecto 10000 100000 1000000)
+        Optimización de mirilla (-O) sobre programas sintéticos con mov reg, 0
+        y add reg, 1: tiempo de la pasada por instrucción (debe mantenerse
+        constante al crecer n) y bytes ahorrados por regla.
+
+    python benchmark.py lote [n]                  (por defecto 2000)
+        n archivos pequeños ensamblados en serie, uno tras otro, contra el
+        front-end asíncrono (ensamblar_lote) con 1..CPUs procesos: archivos/s,
+        latencia p50 y p99 y salidas idénticas.
+
+    python benchmark.py suite [n1 n2 ...]         (por defecto 10000 100000)
+        Programas sintéticos deterministas (ver generar_programa) de n líneas:
+        rendimiento y pico de memoria del análisis (con el cache de
+        codificación por defecto y sin cache), de la resolución de
+        referencias y de cada escritor, comparados con benchmark_base.json.
+        Termina con error (código 1) si alguna fase empeora más que la
+        tolerancia o no tiene entrada en la base (los tamaños que la base no
+        tiene solo se miden).
+
+    python benchmark.py guardar-base [n1 n2 ...]  (por defecto 10000 100000)
+        Igual que suite, pero guarda los resultados como nueva base. La base
+        depende de la máquina: hay que regenerarla al cambiar de equipo.
+"""
+
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from concurrent.futures import ThreadPoolExecutor
+
+from ensamblador import EnsambladorIA32, PoolEnsambladores, ensamblar_lote, percentil
+
+# Base de la suite y tolerancias: rendimiento mínimo y memoria máxima relativos a la
+# base (la memoria es determinista; el tiempo varía entre ejecuciones)
+ARCHIVO_BASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_base.json')
+TOLERANCIA_RENDIMIENTO = 0.30
+TOLERANCIA_MEMORIA = 0.10
+REPETICIONES = 3      # el rendimiento de cada fase es el mejor de estas ejecuciones
+
+# Mezcla de instrucciones del generador: plantilla -> peso. {r} es un registro,
+# {i} un inmediato, {m} un operando de memoria; los saltos se generan aparte.
+MEZCLA_MNEMONICOS = {
+    "mov {r}, {r}": 12, "mov {r}, {i}": 10, "mov {r}, {m}": 8, "mov {m}, {r}": 6,
+    "add {r}, {r}": 5, "add {r}, {i}": 5, "add {m}, {i}": 2,
+    "cmp {r}, {r}": 4, "cmp {r}, {i}": 4, "xor {r}, {r}": 4,
+    "inc {r}": 4, "dec {r}": 3, "push {r}": 4, "pop {r}": 4,
+    "shr {r}, 1": 2, "div {r}": 1, "xchg {r}, {r}": 1, "nop": 1, "ret": 2,
+    "call": 5, "jmp": 4, "jcc": 9,
+}
+REGISTROS_GENERADOR = ['eax', 'ecx', 'edx', 'ebx', 'esi', 'edi']
+SALTOS_CONDICIONALES = ['je', 'jne', 'jbe', 'ja', 'jae', 'jl', 'jg']
+DISTANCIA_CORTA = 8   # líneas máximas entre un jcc y su etiqueta (siempre cabe en rel8)
+
+
+def generar_referencias_adelante(n):
+    # n llamadas a funciones todavía no definidas, seguidas de sus definiciones.
+    # Cada cuarta referencia es un salto corto a la siguiente etiqueta para
+    # mezclar campos rel8 y rel32.
+    for i in range(n):
+        if i % 4 == 3:
+            yield f"    je cerca{i}"
+            yield f"cerca{i}:"
+        else:
+            yield f"    call f{i}"
+    for i in range(n):
+        if i % 4 != 3:
+            yield f"f{i}:"
+            yield "    ret"
+
+
+def generar_instrucciones(n):
+    # n instrucciones sin etiquetas con la mezcla típica de código generado
+    mezcla = ["    mov eax, 1", "    push eax", "    xor edx, edx", "    add eax, 0x1000",
+              "    mov ebx, eax", "    inc ecx", "    pop eax", "    cmp eax, ebx"]
+    for i in range(n):
+        yield mezcla[i % len(mezcla)]
+
+
+def generar_programa_con_etiquetas(n):
+    # Bloques de 8 instrucciones con una etiqueta cada uno, un salto hacia atrás y
+    # una llamada hacia adelante, para tener referencias dentro y entre bloques
+    instrucciones = generar_instrucciones(n)
+    for i, linea in enumerate(instrucciones):
+        if i % 8 == 0:
+            yield f"b{i // 8}:"
+        elif i % 8 == 4:
+            yield f"    jne b{i // 8}"
+        elif i % 8 == 6:
+            yield f"    call b{i // 8 + 100}" if i // 8 + 100 < n // 8 else "    ret"
+        yield linea
+
+
+def generar_saltos_mixtos(n):
+    # n bloques con un salto hacia adelante; cada décimo salta lejos (fuera de
+    # rel8), lo que a su vez aleja a algunos de sus vecinos y obliga a iterar
+    for i in range(n):
+        yield f"s{i}:"
+        yield f"    jmp s{i + 60}" if i % 10 == 0 and i + 60 < n else f"    jne s{min(i + 2, n - 1)}"
+        yield "    mov eax, 1"
+    yield "    ret"
+
+
+def generar_saltos_en_cadena(n):
+    # Peor caso de la iteración por rondas: el salto i abarca solo al salto i+1 y queda
+    # justo en el límite de rel8, así que cada salto que crece empuja al anterior fuera de
+    # rango y la cadena se resuelve de a uno (n rondas si se revisaran todos los cortos)
+    for i in range(n):
+        yield f"    jmp c{i}"
+        yield "    db " + ", ".join(["0"] * 124)
+        if i:
+            yield f"c{i - 1}:"
+    yield f"    jmp c{n - 1}"
+    yield "    nop"
+    yield f"c{n - 1}:"
+
+
+def generar_programa(n, proporcion_adelante=0.5, densidad_etiquetas=0.05, semilla=2025,
+                     mezcla=MEZCLA_MNEMONICOS):
+    # Programa sintético determinista de unas n líneas con la mezcla de mnemónicos dada.
+    # proporcion_adelante es la fracción de call/jmp/jcc a etiquetas todavía no
+    # definidas; densidad_etiquetas, la probabilidad de que una línea sea una etiqueta.
+    # Los jcc (rel8) saltan a la etiqueta más cercana y se fuerza una etiqueta a menos
+    # de DISTANCIA_CORTA líneas, así el programa ensambla sin relajación de saltos.
+    rng = random.Random(semilla)
+    plantillas = list(mezcla)
+    pesos = list(mezcla.values())
+    definidas = 0            # etiquetas L0 .. L(definidas-1) ya emitidas
+    max_referida = -1        # mayor etiqueta referida hacia adelante
+    ultima_etiqueta = -DISTANCIA_CORTA
+    limite_etiqueta = None   # línea en la que hay que emitir una etiqueta por un jcc adelante
+
+    def operando_memoria():
+        forma = rng.randrange(4)
+        if forma == 0:
+            return f"[datos+{rng.randrange(0, 4096, 4)}]"
+        if forma == 1:
+            return f"[{rng.choice(REGISTROS_GENERADOR)}{rng.randrange(-128, 128):+d}]"
+        if forma == 2:
+            return f"[{rng.choice(REGISTROS_GENERADOR)}+{rng.choice(REGISTROS_GENERADOR)}*4]"
+        return f"[datos+{rng.choice(REGISTROS_GENERADOR)}*{rng.choice((1, 2, 4, 8))}]"
+
+    for i in range(n):
+        if limite_etiqueta == i or (limite_etiqueta is None and rng.random() < densidad_etiquetas):
+            yield f"L{definidas}:"
+            definidas += 1
+            ultima_etiqueta = i
+            limite_etiqueta = None
+            continue
+
+        plantilla = rng.choices(plantillas, pesos)[0]
+        if plantilla in ('call', 'jmp', 'jcc'):
+            adelante = definidas == 0 or rng.random() < proporcion_adelante
+            if plantilla == 'jcc':
+                if adelante and limite_etiqueta is None:
+                    destino = definidas
+                    limite_etiqueta = i + rng.randrange(1, DISTANCIA_CORTA)
+                elif not adelante and i - ultima_etiqueta < DISTANCIA_CORTA:
+                    destino = definidas - 1
+                else:
+                    yield "    nop"
+                    continue
+                yield f"    {rng.choice(SALTOS_CONDICIONALES)} L{destino}"
+            else:
+                if adelante:
+                    destino = definidas + rng.randrange(50)
+                else:
+                    destino = rng.randrange(max(0, definidas - 50), definidas)
+                yield f"    {plantilla} L{destino}"
+            if destino >= definidas:
+                max_referida = max(max_referida, destino)
+            continue
+
+        yield "    " + plantilla.format_map(CamposAleatorios(rng, operando_memoria))
+
+    # Define las etiquetas referidas hacia adelante que faltan y el área de datos
+    for etiqueta in range(definidas, max_referida + 1):
+        yield f"L{etiqueta}:"
+    yield "datos:"
+    yield "    nop"
+
+
+class CamposAleatorios(dict):
+    # Rellena {r}, {i} y {m} de una plantilla con un valor nuevo en cada aparición
+    def __init__(self, rng, operando_memoria):
+        super().__init__()
+        self.rng = rng
+        self.operando_memoria = operando_memoria
+
+    def __missing__(self, campo):
+        if campo == 'r':
+            return self.rng.choice(REGISTROS_GENERADOR)
+        if campo == 'i':
+            return str(self.rng.choice((self.rng.randrange(-128, 128), self.rng.randrange(2**31))))
+        return self.operando_memoria()
+
+
+def procesar(ensamblador, lineas):
+    for num_linea, linea in enumerate(lineas, 1):
+        ensamblador.linea_actual = num_linea
+        ensamblador.procesar_linea(linea)
+
+
+def medir_resolucion(n):
+    ensamblador = EnsambladorIA32()
+    inicio = time.perf_counter()
+    procesar(ensamblador, generar_referencias_adelante(n))
+    t_ensamblar = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    ensamblador.resolver_referencias_pendientes()
+    t_resolver = time.perf_counter() - inicio
+    return t_ensamblar, t_resolver
+
+
+def benchmark_referencias(tamanos):
+    tamanos = tamanos or [10_000, 100_000, 1_000_000]
+    print(f"{'referencias':>12} {'ensamblar (s)':>14} {'resolver (s)':>13} {'ns/ref':>8}")
+    for n in tamanos:
+        t_ensamblar, t_resolver = medir_resolucion(n)
+        total = t_ensamblar + t_resolver
+        print(f"{n:>12} {t_ensamblar:>14.3f} {t_resolver:>13.3f} {total / n * 1e9:>8.0f}")
+
+
+def medir_memoria(construir):
+    tracemalloc.start()
+    resultado = construir()
+    memoria, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return resultado, memoria
+
+
+def benchmark_memoria(tamanos):
+    n = tamanos[0] if tamanos else 1_000_000
+
+    def buffer_compacto():
+        ensamblador = EnsambladorIA32()
+        procesar(ensamblador, generar_instrucciones(n))
+        return ensamblador
+
+    ensamblador, mem_compacto = medir_memoria(buffer_compacto)
+    # La representación anterior se reconstruye con los mismos bytes
+    _, mem_lista = medir_memoria(
+        lambda: [(direccion, list(bytes_)) for direccion, bytes_ in ensamblador.codigo_hex])
+
+    print(f"instrucciones: {n}, bytes de código: {len(ensamblador.imagen)}")
+    print(f"{'representación':<32} {'memoria (MB)':>13} {'bytes/instr':>12}")
+    for nombre, memoria in (("bytearray + array('I')", mem_compacto),
+                            ("lista de (direccion, [bytes])", mem_lista)):
+        print(f"{nombre:<32} {memoria / 2**20:>13.1f} {memoria / n:>12.1f}")
+
+
+def benchmark_cache(tamanos):
+    n = tamanos[0] if tamanos else 200_000
+    programas = (("repetitivo", list(generar_instrucciones(n))),
+                 ("etiquetas únicas", list(generar_referencias_adelante(n // 2))),
+                 ("generado", list(generar_programa(n))),
+                 ("sin repetición", [f"    mov eax, {i}" for i in range(n)]))
+    print(f"{'programa':<18} {'capacidad':>10} {'líneas/s':>12} {'aciertos':>9}")
+    for nombre, lineas in programas:
+        for capacidad in (0, 16, 256, 4096, 65536):
+            ensamblador = EnsambladorIA32(tamano_cache=capacidad)
+            inicio = time.perf_counter()
+            procesar(ensamblador, lineas)
+            ensamblador.resolver_referencias_pendientes()
+            tiempo = time.perf_counter() - inicio
+            tasa = ensamblador.estadisticas_cache()['tasa_aciertos']
+            print(f"{nombre:<18} {capacidad:>10} {len(lineas) / tiempo:>12,.0f} {tasa:>9.1%}")
+
+
+def benchmark_paralelo(tamanos):
+    n = tamanos[0] if tamanos else 500_000
+    with tempfile.NamedTemporaryFile('w', suffix='.asm', delete=False) as f:
+        f.writelines(linea + '\n' for linea in generar_programa_con_etiquetas(n))
+    try:
+        inicio = time.perf_counter()
+        serie = EnsambladorIA32()
+        serie.ensamblar(f.name)
+        serie.resolver_referencias_pendientes()
+        t_serie = time.perf_counter() - inicio
+        print(f"{'modo':<12} {'procesos':>8} {'tiempo (s)':>11} {'aceleración':>12} {'idéntico':>9}")
+        print(f"{'serie':<12} {1:>8} {t_serie:>11.3f} {1.0:>12.2f} {'-':>9}")
+
+        for trabajadores in range(1, (os.cpu_count() or 1) + 1):
+            inicio = time.perf_counter()
+            paralelo = EnsambladorIA32()
+            paralelo.ensamblar_paralelo(f.name, trabajadores=trabajadores)
+            paralelo.resolver_referencias_pendientes()
+            t_paralelo = time.perf_counter() - inicio
+            identico = (paralelo.imagen == serie.imagen and
+                        paralelo.tabla_simbolos == serie.tabla_simbolos)
+            print(f"{'paralelo':<12} {trabajadores:>8} {t_paralelo:>11.3f} "
+                  f"{t_serie / t_paralelo:>12.2f} {'sí' if identico else 'NO':>9}")
+    finally:
+        os.unlink(f.name)
+
+
+def benchmark_relajacion(tamanos):
+    tamanos = tamanos or [10_000, 100_000]
+    print(f"{'caso':<8} {'saltos':>10} {'ensamblar (s)':>14} {'relajar (s)':>12} {'cortos':>8} "
+          f"{'cercanos':>9} {'bytes':>10}")
+    for caso, generar in (("mixtos", generar_saltos_mixtos), ("cadena", generar_saltos_en_cadena)):
+        for n in tamanos:
+            ensamblador = EnsambladorIA32(relajar=True)
+            inicio = time.perf_counter()
+            procesar(ensamblador, generar(n))
+            t_ensamblar = time.perf_counter() - inicio
+
+            inicio = time.perf_counter()
+            ensamblador.resolver_referencias_pendientes()
+            t_relajar = time.perf_counter() - inicio
+            cortos, cercanos = ensamblador.saltos_relajados
+            print(f"{caso:<8} {n:>10} {t_ensamblar:>14.3f} {t_relajar:>12.3f} {cortos:>8} {cercanos:>9} "
+                  f"{len(ensamblador.imagen):>10}")
+
+
+def benchmark_salida(tamanos):
+    n = tamanos[0] if tamanos else 1_000_000
+    ensamblador = EnsambladorIA32()
+    procesar(ensamblador, generar_programa_con_etiquetas(n))
+    ensamblador.resolver_referencias_pendientes()
+
+    escritores = (("texto (generar_hex)", ensamblador.generar_hex),
+                  ("texto (guardar_codigo_hex)", ensamblador.guardar_codigo_hex),
+                  ("binario plano", ensamblador.guardar_binario),
+                  ("Intel HEX", ensamblador.guardar_intel_hex),
+                  ("ELF ejecutable", ensamblador.guardar_elf),
+                  ("ELF reubicable", lambda nombre: ensamblador.guardar_elf(nombre, reubicable=True)))
+    print(f"bytes de código: {len(ensamblador.imagen)}")
+    print(f"{'formato':<28} {'tiempo (s)':>11} {'MB código/s':>12} {'archivo (MB)':>13}")
+    with tempfile.TemporaryDirectory() as directorio:
+        for nombre, escribir in escritores:
+            archivo = os.path.join(directorio, 'salida')
+            inicio = time.perf_counter()
+            escribir(archivo)
+            tiempo = time.perf_counter() - inicio
+            print(f"{nombre:<28} {tiempo:>11.3f} {len(ensamblador.imagen) / tiempo / 2**20:>12.1f} "
+                  f"{os.path.getsize(archivo) / 2**20:>13.1f}")
+
+
+def benchmark_incremental(tamanos):
+    n = tamanos[0] if tamanos else 200_000
+    lineas = [linea + '\n' for linea in generar_programa_con_etiquetas(n)]
+    with tempfile.TemporaryDirectory() as directorio:
+        archivo = os.path.join(directorio, 'programa.asm')
+        cache = os.path.join(directorio, 'cache')
+        with open(archivo, 'w') as f:
+            f.writelines(lineas)
+
+        inicio = time.perf_counter()
+        with open(archivo) as f:
+            f.readlines()
+        t_lectura = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        completo = EnsambladorIA32()
+        completo.ensamblar(archivo)
+        completo.resolver_referencias_pendientes()
+        t_completo = time.perf_counter() - inicio
+        print(f"líneas: {len(lineas)}, solo leer el archivo: {t_lectura:.3f} s")
+        print(f"{'ensamblado':<26} {'tiempo (s)':>11} {'reutilizados':>13} {'ensamblados':>12}")
+        print(f"{'completo':<26} {t_completo:>11.3f} {'-':>13} {'-':>12}")
+
+        def incremental(nombre):
+            inicio = time.perf_counter()
+            ensamblador = EnsambladorIA32()
+            ensamblador.ensamblar_incremental(archivo, cache)
+            ensamblador.resolver_referencias_pendientes()
+            tiempo = time.perf_counter() - inicio
+            print(f"{nombre:<26} {tiempo:>11.3f} {ensamblador.bloques_reutilizados:>13} "
+                  f"{ensamblador.bloques_ensamblados:>12}")
+
+        incremental("incremental, cache vacío")
+        incremental("incremental, sin cambios")
+        editada = len(lineas) // 2
+        while lineas[editada].rstrip().endswith(':'):
+            editada += 1
+        lineas[editada] = "    inc ecx\n"
+        with open(archivo, 'w') as f:
+            f.writelines(lineas)
+        incremental("incremental, 1 línea")
+
+
+def benchmark_api(tamanos):
+    n = tamanos[0] if tamanos else 20_000
+    # Fragmentos pequeños como los de un servicio JIT: pocas instrucciones, una
+    # referencia hacia atrás, una hacia adelante y un acceso a memoria indexado
+    fragmentos = [f"inicio:\n    mov eax, [ebx+esi*4+{i % 64}]\n    add eax, {i}\n"
+                  f"    cmp eax, edx\n    jne inicio\n    call fin\nfin:\n    ret"
+                  for i in range(256)]
+
+    def medir(nombre, ensamblar, hilos=1):
+        inicio = time.perf_counter()
+        if hilos == 1:
+            for i in range(n):
+                ensamblar(fragmentos[i % len(fragmentos)], 0x400000 + i * 64)
+        else:
+            with ThreadPoolExecutor(hilos) as executor:
+                list(executor.map(lambda i: ensamblar(fragmentos[i % len(fragmentos)], 0x400000 + i * 64),
+                                  range(n)))
+        tiempo = time.perf_counter() - inicio
+        print(f"{nombre:<34} {hilos:>5} {n / tiempo:>14,.0f} {tiempo / n * 1e6:>10.1f}")
+
+    print(f"{'modo':<34} {'hilos':>5} {'fragmentos/s':>14} {'µs/llamada':>10}")
+    medir("instancia nueva por llamada",
+          lambda fuente, origen: EnsambladorIA32().ensamblar_codigo(fuente, origen))
+    reutilizado = EnsambladorIA32()
+    medir("instancia reutilizada", reutilizado.ensamblar_codigo)
+    pool = PoolEnsambladores()
+    for hilos in (1, 4, 16):
+        medir("PoolEnsambladores", pool.ensamblar_codigo, hilos)
+
+
+def benchmark_datos(tamanos):
+    n = tamanos[0] if tamanos else 1_000_000
+    rng = random.Random(0)
+    valores = [str(rng.randrange(-2**31, 2**31)) for _ in range(n)]
+    casos = [("dd, 1 por línea", [f"    dd {v}" for v in valores])]
+    for por_linea in (16, 1000):
+        casos.append((f"dd, {por_linea} por línea",
+                      ["    dd " + ', '.join(valores[i:i + por_linea]) for i in range(0, n, por_linea)]))
+    casos.append(("db, cadenas", [f"    db 'mensaje número {i}, con coma', 10, 0" for i in range(n // 32)]))
+
+    print(f"{'caso':<20} {'líneas':>9} {'tiempo (s)':>11} {'MB/s':>8}")
+    for nombre, lineas in casos:
+        ensamblador = EnsambladorIA32()
+        inicio = time.perf_counter()
+        ensamblador.ensamblar_codigo(["section .data", "tabla:"] + lineas)
+        tiempo = time.perf_counter() - inicio
+        print(f"{nombre:<20} {len(lineas):>9,} {tiempo:>11.3f} {len(ensamblador.imagen) / 2**20 / tiempo:>8.1f}")
+
+
+def benchmark_mirilla(tamanos):
+    tamanos = tamanos or [10_000, 100_000, 1_000_000]
+    mezcla = dict(MEZCLA_MNEMONICOS, **{"mov {r}, 0": 4, "add {r}, 1": 3})
+    print(f"{'líneas':>10} {'instrucciones':>14} {'mirilla (s)':>12} {'µs/instr':>9} "
+          f"{'bytes sin -O':>13} {'bytes con -O':>13} {'ahorro':>7}")
+    for n in tamanos:
+        lineas = list(generar_programa(n, mezcla=mezcla))
+        sin = EnsambladorIA32()
+        procesar(sin, lineas)
+        sin.resolver_referencias_pendientes()
+
+        con = EnsambladorIA32(optimizar=True, estadisticas=True)
+        procesar(con, lineas)
+        instrucciones = len(con.inicios)
+        con.resolver_referencias_pendientes()
+        tiempo = con.medidor.fases['optimizar_mirilla'][1]
+        ahorro = con.optimizador.bytes_ahorrados()
+        print(f"{n:>10} {instrucciones:>14} {tiempo:>12.3f} {tiempo / instrucciones * 1e6:>9.2f} "
+              f"{len(sin.imagen):>13} {len(con.imagen):>13} {ahorro / len(sin.imagen):>7.1%}")
+    print()
+    for regla, (veces, bytes_) in con.optimizador.ahorro.items():
+        print(f"{regla:<32} {veces:>9} veces {bytes_:>10} bytes")
+
+
+def benchmark_macros(tamanos):
+    n = tamanos[0] if tamanos else 100_000
+    # Cuerpo típico de código generado: copia de un elemento de un arreglo a otro
+    cuerpo = ["    mov eax, [esi+ecx*4+16]", "    add eax, 4", "    mov [edi+ecx*4+16], eax",
+              "    inc ecx", "    cmp ecx, 1000"]
+    desenrollado = [linea for _ in range(n) for linea in cuerpo]
+    compacto = ["TAM equ 4", "DESP equ TAM*4",
+                "%macro copia 2", "    mov eax, [%1+ecx*TAM+DESP]", "    add eax, TAM",
+                "    mov [%2+ecx*TAM+DESP], eax", "%endmacro",
+                f"%rep {n}", "    copia esi, edi", "    inc ecx", "    cmp ecx, 1000", "%endrep"]
+
+    print(f"{'fuente':<14} {'archivo (KB)':>13} {'tiempo (s)':>11} {'pico (MB)':>10} {'idéntico':>9}")
+    resultados = {}
+    with tempfile.TemporaryDirectory() as directorio:
+        for nombre, lineas in (("desenrollado", desenrollado), ("con macros", compacto)):
+            archivo = os.path.join(directorio, 'programa.asm')
+            with open(archivo, 'w') as f:
+                f.writelines(linea + '\n' for linea in lineas)
+            ensamblador = EnsambladorIA32()
+            inicio = time.perf_counter()
+            ensamblador.ensamblar(archivo)
+            tiempo = time.perf_counter() - inicio
+            # La memoria se mide en otra corrida: tracemalloc distorsiona el tiempo
+            tracemalloc.start()
+            EnsambladorIA32().ensamblar(archivo)
+            pico = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            resultados[nombre] = bytes(ensamblador.imagen)
+            identico = resultados[nombre] == resultados["desenrollado"]
+            print(f"{nombre:<14} {os.path.getsize(archivo) / 1024:>13,.0f} {tiempo:>11.3f} "
+                  f"{pico / 2**20:>10.1f} {'sí' if identico else 'NO':>9}")
+
+
+def medir_fase(funcion, cantidad, con_memoria):
+    # Devuelve (cantidad por segundo, pico de memoria en MB o None) de una fase;
+    # cantidad puede ser una función que se evalúa después de la fase
+    if con_memoria:
+        tracemalloc.start()
+    inicio = time.perf_counter()
+    funcion()
+    tiempo = time.perf_counter() - inicio
+    pico = None
+    if con_memoria:
+        pico = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    if callable(cantidad):
+        cantidad = cantidad()
+    return cantidad / tiempo, pico
+
+
+def medir_suite(archivo, num_lineas, con_memoria):
+    # {fase: {'por_segundo', 'unidad', 'pico_mb'}} para el análisis, la resolución de
+    # referencias y cada escritor. La resolución se mide en modo relajado, donde todas
+    # las referencias se resuelven al final (en modo normal se parchean al analizar).
+    resultados = {}
+
+    def registrar(fase, unidad, medida):
+        por_segundo, pico = medida
+        resultados[fase] = {'por_segundo': por_segundo, 'unidad': unidad, 'pico_mb': pico}
+
+    ensamblador = EnsambladorIA32()
+    registrar('análisis', 'líneas', medir_fase(lambda: ensamblador.ensamblar(archivo), num_lineas, con_memoria))
+    ensamblador.resolver_referencias_pendientes()
+    sin_cache = EnsambladorIA32(tamano_cache=0)
+    registrar('análisis sin cache', 'líneas',
+              medir_fase(lambda: sin_cache.ensamblar(archivo), num_lineas, con_memoria))
+
+    relajado = EnsambladorIA32(relajar=True)
+    relajado.ensamblar(archivo)
+    referencias = len(relajado.referencias_diferidas)
+    registrar('resolución', 'referencias',
+              medir_fase(relajado.resolver_referencias_pendientes, referencias, con_memoria))
+
+    bytes_codigo = len(ensamblador.imagen)
+    escritores = (('texto hex', ensamblador.guardar_codigo_hex),
+                  ('binario plano', ensamblador.guardar_binario),
+                  ('Intel HEX', ensamblador.guardar_intel_hex),
+                  ('ELF ejecutable', ensamblador.guardar_elf),
+                  ('ELF reubicable', lambda nombre: ensamblador.guardar_elf(nombre, reubicable=True)))
+    with tempfile.TemporaryDirectory() as directorio:
+        salida = os.path.join(directorio, 'salida')
+        for fase, escribir in escritores:
+            registrar(fase, 'bytes', medir_fase(lambda: escribir(salida), bytes_codigo, con_memoria))
+    return resultados
+
+
+def correr_suite(tamanos):
+    # Tiempo y memoria se miden en ejecuciones separadas: tracemalloc hace más lento
+    # todo lo que mide y distorsionaría el rendimiento. Del tiempo se toma la mejor de
+    # REPETICIONES ejecuciones, la menos afectada por el resto del sistema.
+    resultados = {}
+    for n in tamanos or [10_000, 100_000]:
+        with tempfile.NamedTemporaryFile('w', suffix='.asm', delete=False) as f:
+            num_lineas = 0
+            for linea in generar_programa(n):
+                f.write(linea + '\n')
+                num_lineas += 1
+        try:
+            rendimiento = medir_suite(f.name, num_lineas, con_memoria=False)
+            for _ in range(REPETICIONES - 1):
+                for fase, medida in medir_suite(f.name, num_lineas, con_memoria=False).items():
+                    rendimiento[fase]['por_segundo'] = max(rendimiento[fase]['por_segundo'],
+                                                           medida['por_segundo'])
+            memoria = medir_suite(f.name, num_lineas, con_memoria=True)
+        finally:
+            os.unlink(f.name)
+        for fase, medida in rendimiento.items():
+            medida['pico_mb'] = memoria[fase]['pico_mb']
+        resultados[str(n)] = rendimiento
+    return resultados
+
+
+def formatear_cantidad(valor, unidad):
+    if unidad == 'bytes':
+        return f"{valor / 2**20:,.1f} MB/s"
+    return f"{valor:,.0f} {unidad}/s"
+
+
+def benchmark_lote(tamanos):
+    n = tamanos[0] if tamanos else 2000
+    with tempfile.TemporaryDirectory() as directorio:
+        archivos = []
+        for i in range(n):
+            archivos.append(os.path.join(directorio, f'programa{i}.asm'))
+            with open(archivos[-1], 'w') as f:
+                f.writelines(linea + '\n' for linea in generar_programa(200 + i % 300, semilla=i))
+
+        # En serie: un ensamblador nuevo por archivo, con lectura y escritura bloqueantes
+        latencias = []
+        inicio = time.perf_counter()
+        for archivo in archivos:
+            comienzo = time.perf_counter()
+            ensamblador = EnsambladorIA32()
+            ensamblador.ensamblar(archivo)
+            ensamblador.resolver_referencias_pendientes()
+            ensamblador.guardar_binario(os.path.splitext(archivo)[0] + '.bin')
+            latencias.append(time.perf_counter() - comienzo)
+        t_serie = time.perf_counter() - inicio
+        esperado = {}
+        for archivo in archivos:
+            with open(os.path.splitext(archivo)[0] + '.bin', 'rb') as f:
+                esperado[archivo] = f.read()
+
+        def fila(modo, procesos, segundos, latencias, identico):
+            latencias = sorted(latencias)
+            print(f"{modo:<8} {procesos:>8} {n / segundos:>11,.0f} {percentil(latencias, 0.5) * 1000:>9.1f} "
+                  f"{percentil(latencias, 0.99) * 1000:>9.1f} {identico:>9}")
+
+        print(f"{'modo':<8} {'procesos':>8} {'archivos/s':>11} {'p50 (ms)':>9} {'p99 (ms)':>9} {'idéntico':>9}")
+        fila('serie', 1, t_serie, latencias, '-')
+        salida = os.path.join(directorio, 'salida')
+        os.makedirs(salida)
+        for trabajadores in range(1, (os.cpu_count() or 1) + 1):
+            resultado = asyncio.run(ensamblar_lote(archivos, 'bin', salida, trabajadores=trabajadores))
+            identico = not resultado.errores
+            for archivo in archivos:
+                with open(os.path.join(salida, os.path.basename(os.path.splitext(archivo)[0]) + '.bin'), 'rb') as f:
+                    identico = identico and f.read() == esperado[archivo]
+            fila('lote', trabajadores, resultado.segundos, resultado.latencias, 'sí' if identico else 'NO')
+
+
+def benchmark_suite(tamanos, guardar_base=False):
+    resultados = correr_suite(tamanos)
+    base = {}
+    if not guardar_base and os.path.exists(ARCHIVO_BASE):
+        with open(ARCHIVO_BASE) as f:
+            base = json.load(f)['resultados']
+
+    regresiones = []
+    print(f"{'líneas':>9} {'fase':<18} {'rendimiento':>22} {'vs base':>8} {'pico (MB)':>10} {'vs base':>8}")
+    for n, fases in resultados.items():
+        for fase, medida in fases.items():
+            referencia = base.get(n, {}).get(fase)
+            cambio_rendimiento = cambio_memoria = '-'
+            if n in base and not referencia:
+                # Una fase nueva sin base no se estaría vigilando: también es un error
+                regresiones.append(f"{fase} ({n} líneas): sin entrada en la base; regenérala con guardar-base")
+            elif referencia:
+                relativo = medida['por_segundo'] / referencia['por_segundo'] - 1
+                cambio_rendimiento = f"{relativo:+.0%}"
+                if relativo < -TOLERANCIA_RENDIMIENTO:
+                    regresiones.append(f"{fase} ({n} líneas): rendimiento {relativo:+.0%}")
+                # Margen absoluto pequeño para fases que casi no reservan memoria
+                limite = referencia['pico_mb'] * (1 + TOLERANCIA_MEMORIA) + 0.1
+                cambio_memoria = f"{medida['pico_mb'] / max(referencia['pico_mb'], 1e-9) - 1:+.0%}"
+                if medida['pico_mb'] > limite:
+                    regresiones.append(f"{fase} ({n} líneas): pico de memoria "
+                                       f"{referencia['pico_mb']:.1f} -> {medida['pico_mb']:.1f} MB")
+            print(f"{n:>9} {fase:<18} {formatear_cantidad(medida['por_segundo'], medida['unidad']):>22} "
+                  f"{cambio_rendimiento:>8} {medida['pico_mb']:>10.1f} {cambio_memoria:>8}")
+
+    sin_base = [n for n in resultados if base and n not in base]
+    if sin_base:
+        print(f"\nTamaños sin base (solo medidos): {', '.join(sin_base)}")
+
+    if guardar_base:
+        with open(ARCHIVO_BASE, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'resultados': resultados}, f, indent=2, ensure_ascii=False)
+            f.write('\n')
+        print(f"\nBase guardada en {ARCHIVO_BASE}")
+    elif not base:
+        print("\nSin base para comparar; créala con: python benchmark.py guardar-base")
+    elif regresiones:
+        print("\n" + "=" * 60, file=sys.stderr)
+        print(f"REGRESIÓN DE RENDIMIENTO (tolerancia {TOLERANCIA_RENDIMIENTO:.0%} en rendimiento, "
+              f"{TOLERANCIA_MEMORIA:.0%} en memoria):", file=sys.stderr)
+        for regresion in regresiones:
+            print(f"  - {regresion}", file=sys.stderr)
+        print("=" * 60, file=sys.stderr)
+        sys.exit(1)
+    else:
+        print("\nSin regresiones respecto a la base.")
+
+
+def main():
+    benchmarks = {'referencias': benchmark_referencias, 'memoria': benchmark_memoria,
+                  'cache': benchmark_cache, 'paralelo': benchmark_paralelo,
+                  'relajacion': benchmark_relajacion, 'salida': benchmark_salida,
+                  'incremental': benchmark_incremental, 'api': benchmark_api,
+                  'macros': benchmark_macros, 'datos': benchmark_datos,
+                  'mirilla': benchmark_mirilla, 'lote': benchmark_lote,
+                  'suite': benchmark_suite,
+                  'guardar-base': lambda tamanos: benchmark_suite(tamanos, guardar_base=True)}
+    if len(sys.argv) < 2 or sys.argv[1] not in benchmarks:
+        print(__doc__)
+        return
+    benchmarks[sys.argv[1]]([int(x) for x in sys.argv[2:]])
+
+
+if __name__ == '__main__':
+    main()
@@ -6,33 +6,1414 @@ Revisiones:
 Fecha de última modificación: 09 de junio de 2025
 """
 
+import argparse
+import ast
+import asyncio
+import bisect
+import cProfile
+import hashlib
+import heapq
+import itertools
+import json
+import marshal
+import os
+import queue
+import random
 import re
+import struct
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from array import array
+from collections import OrderedDict, deque, namedtuple
 
-class EnsambladorIA32:
+# Registro de una referencia a etiqueta, creado al emitir la instrucción que la usa:
+# dirección absoluta del campo a parchear, ancho en bytes (1 = rel8, 4 = rel32/disp32),
+# si es relativo al PC (saltos y llamadas) o absoluto ([label]) y línea fuente.
+# Un campo absoluto ya contiene el desplazamiento de [label+disp], que se suma al parchear.
+ReferenciaPendiente = namedtuple('ReferenciaPendiente', ['direccion', 'ancho', 'relativo', 'linea'])
+
+# Códigos de los registros de 32 bits (campo reg o r/m de ModR/M, o sumados al opcode)
+REGISTROS = {
+    'eax': 0x00,
+    'ecx': 0x01,
+    'edx': 0x02,
+    'ebx': 0x03,
+    'esp': 0x04,
+    'ebp': 0x05,
+    'esi': 0x06,
+    'edi': 0x07
+}
+OPERANDOS_REGISTRO = {nombre: ('reg', codigo) for nombre, codigo in REGISTROS.items()}
+
+# Tabla de instrucciones: mnemónico -> {forma de operandos: (notación Intel, Op/En)}
+# Formas de operando: reg, imm (inmediato), imm8 (inmediato que cabe en 8 bits con
+# signo), mem ([dirección]) y label (etiqueta). Op/En indica dónde va cada operando,
+# en orden: R = campo reg de ModR/M, M = campo r/m, O = sumado al opcode (+rd),
+# I = inmediato, D = desplazamiento relativo a una etiqueta; ZO = sin operandos.
+# Agregar una instrucción es agregar una entrada aquí.
+INSTRUCCIONES = {
+    'mov':  {('reg', 'reg'):  ('8B /r', 'RM'),       # mov r32, r/m32
+             ('reg', 'imm'):  ('B8+rd id', 'OI'),    # mov r32, imm32
+             ('reg', 'mem'):  ('8B /r', 'RM'),
+             ('mem', 'reg'):  ('89 /r', 'MR'),       # mov r/m32, r32
+             ('mem', 'imm'):  ('C7 /0 id', 'MI')},
+    'add':  {('reg', 'reg'):  ('01 /r', 'MR'),       # add r/m32, r32
+             ('reg', 'imm8'): ('83 /0 ib', 'MI'),
+             ('reg', 'imm'):  ('81 /0 id', 'MI'),
+             ('reg', 'mem'):  ('03 /r', 'RM'),       # add r32, r/m32
+             ('mem', 'reg'):  ('01 /r', 'MR'),
+             ('mem', 'imm8'): ('83 /0 ib', 'MI'),
+             ('mem', 'imm'):  ('81 /0 id', 'MI')},
+    'div':  {('reg',):        ('F7 /6', 'M'),
+             ('mem',):        ('F7 /6', 'M')},
+    'inc':  {('reg',):        ('40+rd', 'O'),
+             ('mem',):        ('FF /0', 'M')},
+    'dec':  {('reg',):        ('48+rd', 'O'),
+             ('mem',):        ('FF /1', 'M')},
+    'cmp':  {('reg', 'reg'):  ('39 /r', 'MR'),
+             ('reg', 'imm8'): ('83 /7 ib', 'MI'),
+             ('reg', 'imm'):  ('81 /7 id', 'MI'),
+             ('reg', 'mem'):  ('3B /r', 'RM'),
+             ('mem', 'reg'):  ('39 /r', 'MR'),
+             ('mem', 'imm8'): ('83 /7 ib', 'MI'),
+             ('mem', 'imm'):  ('81 /7 id', 'MI')},
+    'shr':  {('reg', 'imm'):  ('C1 /5 ib', 'MI'),    # el CPU solo usa 5 bits de la cuenta
+             ('mem', 'imm'):  ('C1 /5 ib', 'MI')},
+    'xor':  {('reg', 'reg'):  ('31 /r', 'MR'),
+             ('reg', 'imm8'): ('83 /6 ib', 'MI'),
+             ('reg', 'imm'):  ('81 /6 id', 'MI'),
+             ('reg', 'mem'):  ('33 /r', 'RM'),
+             ('mem', 'reg'):  ('31 /r', 'MR'),
+             ('mem', 'imm8'): ('83 /6 ib', 'MI'),
+             ('mem', 'imm'):  ('81 /6 id', 'MI')},
+    'push': {('reg',):        ('50+rd', 'O'),
+             ('mem',):        ('FF /6', 'M')},
+    'pop':  {('reg',):        ('58+rd', 'O'),
+             ('mem',):        ('8F /0', 'M')},
+    'xchg': {('reg', 'reg'):  ('87 /r', 'MR'),
+             ('reg', 'mem'):  ('87 /r', 'RM'),
+             ('mem', 'reg'):  ('87 /r', 'MR')},
+    'call': {('label',):      ('E8 cd', 'D')},
+    'jmp':  {('label',):      ('E9 cd', 'D')},
+    'je':   {('label',):      ('74 cb', 'D')},
+    'jne':  {('label',):      ('75 cb', 'D')},
+    'jbe':  {('label',):      ('76 cb', 'D')},       # jbe / jna
+    'ja':   {('label',):      ('77 cb', 'D')},       # ja / jnbe
+    'jae':  {('label',):      ('73 cb', 'D')},       # jae / jnb
+    'jl':   {('label',):      ('7C cb', 'D')},
+    'jg':   {('label',):      ('7F cb', 'D')},
+    'ret':  {():              ('C3', 'ZO')},
+    'hlt':  {():              ('F4', 'ZO')},
+    'nop':  {():              ('90', 'ZO')},
+}
+
+# Codificación de una forma de instrucción ya traducida de la notación Intel:
+# opcode (bytes), digito (/digit de ModR/M, None para /r), op_en, ancho_imm y
+# ancho_rel (bytes del inmediato y del desplazamiento relativo, 0 si no hay).
+Codificacion = namedtuple('Codificacion', ['opcode', 'digito', 'op_en', 'ancho_imm', 'ancho_rel'])
+
+# Operando de memoria: [base + indice*escala + desplazamiento] con etiqueta opcional;
+# base e indice son códigos de registro o None
+Direccion = namedtuple('Direccion', ['base', 'indice', 'escala', 'desplazamiento', 'etiqueta'])
+
+# Escala del índice -> campo ss del byte SIB
+ESCALAS = {1: 0, 2: 1, 4: 2, 8: 3}
+
+ANCHOS = {'ib': 1, 'id': 4, 'cb': 1, 'cd': 4}
+
+# Lexer de instrucciones: mnemónico y hasta dos operandos ya sin espacios alrededor
+LEXER_INSTRUCCION = re.compile(r'([A-Za-z]\w*)(?:\s+([^,\s](?:[^,]*[^,\s])?))?(?:\s*,\s*([^,\s](?:[^,]*[^,\s])?))?\s*$')
+
+# Capacidad por defecto del cache de codificación (líneas de instrucción distintas sin
+# etiquetas: las que usan etiquetas nunca se guardan)
+TAMANO_CACHE = 4096
+# Cache adaptable: cada VENTANA_CACHE fallos se mira la tasa de aciertos de la ventana; si
+# es menor que TASA_MINIMA_CACHE el cache se vacía y deja de guardar líneas durante
+# PAUSA_CACHE ventanas, y después vuelve a probar
+VENTANA_CACHE = 4096
+TASA_MINIMA_CACHE = 0.2
+PAUSA_CACHE = 8
+
+# Comentario de una línea: todo desde el primer ';' que no esté dentro de una cadena
+COMENTARIO = re.compile(r"""(?:[^;'"]|'[^']*'|"[^"]*"|['"])*""")
+
+# Secciones (section .data o solo .data) y directivas de datos, con etiqueta opcional
+# en la misma línea (con o sin ':'): mensaje db 'hola', 0 / tabla: dd 1, 2 / resb 64 / align 4
+SECCIONES = ('.text', '.data', '.bss')
+SECCION = re.compile(r'(?:(?:section|segment)\s+(\S+)|(\.(?:text|data|bss)))$', re.I)
+DIRECTIVA_DATOS = re.compile(r'(?:([A-Za-z_.$?@][\w.$?@]*):?\s+)?(d[bwd]|res[bwd]|align)\s+(\S.*)$', re.I)
+ELEMENTO_ETIQUETA = re.compile(r'([A-Za-z_.$?@][\w.$?@]*)\s*([+-]\s*\w+)?$')
+ANCHOS_DATOS = {'b': 1, 'w': 2, 'd': 4}
+FORMATOS_DATOS = {1: 'B', 2: 'H', 4: 'I'}
+ALINEACION_SECCIONES = 4   # alineación mínima del inicio de .data y .bss
+
+# Preprocesador: líneas que son directivas (%define, %macro, %rep, ..., times, equ)
+DIRECTIVA = re.compile(r'\s*(?:(%[A-Za-z]+)|(times)\s|([A-Za-z_.$?@][\w.$?@]*):?\s+(equ)\s)', re.I)
+IDENTIFICADOR = re.compile(r"""'[^']*'|"[^"]*"|[A-Za-z_.$?@][\w.$?@]*""")   # las cadenas se saltan enteras
+PARAMETRO_MACRO = re.compile(r'%(\d+)')
+PROFUNDIDAD_MAXIMA_MACROS = 64
+# Límites del preprocesador: cuenta de un %rep o times, y bits de cualquier valor (también
+# intermedio) de una expresión constante, para que 1<<100000 no consuma memoria y tiempo
+REPETICIONES_MAXIMAS = 1 << 24
+BITS_MAXIMOS_EXPRESION = 64
+
+# Operadores permitidos en las expresiones constantes del preprocesador ('/' es entera)
+OPERADORES_BINARIOS = {
+    ast.Add: lambda a, b: a + b, ast.Sub: lambda a, b: a - b, ast.Mult: lambda a, b: a * b,
+    ast.Div: lambda a, b: a // b, ast.FloorDiv: lambda a, b: a // b, ast.Mod: lambda a, b: a % b,
+    ast.LShift: lambda a, b: a << b, ast.RShift: lambda a, b: a >> b,
+    ast.BitAnd: lambda a, b: a & b, ast.BitOr: lambda a, b: a | b, ast.BitXor: lambda a, b: a ^ b,
+}
+OPERADORES_UNARIOS = {ast.USub: lambda a: -a, ast.UAdd: lambda a: a, ast.Invert: lambda a: ~a}
+
+# Cache incremental en disco: tamaño máximo por defecto, líneas promedio por bloque y
+# versión del formato (cambiarla invalida los bloques guardados por versiones anteriores)
+TAMANO_CACHE_DISCO = 256 * 2**20
+LINEAS_POR_BLOQUE_INCREMENTAL = 1024
+VERSION_CACHE_DISCO = 3
+
+def quitar_comentario(linea):
+    # Corta el comentario sin confundir un ';' dentro de una cadena (db 'a;b')
+    if "'" in linea or '"' in linea:
+        return COMENTARIO.match(linea).group()
+    corte = linea.find(';')
+    return linea if corte < 0 else linea[:corte]
+
+def traducir_notacion(notacion, op_en):
+    # "83 /0 ib" -> Codificacion(b'\x83', 0, 'MI', 1, 0)
+    opcode = []
+    digito = None
+    ancho_imm = ancho_rel = 0
+    for parte in notacion.split():
+        if parte.startswith('/'):
+            digito = None if parte == '/r' else int(parte[1:])
+        elif parte in ('ib', 'id'):
+            ancho_imm = ANCHOS[parte]
+        elif parte in ('cb', 'cd'):
+            ancho_rel = ANCHOS[parte]
+        else:
+            opcode.append(int(parte.split('+')[0], 16))
+    return Codificacion(bytes(opcode), digito, op_en, ancho_imm, ancho_rel)
+
+def construir_tabla_codificacion(instrucciones):
+    # Aplana INSTRUCCIONES en {(mnemónico, forma): Codificacion} para despachar con
+    # un solo acceso a diccionario. Una forma imm también acepta inmediatos de 8 bits
+    # y una forma mem acepta una etiqueta suelta (equivale a [etiqueta]), salvo que
+    # la instrucción tenga una entrada propia para ellos.
+    especificas = {'imm': ('imm', 'imm8'), 'mem': ('mem', 'label')}
+    tabla = {}
+    for mnem, formas in instrucciones.items():
+        for forma, (notacion, op_en) in formas.items():
+            tabla[(mnem, forma)] = traducir_notacion(notacion, op_en)
+    for mnem, formas in instrucciones.items():
+        for forma in formas:
+            for concreta in itertools.product(*(especificas.get(c, (c,)) for c in forma)):
+                tabla.setdefault((mnem, concreta), tabla[(mnem, forma)])
+    return tabla
+
+def empacar_inmediato(imm, ancho):
+    if ancho == 1:
+        return bytes((imm & 0xFF,))
+    if not (-2**31 <= imm < 2**32):
+        raise ValueError(f"Inmediato fuera de rango de 32 bits: {imm}")
+    return struct.pack('<I', imm & 0xFFFFFFFF)
+
+def codificar_direccion(reg, direccion, offset):
+    # ModR/M, SIB si hace falta y desplazamiento de un operando de memoria. offset es
+    # la posición del byte ModR/M dentro de la instrucción; devuelve (bytes, referencias).
+    # Se elige el desplazamiento más corto: ninguno, disp8 o disp32 (siempre disp32 con
+    # etiqueta, cuyo campo se parchea sumando el desplazamiento ya escrito).
+    base, indice, escala, desplazamiento, etiqueta = direccion
+    if base is None:
+        if indice is None:
+            # Dirección absoluta: mod=00 r/m=101
+            modrm = bytes((0x05 | (reg << 3),))
+        else:
+            # Solo índice escalado: SIB con base=101 y mod=00, siempre con disp32
+            modrm = bytes((0x04 | (reg << 3), (ESCALAS[escala] << 6) | (indice << 3) | 0x05))
+        ancho = 4
+    else:
+        if etiqueta is not None:
+            mod, ancho = 0x80, 4
+        elif desplazamiento == 0 and base != REGISTROS['ebp']:
+            mod, ancho = 0x00, 0    # [ebp] con mod=00 significaría disp32 sin base
+        elif -128 <= desplazamiento <= 127:
+            mod, ancho = 0x40, 1
+        else:
+            mod, ancho = 0x80, 4
+        if indice is None and base != REGISTROS['esp']:
+            modrm = bytes((mod | (reg << 3) | base,))
+        else:
+            # r/m=100 pide SIB; índice 100 significa sin índice (así se codifica [esp])
+            indice = REGISTROS['esp'] if indice is None else indice
+            modrm = bytes((mod | (reg << 3) | 0x04, (ESCALAS[escala] << 6) | (indice << 3) | base))
+
+    if ancho == 1:
+        return modrm + bytes((desplazamiento & 0xFF,)), ()
+    if ancho == 0:
+        return modrm, ()
+    if not (-2**31 <= desplazamiento < 2**32):
+        raise ValueError(f"Desplazamiento fuera de rango de 32 bits: {desplazamiento}")
+    bytes_dir = modrm + (desplazamiento & 0xFFFFFFFF).to_bytes(4, 'little')
+    if etiqueta is not None:
+        return bytes_dir, ((etiqueta, offset + len(modrm), 4, False),)
+    return bytes_dir, ()
+
+def compilar_codificador(codificacion, forma):
+    # Especializa una Codificacion para una forma concreta de operandos. Devuelve una
+    # función valores -> (bytes, referencias), donde cada referencia es
+    # (label, offset, ancho, relativo), sin volver a interpretar la notación por línea.
+    op_en = '' if codificacion.op_en == 'ZO' else codificacion.op_en
+    opcode = codificacion.opcode
+    ancho_imm = codificacion.ancho_imm
+
+    if 'D' in op_en:
+        # Salto o llamada: el desplazamiento relativo se deja en cero y se parchea
+        plantilla = opcode + bytes(codificacion.ancho_rel)
+        offset, ancho_rel = len(opcode), codificacion.ancho_rel
+        def codificador(valores):
+            return plantilla, ((valores[0], offset, ancho_rel, True),)
+        return codificador
+
+    if 'O' in op_en:
+        # opcode+rd: se precalcula el opcode de cada registro
+        por_registro = [(opcode[:-1] + bytes((opcode[-1] + r,)), ()) for r in range(8)]
+        if not ancho_imm:
+            def codificador(valores):
+                return por_registro[valores[0]]
+            return codificador
+        def codificador(valores):
+            return por_registro[valores[0]][0] + empacar_inmediato(valores[1], ancho_imm), ()
+        return codificador
+
+    if 'M' not in op_en:
+        fijo = (opcode, ())
+        def codificador(valores):
+            return fijo
+        return codificador
+
+    i_rm, i_reg, i_imm = op_en.index('M'), op_en.find('R'), op_en.find('I')
+    digito = codificacion.digito
+    if forma[i_rm] == 'reg':
+        # ModR/M: mod=11 (registro directo), reg, r/m
+        if i_imm < 0 and i_reg < 0:
+            # Solo /digit y un registro: se precalcula cada resultado
+            por_registro = [(opcode + bytes((0xC0 | (digito << 3) | r,)), ()) for r in range(8)]
+            def codificador(valores):
+                return por_registro[valores[i_rm]]
+            return codificador
+        if i_imm < 0:
+            def codificador(valores):
+                return opcode + bytes((0xC0 | (valores[i_reg] << 3) | valores[i_rm],)), ()
+            return codificador
+        def codificador(valores):
+            reg = digito if i_reg < 0 else valores[i_reg]
+            return (opcode + bytes((0xC0 | (reg << 3) | valores[i_rm],))
+                    + empacar_inmediato(valores[i_imm], ancho_imm)), ()
+        return codificador
+
+    etiqueta_suelta = forma[i_rm] == 'label'
+    def codificador(valores):
+        reg = digito if i_reg < 0 else valores[i_reg]
+        direccion = valores[i_rm]
+        if etiqueta_suelta:
+            direccion = Direccion(None, None, 1, 0, direccion)
+        bytes_dir, referencias = codificar_direccion(reg, direccion, len(opcode))
+        bytes_cod = opcode + bytes_dir
+        if i_imm >= 0:
+            bytes_cod += empacar_inmediato(valores[i_imm], ancho_imm)
+        return bytes_cod, referencias
+    return codificador
+
+TABLA_CODIFICACION = construir_tabla_codificacion(INSTRUCCIONES)
+CODIFICADORES = {clave: compilar_codificador(codificacion, clave[1])
+                 for clave, codificacion in TABLA_CODIFICACION.items()}
+
+# Constantes de ELF32 para Intel 386 (little endian)
+ELF_CABECERA = struct.Struct('<16sHHIIIIIHHHHHH')
+ELF_PROGRAMA = struct.Struct('<IIIIIIII')
+ELF_SECCION = struct.Struct('<IIIIIIIIII')
+ELF_SIMBOLO = struct.Struct('<IIIBBH')
+ELF_REUBICACION = struct.Struct('<II')
+ELF_IDENT = b'\x7fELF\x01\x01\x01' + bytes(9)   # 32 bits, little endian, versión 1
+ET_REL, ET_EXEC, EM_386 = 1, 2, 3
+SHT_PROGBITS, SHT_SYMTAB, SHT_STRTAB, SHT_NOBITS, SHT_REL = 1, 2, 3, 8, 9
+SHF_ALLOC_EXEC = 0x6                                 # SHF_ALLOC | SHF_EXECINSTR
+SHF_ALLOC_WRITE = 0x3                                # SHF_WRITE | SHF_ALLOC
+PT_LOAD, PF_R_X, PF_RWX = 1, 0x5, 0x7
+STT_SECTION, STB_GLOBAL = 3, 1
+R_386_32 = 1
+ALINEACION_PAGINA = 0x1000
+
+# Mapa de fuente en binario: firma, cantidad de entradas y dirección final, seguidos de
+# las direcciones y las líneas como arreglos de enteros de 32 bits little endian
+MAPA_CABECERA = struct.Struct('<4sII')
+MAPA_FIRMA = b'MAPF'
+BYTES_POR_FILA_LISTADO = 8
+
+# Saltos con forma corta (rel8) y cercana (rel32) para la relajación de saltos:
+# mnemónico -> (forma corta, forma cercana) en notación Intel
+SALTOS_RELAJABLES = {
+    'jmp': ('EB cb', 'E9 cd'),
+    'je':  ('74 cb', '0F 84 cd'),
+    'jne': ('75 cb', '0F 85 cd'),
+    'jbe': ('76 cb', '0F 86 cd'),
+    'ja':  ('77 cb', '0F 87 cd'),
+    'jae': ('73 cb', '0F 83 cd'),
+    'jl':  ('7C cb', '0F 8C cd'),
+    'jg':  ('7F cb', '0F 8F cd'),
+}
+
+# En modo relajado todo salto relajable se emite primero en su forma corta
+CODIFICADORES_RELAJADOS = dict(CODIFICADORES)
+CODIFICADORES_RELAJADOS.update(
+    ((mnem, ('label',)), compilar_codificador(traducir_notacion(corta, 'D'), ('label',)))
+    for mnem, (corta, _) in SALTOS_RELAJABLES.items())
+
+# Opcode de la forma corta -> opcode de la forma cercana
+FORMA_CERCANA = {traducir_notacion(corta, 'D').opcode[0]: traducir_notacion(cercana, 'D').opcode
+                 for corta, cercana in SALTOS_RELAJABLES.values()}
+
+# Desensamblador: entrada de la tabla de decodificación. registro es el código sumado al
+# opcode en las formas +rd (None en las demás).
+Decodificacion = namedtuple('Decodificacion', ['mnemonico', 'op_en', 'ancho_imm', 'ancho_rel', 'registro'])
+
+def construir_tabla_decodificacion(instrucciones, saltos):
+    # Invierte INSTRUCCIONES (más las formas corta y cercana de los saltos relajables) en
+    # {opcode: {dígito de ModR/M: Decodificacion}}, con el opcode como entero (0x0F84
+    # para dos bytes) y dígito None en las formas /r o sin ModR/M. Si dos formas comparten
+    # opcode y dígito (xchg reg, mem y xchg mem, reg) queda la primera: codifican igual.
+    tabla = {}
+    def agregar(opcode, digito, entrada):
+        tabla.setdefault(int.from_bytes(opcode, 'big'), {}).setdefault(digito, entrada)
+    for mnem, formas in instrucciones.items():
+        for notacion, op_en in formas.values():
+            codificacion = traducir_notacion(notacion, op_en)
+            opcode = codificacion.opcode
+            op_en = '' if op_en == 'ZO' else op_en
+            if 'O' in op_en:
+                for r in range(8):
+                    agregar(opcode[:-1] + bytes((opcode[-1] + r,)), None,
+                            Decodificacion(mnem, op_en, codificacion.ancho_imm, 0, r))
+            else:
+                agregar(opcode, codificacion.digito,
+                        Decodificacion(mnem, op_en, codificacion.ancho_imm, codificacion.ancho_rel, None))
+    for mnem, formas in saltos.items():
+        for notacion in formas:
+            codificacion = traducir_notacion(notacion, 'D')
+            agregar(codificacion.opcode, None, Decodificacion(mnem, 'D', 0, codificacion.ancho_rel, None))
+    return tabla
+
+DECODIFICACION = construir_tabla_decodificacion(INSTRUCCIONES, SALTOS_RELAJABLES)
+NOMBRES_REGISTRO = {codigo: nombre for nombre, codigo in REGISTROS.items()}
+INMEDIATOS_SIN_SIGNO = {'shr'}   # su ib es una cuenta (0..255); en los demás, ib se extiende con signo
+
+# Optimización de mirilla (-O). Cada instrucción emitida se recuerda por el índice de su
+# mnemónico en MNEMONICOS (0: línea de datos, que podría ser código y se trata como opaca)
+MNEMONICOS = ('',) + tuple(INSTRUCCIONES)
+ID_MNEMONICO = {mnem: i for i, mnem in enumerate(MNEMONICOS) if mnem}
+
+# Banderas de estado (bits de EFLAGS) para el análisis de vida: qué banderas escribe
+# siempre y cuáles lee cada mnemónico. shr con cuenta 0 no toca las banderas y div las
+# deja indefinidas, así que por prudencia no cuentan como escritura.
+CF, PF, AF, ZF, SF, OF = 0x1, 0x4, 0x10, 0x40, 0x80, 0x800
+TODAS_BANDERAS = CF | PF | AF | ZF | SF | OF
+BANDERAS_ESCRITAS = {'add': TODAS_BANDERAS, 'cmp': TODAS_BANDERAS, 'xor': TODAS_BANDERAS,
+                     'inc': TODAS_BANDERAS & ~CF, 'dec': TODAS_BANDERAS & ~CF}
+BANDERAS_LEIDAS = {'je': ZF, 'jne': ZF, 'jbe': CF | ZF, 'ja': CF | ZF, 'jae': CF,
+                   'jl': SF | OF, 'jg': ZF | SF | OF}
+
+# Reglas de la optimización de mirilla, en el orden del reporte
+REGLAS_MIRILLA = ('mov reg, 0 -> xor reg, reg', 'add reg, 1 -> inc reg', 'jmp a la instrucción siguiente')
+
+class SumasPrefijo:
+    # Árbol de Fenwick: suma de los primeros i valores en O(log n) con actualizaciones puntuales
+    def __init__(self, n):
+        self.arbol = [0] * (n + 1)
+
+    def agregar(self, i, valor):
+        i += 1
+        while i < len(self.arbol):
+            self.arbol[i] += valor
+            i += i & -i
+
+    def suma(self, i):
+        total = 0
+        while i > 0:
+            total += self.arbol[i]
+            i -= i & -i
+        return total
+
+# Resultado de ensamblar un bloque de líneas en un proceso trabajador, con direcciones
+# relativas al inicio del bloque: imagen, inicios y línea de cada inicio, tabla de símbolos
+# local, referencias a etiquetas que el bloque no define, referencias hacia adelante de
+# cada etiqueta, campos absolutos ya parcheados que hay que reubicar, mnemónico de cada
+# instrucción (solo con optimización de mirilla) y contadores del cache.
+BloqueEnsamblado = namedtuple('BloqueEnsamblado', [
+    'imagen', 'inicios', 'lineas_fuente', 'tabla_simbolos', 'referencias_pendientes', 'referencias_adelantadas',
+    'reubicaciones', 'referencias_diferidas', 'mnemonicos', 'cache_aciertos', 'cache_fallos'])
+
+def ensamblar_bloque(lineas, primera_linea, tamano_cache=TAMANO_CACHE, relajar=False, optimizar=False):
+    # Trabajador del modo paralelo: ensambla el bloque desde la dirección 0
+    ensamblador = EnsambladorIA32(tamano_cache=tamano_cache, relajar=relajar, optimizar=optimizar)
+    ensamblador.contador_posicion = ensamblador.base_imagen = 0
+    for num_linea, linea in enumerate(lineas, primera_linea):
+        ensamblador.linea_actual = num_linea
+        ensamblador.procesar_linea(linea)
+    # Las secciones .data y .bss se ensamblan en leer_expandido; si algo llegó hasta aquí,
+    # el bloque no lo puede devolver y se perdería
+    if (ensamblador.seccion != '.text' or ensamblador.datos or ensamblador.contador_bss
+            or ensamblador.simbolos_secciones or ensamblador.referencias_datos):
+        raise ValueError(f"Datos de .data o .bss dentro de un bloque de código "
+                         f"(líneas {primera_linea} a {primera_linea + len(lineas) - 1})")
+    return BloqueEnsamblado(
+        bytes(ensamblador.imagen), ensamblador.inicios, ensamblador.lineas_fuente, ensamblador.tabla_simbolos,
+        ensamblador.referencias_pendientes, ensamblador.referencias_adelantadas,
+        ensamblador.reubicaciones, ensamblador.referencias_diferidas,
+        ensamblador.optimizador.mnemonicos if optimizar else array('B'),
+        ensamblador.cache_aciertos, ensamblador.cache_fallos)
+
+class PoolEnsambladores:
+    # Pool de ensambladores reutilizables para llamar a ensamblar_codigo desde varios
+    # hilos a la vez: cada llamada toma una instancia libre (o crea una si no hay) y la
+    # devuelve al terminar, así no hay costo de construcción por llamada y cada
+    # instancia conserva su cache de codificación caliente.
+    def __init__(self, tamano_cache=TAMANO_CACHE, relajar=False, optimizar=False):
+        self.tamano_cache = tamano_cache
+        self.relajar = relajar
+        self.optimizar = optimizar
+        self.libres = queue.SimpleQueue()
+
+    def ensamblar_codigo(self, fuente, origen=0x1000):
+        try:
+            ensamblador = self.libres.get_nowait()
+        except queue.Empty:
+            ensamblador = EnsambladorIA32(tamano_cache=self.tamano_cache, relajar=self.relajar,
+                                          optimizar=self.optimizar)
+        try:
+            return ensamblador.ensamblar_codigo(fuente, origen)
+        finally:
+            self.libres.put(ensamblador)
+
+def dividir_en_bloques(lineas, promedio=LINEAS_POR_BLOQUE_INCREMENTAL):
+    # División por contenido: un bloque termina en una línea cuyo hash es múltiplo de
+    # promedio (con un mínimo y un máximo de líneas). Como el corte depende solo de las
+    # líneas, insertar o borrar una línea cambia el bloque que la contiene y los
+    # siguientes vuelven a cortarse igual. Devuelve [(primera_linea, lineas)].
+    minimo, maximo = max(1, promedio // 4), promedio * 4
+    hashes = map(zlib.crc32, map(str.encode, lineas))
+    candidatos = [i + 1 for i, h in enumerate(hashes) if h % promedio == 0]
+    candidatos.append(len(lineas))
+    cortes = []
+    inicio = 0
+    for fin in candidatos:
+        while fin - inicio > maximo:
+            inicio += maximo
+            cortes.append(inicio)
+        if fin - inicio >= minimo or fin == len(lineas):
+            cortes.append(fin)
+            inicio = fin
+    bloques = []
+    inicio = 0
+    for fin in cortes:
+        if fin > inicio:
+            bloques.append((inicio + 1, lineas[inicio:fin]))
+            inicio = fin
+    return bloques
+
+class CacheBloques:
+    # Cache en disco de bloques ya ensamblados, un archivo por bloque con el hash de su
+    # contenido como nombre. Las direcciones del bloque son relativas a su inicio y se
+    # guarda la línea donde empezaba, así que sirve en cualquier posición del archivo.
+    # Al superar tamano_maximo bytes se borran los bloques usados hace más tiempo (LRU
+    # por mtime).
+    def __init__(self, directorio, tamano_maximo=TAMANO_CACHE_DISCO):
+        self.directorio = directorio
+        self.tamano_maximo = tamano_maximo
+        os.makedirs(directorio, exist_ok=True)
+
+    def clave(self, lineas, relajar, optimizar=False):
+        # El bloque depende de su texto, de los modos de ensamblado y de la versión del formato
+        h = hashlib.sha256(f"{VERSION_CACHE_DISCO}:{sys.version_info[:2]}:{relajar}:{optimizar}\n".encode())
+        h.update('\0'.join(lineas).encode())
+        return h.hexdigest()
+
+    def ruta(self, clave):
+        return os.path.join(self.directorio, clave + '.bloque')
+
+    def cargar(self, clave):
+        # Devuelve (BloqueEnsamblado, primera línea con que se ensambló) o None
+        ruta = self.ruta(clave)
+        try:
+            with open(ruta, 'rb') as f:
+                datos = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(ruta)  # marca el bloque como usado recientemente
+        except FileNotFoundError:
+            pass  # otro proceso lo recortó después de leerlo: es solo una pista para el LRU
+        (primera_linea, imagen, inicios, lineas_fuente, tabla_simbolos, pendientes, adelantadas,
+         reubicaciones, diferidas, mnemonicos) = marshal.loads(datos)
+        return primera_linea, BloqueEnsamblado(
+            imagen, array('I', inicios), array('I', lineas_fuente), tabla_simbolos,
+            {label: [ReferenciaPendiente._make(ref) for ref in refs] for label, refs in pendientes.items()},
+            adelantadas, array('I', reubicaciones),
+            [(label, ReferenciaPendiente._make(ref)) for label, ref in diferidas],
+            array('B', mnemonicos), 0, 0)
+
+    def guardar(self, clave, bloque, primera_linea):
+        # Tipos básicos con marshal: mucho más rápido de cargar que pickle
+        datos = marshal.dumps((
+            primera_linea, bytes(bloque.imagen), bloque.inicios.tobytes(), bloque.lineas_fuente.tobytes(),
+            bloque.tabla_simbolos,
+            {label: [tuple(ref) for ref in refs] for label, refs in bloque.referencias_pendientes.items()},
+            bloque.referencias_adelantadas, bloque.reubicaciones.tobytes(),
+            [(label, tuple(ref)) for label, ref in bloque.referencias_diferidas],
+            bloque.mnemonicos.tobytes()))
+        # Escritura atómica: otro proceso nunca ve un bloque a medias
+        temporal = f"{self.ruta(clave)}.{os.getpid()}.tmp"
+        with open(temporal, 'wb') as f:
+            f.write(datos)
+        os.replace(temporal, self.ruta(clave))
+
+    def recortar(self):
+        # Borra los bloques menos usados hasta quedar dentro del tamaño máximo
+        entradas = []
+        for entrada in os.scandir(self.directorio):
+            if entrada.name.endswith('.bloque'):
+                info = entrada.stat()
+                entradas.append((info.st_mtime, info.st_size, entrada.path))
+        entradas.sort()
+        total = sum(tamano for _, tamano, _ in entradas)
+        for _, tamano, ruta in entradas:
+            if total <= self.tamano_maximo:
+                break
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+            total -= tamano
+
+class VistaCodigoHex:
+    # Vista perezosa de solo lectura con la forma histórica de codigo_hex:
+    # [(direccion, bytes), ...], una entrada por instrucción. Los bytes se copian
+    # de la imagen únicamente cuando se accede a la entrada.
+    def __init__(self, ensamblador):
+        self.ensamblador = ensamblador
+
+    def __len__(self):
+        return len(self.ensamblador.inicios)
+
+    def __getitem__(self, indice):
+        if isinstance(indice, slice):
+            return [self[i] for i in range(*indice.indices(len(self)))]
+        ens = self.ensamblador
+        inicios = ens.inicios
+        if indice < 0:
+            indice += len(inicios)
+        inicio = inicios[indice]
+        fin = inicios[indice + 1] if indice + 1 < len(inicios) else ens.contador_posicion
+        return (inicio, bytes(ens.imagen[inicio - ens.base_imagen:fin - ens.base_imagen]))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+class MapaFuente:
+    # Mapa de fuente compacto: dirección de inicio de cada instrucción o línea de datos,
+    # ordenadas, y la línea fuente de cada una, en dos array('I') paralelos. linea() busca
+    # con bisect en O(log n) sin volver a ensamblar; se guarda en binario con guardar() y
+    # se lee con cargar_mapa_fuente().
+    def __init__(self, direcciones, lineas, fin):
+        self.direcciones = direcciones
+        self.lineas = lineas
+        self.fin = fin   # dirección siguiente al último byte del programa
+
+    def __len__(self):
+        return len(self.direcciones)
+
+    def linea(self, direccion):
+        # Línea fuente que emitió el byte en direccion, o None si no es parte del programa
+        # (o es relleno entre secciones)
+        if not self.direcciones or not self.direcciones[0] <= direccion < self.fin:
+            return None
+        return self.lineas[bisect.bisect_right(self.direcciones, direccion) - 1] or None
+
+    def guardar(self, nombre_archivo):
+        direcciones, lineas = self.direcciones, self.lineas
+        if sys.byteorder == 'big':
+            direcciones, lineas = array('I', direcciones), array('I', lineas)
+            direcciones.byteswap()
+            lineas.byteswap()
+        with open(nombre_archivo, 'wb') as f:
+            f.write(MAPA_CABECERA.pack(MAPA_FIRMA, len(direcciones), self.fin))
+            f.write(direcciones.tobytes())
+            f.write(lineas.tobytes())
+
+def cargar_mapa_fuente(nombre_archivo):
+    # Lee un MapaFuente escrito por MapaFuente.guardar
+    with open(nombre_archivo, 'rb') as f:
+        datos = f.read()
+    if len(datos) < MAPA_CABECERA.size:
+        raise ValueError(f"{nombre_archivo} no es un mapa de fuente")
+    firma, cantidad, fin = MAPA_CABECERA.unpack_from(datos)
+    if firma != MAPA_FIRMA or len(datos) != MAPA_CABECERA.size + 8 * cantidad:
+        raise ValueError(f"{nombre_archivo} no es un mapa de fuente")
+    mitad = MAPA_CABECERA.size + 4 * cantidad
+    direcciones = array('I', datos[MAPA_CABECERA.size:mitad])
+    lineas = array('I', datos[mitad:])
+    if sys.byteorder == 'big':
+        direcciones.byteswap()
+        lineas.byteswap()
+    return MapaFuente(direcciones, lineas, fin)
+
+# Métodos que cuentan como fase para el colector de estadísticas (las fases anidadas,
+# como relajar_saltos dentro de resolver_referencias_pendientes, se miden por separado)
+FASES_MEDIDAS = (
+    'ensamblar', 'ensamblar_paralelo', 'ensamblar_incremental', 'ensamblar_a_archivo',
+    'resolver_referencias_pendientes', 'optimizar_mirilla', 'relajar_saltos', 'ubicar_secciones',
+    'generar_hex', 'generar_reportes', 'guardar_codigo_hex', 'guardar_tabla_simbolos',
+    'guardar_referencias_pendientes', 'guardar_binario', 'guardar_intel_hex', 'guardar_elf',
+    'guardar_desensamblado', 'guardar_listado', 'guardar_mapa')
+FASES_ENSAMBLADO = ('ensamblar', 'ensamblar_paralelo', 'ensamblar_incremental', 'ensamblar_a_archivo')
+
+class Estadisticas:
+    # Colector opcional de métricas de un EnsambladorIA32: tiempo por fase, líneas,
+    # bytes, referencias creadas y resueltas, y cuenta y tiempo por mnemónico.
+    # instalar() reemplaza métodos de la instancia por versiones medidas, así que un
+    # ensamblador sin estadísticas ejecuta exactamente el mismo código que antes.
+    # En los modos paralelo e incremental solo se cuentan las líneas e instrucciones
+    # ensambladas en este proceso (no las de los trabajadores ni las del cache en disco).
     def __init__(self):
-        self.tabla_simbolos = {}           # {label: direccion} Diccionario que guarda etiquetas y su dirección asignada.
-        self.referencias_pendientes = {}   # {label: [lista_direcciones_de_referencia]} Etiquetas usadas antes de ser definidas, con las posiciones donde se referencian.
-        self.codigo_hex = []                # lista de (direccion, [bytes]) Lista con tuplas (dirección, bytes) que representan el código máquina generado.
-        self.contador_posicion = 0x1000    # Location counter, inicia en 0x1000 Apunta a la dirección actual donde se insertará el siguiente código (inicia en 0x1000).
-
-        # Diccionario simple de registros a código (solo para mov y add simplificados)
-        self.registros = {
-            'eax': 0x00,
-            'ecx': 0x01,
-            'edx': 0x02,
-            'ebx': 0x03,
-            'esp': 0x04,
-            'ebp': 0x05,
-            'esi': 0x06,
-            'edi': 0x07
+        self.fases = {}                 # {fase: [llamadas, segundos]}
+        self.por_mnemonico = {}         # {mnemónico: [cuenta, segundos]}
+        self.reiniciar()
+
+    def reiniciar(self, direccion_inicial=0):
+        # Empieza a medir otro programa (lo llama EnsambladorIA32.reiniciar). Los diccionarios
+        # se vacían en su lugar porque los métodos medidos guardan una referencia a ellos.
+        self.fases.clear()
+        self.por_mnemonico.clear()
+        self.lineas = 0
+        self.referencias_creadas = 0
+        self.referencias_resueltas = 0
+        self.direccion_inicial = direccion_inicial
+        self.inicio = time.perf_counter()
+
+    def instalar(self, ensamblador):
+        for fase in FASES_MEDIDAS:
+            setattr(ensamblador, fase, self.medir_fase(fase, getattr(ensamblador, fase)))
+        ensamblador.procesar_linea = self.contar_lineas(ensamblador.procesar_linea)
+        ensamblador.procesar_instruccion = self.medir_instrucciones(ensamblador.procesar_instruccion)
+        ensamblador.agregar_referencia_pendiente = self.contar_referencias(ensamblador.agregar_referencia_pendiente)
+        ensamblador.parchear_referencia = self.contar_parches(ensamblador.parchear_referencia)
+
+    def medir_fase(self, fase, metodo):
+        # Las llamadas recursivas (ensamblar_a_archivo se llama a sí misma con el archivo
+        # ya abierto) cuentan dentro de la llamada externa, no como otra llamada
+        activas = [0]
+        def medido(*args, **kwargs):
+            if activas[0]:
+                return metodo(*args, **kwargs)
+            activas[0] += 1
+            inicio = time.perf_counter()
+            try:
+                return metodo(*args, **kwargs)
+            finally:
+                activas[0] -= 1
+                medida = self.fases.setdefault(fase, [0, 0.0])
+                medida[0] += 1
+                medida[1] += time.perf_counter() - inicio
+        return medido
+
+    def contar_lineas(self, metodo):
+        def contado(linea):
+            self.lineas += 1
+            metodo(linea)
+        return contado
+
+    def medir_instrucciones(self, metodo):
+        por_mnemonico = self.por_mnemonico
+        def medido(instruccion):
+            inicio = time.perf_counter()
+            metodo(instruccion)
+            tiempo = time.perf_counter() - inicio
+            mnem = instruccion.split(None, 1)[0].lower()
+            medida = por_mnemonico.get(mnem)
+            if medida is None:
+                medida = por_mnemonico[mnem] = [0, 0.0]
+            medida[0] += 1
+            medida[1] += tiempo
+        return medido
+
+    def contar_referencias(self, metodo):
+        def contado(*args):
+            self.referencias_creadas += 1
+            metodo(*args)
+        return contado
+
+    def contar_parches(self, metodo):
+        def contado(*args):
+            self.referencias_resueltas += 1
+            metodo(*args)
+        return contado
+
+    def como_dict(self, ensamblador):
+        total = time.perf_counter() - self.inicio
+        t_ensamblado = sum(self.fases[f][1] for f in FASES_ENSAMBLADO if f in self.fases) or total
+        return {
+            'segundos_totales': total,
+            'fases': {fase: {'llamadas': llamadas, 'segundos': segundos}
+                      for fase, (llamadas, segundos) in self.fases.items()},
+            'lineas': self.lineas,
+            'lineas_por_segundo': self.lineas / t_ensamblado if t_ensamblado else 0.0,
+            'bytes_emitidos': ensamblador.contador_posicion - self.direccion_inicial,
+            'referencias': {'creadas': self.referencias_creadas,
+                            'resueltas': self.referencias_resueltas,
+                            'abiertas': ensamblador.referencias_abiertas()},
+            'mnemonicos': {mnem: {'cuenta': cuenta, 'segundos': segundos}
+                           for mnem, (cuenta, segundos) in sorted(self.por_mnemonico.items())},
+            'cache': ensamblador.estadisticas_cache(),
         }
 
-    def ensamblar(self, archivo_entrada):
-        with open(archivo_entrada, 'r') as f:
-            lineas = f.readlines()
+class OptimizadorMirilla:
+    # Optimización de mirilla opcional (-O) sobre las instrucciones ya emitidas: mov reg, 0
+    # pasa a xor reg, reg y add reg, 1 a inc reg cuando las banderas que cambian no se
+    # usan después, y se borra todo jmp a la instrucción siguiente. Como instalar() solo
+    # envuelve procesar_instruccion para recordar el mnemónico de cada instrucción, un
+    # ensamblador sin -O ejecuta exactamente el mismo código que antes.
+    def __init__(self):
+        self.reiniciar()
+
+    def reiniciar(self):
+        self.mnemonicos = array('B')    # Índice en MNEMONICOS de cada entrada de inicios.
+        self.ahorro = {regla: [0, 0] for regla in REGLAS_MIRILLA}  # {regla: [veces, bytes ahorrados]}
+
+    def instalar(self, ensamblador):
+        ensamblador.procesar_instruccion = self.registrar_mnemonicos(ensamblador, ensamblador.procesar_instruccion)
+
+    def registrar_mnemonicos(self, ensamblador, metodo):
+        def registrado(instruccion):
+            n = len(ensamblador.inicios)
+            metodo(instruccion)
+            if len(ensamblador.inicios) > n:
+                self.mnemonicos.append(ID_MNEMONICO.get(instruccion.split(None, 1)[0].lower(), 0))
+        return registrado
+
+    def contar(self, regla, bytes_ahorrados):
+        ahorro = self.ahorro[REGLAS_MIRILLA[regla]]
+        ahorro[0] += 1
+        ahorro[1] += bytes_ahorrados
+
+    def bytes_ahorrados(self):
+        return sum(bytes_ for _, bytes_ in self.ahorro.values())
+
+    def aplicar(self, ensamblador):
+        # Se llama con las referencias todavía diferidas. Recorre las instrucciones de atrás
+        # hacia adelante llevando las banderas vivas (que se leen antes de volver a
+        # escribirse) y reconstruye la imagen una sola vez con los cambios: O(n). Tras call,
+        # ret, datos y saltos hacia atrás o sin destino conocido se suponen todas vivas.
+        inicios = ensamblador.inicios
+        imagen = ensamblador.imagen
+        base = ensamblador.base_imagen
+        tabla = ensamblador.tabla_simbolos
+        mnemonicos = self.mnemonicos
+        xor = ensamblador.codificadores[('xor', ('reg', 'reg'))]
+        inc = ensamblador.codificadores[('inc', ('reg',))]
+
+        # Etiqueta de cada salto por la dirección donde termina su campo, que es también
+        # donde termina la instrucción
+        destinos = {ref.direccion + ref.ancho: label
+                    for label, ref in ensamblador.referencias_diferidas if ref.relativo}
+        etiquetadas = set(tabla.values())
+        vivas_en = {}   # {direccion etiquetada: banderas vivas al llegar a ella}
+
+        ediciones = []
+        vivas = TODAS_BANDERAS  # no se sabe qué viene después del código
+        fin = ensamblador.contador_posicion
+        for i in range(len(inicios) - 1, -1, -1):
+            inicio = inicios[i]
+            mnem = MNEMONICOS[mnemonicos[i]]
+            p = inicio - base
+            if mnem == 'jmp' or mnem in BANDERAS_LEIDAS:
+                destino = tabla.get(destinos.get(fin))
+                if mnem == 'jmp' and destino == fin:
+                    ediciones.append((inicio, fin - inicio, b'', None))
+                    self.contar(2, fin - inicio)
+                else:
+                    # Solo los destinos hacia adelante ya están calculados
+                    en_destino = vivas_en.get(destino, TODAS_BANDERAS)
+                    vivas = en_destino if mnem == 'jmp' else vivas | en_destino | BANDERAS_LEIDAS[mnem]
+            elif mnem == 'call' or mnem == 'ret' or not mnem:
+                vivas = TODAS_BANDERAS
+            else:
+                if mnem == 'mov' and not vivas and fin - inicio == 5 and 0xB8 <= imagen[p] <= 0xBF \
+                        and imagen[p + 1:p + 5] == b'\0\0\0\0':
+                    # xor escribe todas las banderas y mov ninguna
+                    reg = imagen[p] - 0xB8
+                    nuevos = xor((reg, reg))[0]
+                    ediciones.append((inicio, 5, nuevos, None))
+                    self.contar(0, 5 - len(nuevos))
+                elif mnem == 'add' and not vivas & CF and fin - inicio == 3 and imagen[p] == 0x83 \
+                        and imagen[p + 1] >> 3 == 0x18 and imagen[p + 2] == 1:
+                    # inc deja CF como estaba; las demás banderas quedan igual que con add
+                    nuevos = inc((imagen[p + 1] & 7,))[0]
+                    ediciones.append((inicio, 3, nuevos, None))
+                    self.contar(1, 3 - len(nuevos))
+                vivas &= ~BANDERAS_ESCRITAS.get(mnem, 0)
+            if inicio in etiquetadas:
+                vivas_en[inicio] = vivas
+            fin = inicio
+
+        if ediciones:
+            ediciones.reverse()
+            ensamblador.reconstruir_imagen(ediciones)
+        self.mnemonicos = array('B')
+
+def decodificar_modrm(codigo, p):
+    # Operando r/m a partir del byte ModR/M en codigo[p] (inverso de codificar_direccion).
+    # Devuelve (campo reg, operando, posición siguiente, posición del disp32 o None).
+    modrm = codigo[p]
+    mod, reg, rm = modrm >> 6, (modrm >> 3) & 7, modrm & 7
+    p += 1
+    if mod == 3:
+        return reg, ('reg', rm), p, None
+    base, indice, escala = rm, None, 1
+    if rm == 4:
+        sib = codigo[p]
+        p += 1
+        base, indice = sib & 7, (sib >> 3) & 7
+        if indice == 4:
+            indice = None   # índice 100: sin índice ([esp])
+        else:
+            escala = 1 << (sib >> 6)
+    if base == 5 and mod == 0:
+        base = None         # mod=00 con base 101: disp32 sin base
+    if mod == 1:
+        return reg, ('mem', Direccion(base, indice, escala, struct.unpack_from('<b', codigo, p)[0], None)), p + 1, None
+    if mod == 2 or base is None:
+        return reg, ('mem', Direccion(base, indice, escala, struct.unpack_from('<i', codigo, p)[0], None)), p + 4, p
+    return reg, ('mem', Direccion(base, indice, escala, 0, None)), p, None
+
+def decodificar_instruccion(codigo, posicion, direccion):
+    # Decodifica la instrucción que empieza en codigo[posicion], ubicada en direccion.
+    # Devuelve (largo, mnemónico, operandos, campo) con operandos ('reg', código),
+    # ('imm', valor), ('mem', Direccion) o ('rel', destino) y campo la dirección del
+    # disp32 de un operando de memoria (None si no hay), o None si no es una instrucción
+    # conocida o está cortada.
+    try:
+        p = posicion
+        opcode = codigo[p]
+        p += 1
+        if opcode == 0x0F:
+            opcode = 0x0F00 | codigo[p]
+            p += 1
+        entradas = DECODIFICACION.get(opcode)
+        if entradas is None:
+            return None
+        entrada = entradas.get(None) or entradas.get((codigo[p] >> 3) & 7)
+        if entrada is None:
+            return None
+
+        op_en = entrada.op_en
+        campo = None
+        if op_en == 'D':
+            if entrada.ancho_rel == 1:
+                rel = struct.unpack_from('<b', codigo, p)[0]
+            else:
+                rel = struct.unpack_from('<i', codigo, p)[0]
+            p += entrada.ancho_rel
+            return p - posicion, entrada.mnemonico, [('rel', direccion + p - posicion + rel)], None
+        if 'M' in op_en:
+            reg, rm, p, posicion_disp = decodificar_modrm(codigo, p)
+            if posicion_disp is not None:
+                campo = direccion + posicion_disp - posicion
+        if entrada.ancho_imm == 1:
+            formato = '<B' if entrada.mnemonico in INMEDIATOS_SIN_SIGNO else '<b'
+            imm = ('imm', struct.unpack_from(formato, codigo, p)[0])
+        elif entrada.ancho_imm == 4:
+            imm = ('imm', struct.unpack_from('<i', codigo, p)[0])
+        if len(codigo) < p + entrada.ancho_imm:
+            return None
+        p += entrada.ancho_imm
+    except (IndexError, struct.error):
+        return None
+
+    if 'O' in op_en:
+        operandos = [('reg', entrada.registro)]
+    elif op_en == 'MR':
+        operandos = [rm, ('reg', reg)]
+    elif op_en == 'RM':
+        operandos = [('reg', reg), rm]
+    elif 'M' in op_en:
+        operandos = [rm]
+    else:
+        operandos = []
+    if entrada.ancho_imm:
+        operandos.append(imm)
+    return p - posicion, entrada.mnemonico, operandos, campo
 
-        for linea in lineas:
+class Desensamblador:
+    # Desensamblador guiado por las mismas tablas que el ensamblador (ver DECODIFICACION).
+    # Devuelve texto que este ensamblador acepta, con los nombres de tabla_simbolos en los
+    # destinos de saltos y llamadas y en los campos absolutos que vinieron de una etiqueta
+    # (los de reubicaciones), como etiqueta o etiqueta+desplazamiento.
+    def __init__(self, simbolos=None, reubicaciones=()):
+        self.nombres = {}   # {direccion: primera etiqueta con esa dirección}
+        for etiqueta, direccion in (simbolos or {}).items():
+            self.nombres.setdefault(direccion, etiqueta)
+        self.direcciones = sorted(self.nombres)
+        self.reubicaciones = set(reubicaciones)
+
+    def desensamblar(self, codigo, origen=0x1000, inicios=None, fin=None):
+        # Generador: (direccion, bytes, texto) de cada instrucción hasta fin (por defecto
+        # el final del código). Con inicios (como EnsambladorIA32.inicios) cada entrada se
+        # decodifica dentro de sus propios límites y la que no es exactamente una
+        # instrucción (datos en .text) sale como db; sin ellos el código se recorre de
+        # corrido y cada byte desconocido sale como db.
+        fin = len(codigo) if fin is None else fin - origen
+        if inicios is None:
+            p = 0
+            while p < fin:
+                decodificada = decodificar_instruccion(codigo, p, origen + p)
+                if decodificada is None or p + decodificada[0] > fin:
+                    yield origen + p, bytes(codigo[p:p + 1]), formatear_datos(codigo[p:p + 1])
+                    p += 1
+                    continue
+                largo, mnem, operandos, campo = decodificada
+                yield origen + p, bytes(codigo[p:p + largo]), self.formatear(mnem, operandos, campo)
+                p += largo
+            return
+
+        n = len(inicios)
+        for i in range(n):
+            p = inicios[i] - origen
+            if p >= fin:
+                break
+            siguiente = min(inicios[i + 1] - origen, fin) if i + 1 < n else fin
+            if siguiente == p:
+                continue
+            decodificada = decodificar_instruccion(codigo, p, origen + p)
+            if decodificada is None or decodificada[0] != siguiente - p:
+                yield origen + p, bytes(codigo[p:siguiente]), formatear_datos(codigo[p:siguiente])
+            else:
+                largo, mnem, operandos, campo = decodificada
+                yield origen + p, bytes(codigo[p:siguiente]), self.formatear(mnem, operandos, campo)
+
+    def nombre(self, direccion):
+        # Etiqueta de la dirección, o etiqueta+desplazamiento de la anterior más cercana
+        i = bisect.bisect_right(self.direcciones, direccion) - 1
+        if i < 0:
+            return None
+        anterior = self.direcciones[i]
+        etiqueta = self.nombres[anterior]
+        return etiqueta if anterior == direccion else f"{etiqueta}+{direccion - anterior}"
+
+    def formatear(self, mnem, operandos, campo=None):
+        if not operandos:
+            return mnem
+        return f"{mnem} {', '.join(self.formatear_operando(op, campo) for op in operandos)}"
+
+    def formatear_operando(self, operando, campo):
+        clase, valor = operando
+        if clase == 'reg':
+            return NOMBRES_REGISTRO[valor]
+        if clase == 'imm':
+            return formatear_numero(valor)
+        if clase == 'rel':
+            return self.nombres.get(valor) or f"0x{valor:X}"
+        return self.formatear_direccion(valor, campo in self.reubicaciones)
+
+    def formatear_direccion(self, direccion, con_etiqueta):
+        partes = []
+        if direccion.base is not None:
+            partes.append(NOMBRES_REGISTRO[direccion.base])
+        if direccion.indice is not None:
+            indice = NOMBRES_REGISTRO[direccion.indice]
+            partes.append(indice if direccion.escala == 1 else f"{indice}*{direccion.escala}")
+        desplazamiento = direccion.desplazamiento
+        nombre = self.nombre(desplazamiento & 0xFFFFFFFF) if con_etiqueta else None
+        if nombre is not None:
+            partes.append(nombre)
+        elif not partes:
+            partes.append(f"0x{desplazamiento & 0xFFFFFFFF:X}")
+        elif desplazamiento:
+            return f"[{'+'.join(partes)}{desplazamiento:+d}]"
+        return f"[{'+'.join(partes)}]"
+
+def formatear_numero(valor):
+    # Decimal si es chico; si no, hexadecimal sin signo de 32 bits
+    if -0x10000 < valor < 0x10000:
+        return str(valor)
+    return f"0x{valor & 0xFFFFFFFF:X}"
+
+def formatear_datos(bytes_):
+    return 'db ' + ', '.join(f"0x{b:02X}" for b in bytes_)
+
+class Preprocesador:
+    # Etapa perezosa entre la lectura y procesar_linea: recibe (num_linea, linea) y
+    # entrega las líneas ya expandidas, una por una, sin guardar el texto expandido.
+    #   NOMBRE equ expr  /  %define NOMBRE valor    constantes (expr se pliega al definir)
+    #   %macro nombre n ... %endmacro                 macro con parámetros %1..%n y
+    #                                                 etiquetas locales %%etiqueta
+    #   %rep n ... %endrep  /  times n instrucción    repeticiones
+    # Las líneas expandidas conservan el número de la línea que las generó.
+    def __init__(self):
+        self.constantes = {}     # {nombre: texto del valor, ya plegado si es numérico}
+        self.macros = {}         # {nombre: (num_parametros, [(num_linea, linea), ...])}
+        self.expansiones = 0     # contador para hacer únicas las etiquetas %% de cada expansión
+        # Memorias de lo ya calculado (un %rep repite las mismas líneas miles de veces):
+        # línea -> línea sustituida, y (macro, argumentos) -> cuerpo expandido de las
+        # macros sin etiquetas locales. Se vacían al definir una constante nueva.
+        self.sustituidas = {}
+        self.cuerpos = {}
+        self.en_expansion = set()  # constantes que se están evaluando (para detectar ciclos)
+
+    def expandir(self, lineas, profundidad=0):
+        lineas = iter(lineas)
+        constantes, macros = self.constantes, self.macros
+        for numerada in lineas:
+            num_linea, linea = numerada
+            # Filtro barato antes de la expresión regular: casi ninguna línea es directiva
+            # (las palabras clave se aceptan en minúsculas o en mayúsculas)
+            directiva = None
+            if '%' in linea or 'equ' in linea or 'times' in linea or 'EQU' in linea or 'TIMES' in linea:
+                directiva = DIRECTIVA.match(linea)
+            if directiva is None:
+                if not constantes and not macros:
+                    yield numerada  # camino rápido: sin constantes ni macros definidas
+                    continue
+                if ';' in linea:
+                    linea = quitar_comentario(linea)
+                partes = linea.split(None, 1)
+                if partes and partes[0] in macros:
+                    yield from self.expandir_macro(num_linea, partes[0], partes[1] if len(partes) > 1 else '',
+                                                   profundidad)
+                    continue
+                yield num_linea, self.sustituir(linea, num_linea)
+                continue
+
+            if ';' in linea:
+                linea = quitar_comentario(linea)
+            nombre, times, constante, _ = directiva.groups()
+            resto = linea[directiva.end():].strip()
+            if constante is not None:
+                self.definir(constante, resto, num_linea)
+            elif times is not None:
+                veces, instruccion = self.separar_cuenta(resto, num_linea)
+                cuerpo = [(num_linea, instruccion)]
+                for _ in range(veces):
+                    yield from self.expandir(cuerpo, profundidad)
+            else:
+                nombre = nombre.lower()
+                if nombre == '%define':
+                    partes = resto.split(None, 1)
+                    if not partes:
+                        raise ValueError(f"%define sin nombre (línea {num_linea})")
+                    self.definir(partes[0], partes[1] if len(partes) > 1 else '', num_linea)
+                elif nombre == '%macro':
+                    partes = resto.split()
+                    if len(partes) != 2 or not partes[1].isdigit():
+                        raise ValueError(f"Se esperaba %macro nombre num_parametros (línea {num_linea})")
+                    self.macros[partes[0]] = (int(partes[1]), self.leer_cuerpo(lineas, '%macro', '%endmacro', num_linea))
+                elif nombre == '%rep':
+                    veces = self.evaluar_cuenta(resto, num_linea)
+                    cuerpo = self.leer_cuerpo(lineas, '%rep', '%endrep', num_linea)
+                    for _ in range(veces if cuerpo else 0):
+                        yield from self.expandir(cuerpo, profundidad)
+                elif nombre in ('%endmacro', '%endrep'):
+                    raise ValueError(f"{nombre} sin apertura (línea {num_linea})")
+                else:
+                    raise NotImplementedError(f"Directiva {nombre} no soportada aún (línea {num_linea})")
+
+    def leer_cuerpo(self, lineas, apertura, cierre, num_linea):
+        # Consume las líneas hasta el cierre correspondiente (admite anidación)
+        cuerpo = []
+        nivel = 1
+        for numerada in lineas:
+            directiva = DIRECTIVA.match(numerada[1])
+            if directiva is not None and directiva.group(1):
+                nombre = directiva.group(1).lower()
+                if nombre == apertura:
+                    nivel += 1
+                elif nombre == cierre:
+                    nivel -= 1
+                    if nivel == 0:
+                        return cuerpo
+            cuerpo.append(numerada)
+        raise ValueError(f"{apertura} sin {cierre} (línea {num_linea})")
+
+    def expandir_macro(self, num_linea, nombre, argumentos, profundidad):
+        if profundidad >= PROFUNDIDAD_MAXIMA_MACROS:
+            raise ValueError(f"Expansión de macros demasiado profunda en {nombre} (línea {num_linea})")
+        num_parametros, cuerpo = self.macros[nombre]
+        expandido = self.cuerpos.get((nombre, argumentos))
+        if expandido is not None:
+            yield from self.expandir([(num_linea, linea) for linea in expandido], profundidad + 1)
+            return
+        valores = self.separar_argumentos(argumentos)
+        if len(valores) != num_parametros:
+            raise ValueError(f"La macro {nombre} espera {num_parametros} argumentos "
+                             f"y recibió {len(valores)} (línea {num_linea})")
+        self.expansiones += 1
+        local = f"..@{self.expansiones}."
+
+        def parametro(m):
+            indice = int(m.group(1))
+            if not 1 <= indice <= num_parametros:
+                raise ValueError(f"Parámetro %{indice} fuera de rango en la macro {nombre} (línea {num_linea})")
+            return valores[indice - 1]
+
+        # Las líneas del cuerpo toman el número de la línea que invoca la macro
+        expandido = [PARAMETRO_MACRO.sub(parametro, linea.replace('%%', local)) for _, linea in cuerpo]
+        if not any('%%' in linea for _, linea in cuerpo) and len(self.cuerpos) < TAMANO_CACHE:
+            self.cuerpos[(nombre, argumentos)] = expandido
+        yield from self.expandir([(num_linea, linea) for linea in expandido], profundidad + 1)
+
+    def separar_argumentos(self, texto):
+        # Separa por comas que no estén dentro de [ ], ( ) ni de una cadena
+        if not texto.strip():
+            return []
+        argumentos, actual, nivel, comilla = [], [], 0, None
+        for caracter in texto:
+            if comilla is not None:
+                if caracter == comilla:
+                    comilla = None
+            elif caracter in '\'"':
+                comilla = caracter
+            elif caracter in '[(':
+                nivel += 1
+            elif caracter in '])':
+                nivel -= 1
+            elif caracter == ',' and nivel == 0:
+                argumentos.append(''.join(actual).strip())
+                actual = []
+                continue
+            actual.append(caracter)
+        argumentos.append(''.join(actual).strip())
+        return argumentos
+
+    def definir(self, nombre, valor, num_linea):
+        # Pliega la constante una sola vez: si es una expresión numérica se guarda su
+        # valor; si no (p. ej. un registro), el texto con las constantes ya sustituidas
+        if nombre in self.constantes:
+            raise ValueError(f"Constante {nombre} redefinida (línea {num_linea})")
+        numero = self.evaluar(valor, num_linea)
+        self.sustituidas.clear()
+        self.cuerpos.clear()
+        self.constantes[nombre] = self.reemplazar_constantes(valor.strip()) if numero is None else str(numero)
+        if numero is None:
+            # Un texto que nombra constantes aún sin definir se evalúa al usarlo; si forma
+            # un ciclo (%define A A, o A -> B -> A) se informa aquí, no en cada uso
+            self.evaluar(nombre, num_linea)
+
+    def separar_cuenta(self, texto, num_linea):
+        # "n instrucción" de times, donde n es un número, una constante o una expresión
+        # sin espacios
+        partes = texto.split(None, 1)
+        if len(partes) != 2:
+            raise ValueError(f"Se esperaba times cuenta instrucción (línea {num_linea})")
+        return self.evaluar_cuenta(partes[0], num_linea), partes[1]
+
+    def evaluar_cuenta(self, texto, num_linea):
+        veces = self.evaluar(texto, num_linea)
+        if veces is None or veces < 0:
+            raise ValueError(f"Cuenta de repetición inválida: {texto} (línea {num_linea})")
+        if veces > REPETICIONES_MAXIMAS:
+            raise ValueError(f"Cuenta de repetición demasiado grande: {texto} (máximo {REPETICIONES_MAXIMAS}) "
+                             f"(línea {num_linea})")
+        return veces
+
+    def sustituir(self, linea, num_linea):
+        # Reemplaza las constantes por su valor y pliega los operandos que quedan como
+        # expresiones numéricas (p. ej. "mov eax, TAM*4" -> "mov eax, 16")
+        if not self.constantes:
+            return linea
+        sustituida = self.sustituidas.get(linea)
+        if sustituida is None:
+            sustituida = self.sustituir_operandos(self.reemplazar_constantes(linea), num_linea)
+            if len(self.sustituidas) >= TAMANO_CACHE:
+                self.sustituidas.clear()
+            self.sustituidas[linea] = sustituida
+        return sustituida
+
+    def sustituir_operandos(self, linea, num_linea):
+        partes = linea.split(None, 1)
+        if len(partes) < 2 or partes[0].endswith(':'):
+            return linea
+        operandos = []
+        for operando in self.separar_argumentos(partes[1]):
+            if operando[:1] not in '[\'"' and not operando.lower() in REGISTROS:
+                numero = self.evaluar(operando, num_linea)
+                if numero is not None:
+                    operando = str(numero)
+            operandos.append(operando)
+        return f"{partes[0]} {', '.join(operandos)}"
+
+    def reemplazar_constantes(self, texto):
+        constantes = self.constantes
+        return IDENTIFICADOR.sub(lambda m: constantes.get(m.group(), m.group()), texto)
+
+    def evaluar(self, texto, num_linea):
+        # Valor entero de una expresión constante, o None si no lo es. Un valor de más de
+        # BITS_MAXIMOS_EXPRESION bits es un error (con num_linea para el mensaje).
+        try:
+            arbol = ast.parse(texto.strip(), mode='eval')
+        except SyntaxError:
+            return None
+        return self.evaluar_nodo(arbol.body, texto, num_linea)
+
+    def evaluar_nodo(self, nodo, texto, num_linea):
+        if isinstance(nodo, ast.Constant) and type(nodo.value) is int:
+            valor = nodo.value
+        elif isinstance(nodo, ast.Name) and nodo.id in self.constantes:
+            if nodo.id in self.en_expansion:
+                raise ValueError(f"Constante {nodo.id} definida en términos de sí misma (línea {num_linea})")
+            self.en_expansion.add(nodo.id)
+            try:
+                return self.evaluar(self.constantes[nodo.id], num_linea)
+            finally:
+                self.en_expansion.discard(nodo.id)
+        elif isinstance(nodo, ast.BinOp) and type(nodo.op) in OPERADORES_BINARIOS:
+            izquierda = self.evaluar_nodo(nodo.left, texto, num_linea)
+            derecha = self.evaluar_nodo(nodo.right, texto, num_linea)
+            if izquierda is None or derecha is None:
+                return None
+            if type(nodo.op) is ast.LShift and derecha > BITS_MAXIMOS_EXPRESION:
+                valor = 1 << (BITS_MAXIMOS_EXPRESION + 1)  # fuera de rango, sin calcularlo
+            else:
+                try:
+                    valor = OPERADORES_BINARIOS[type(nodo.op)](izquierda, derecha)
+                except (ZeroDivisionError, ValueError):
+                    return None
+        elif isinstance(nodo, ast.UnaryOp) and type(nodo.op) in OPERADORES_UNARIOS:
+            operando = self.evaluar_nodo(nodo.operand, texto, num_linea)
+            if operando is None:
+                return None
+            valor = OPERADORES_UNARIOS[type(nodo.op)](operando)
+        else:
+            return None
+        if valor.bit_length() > BITS_MAXIMOS_EXPRESION:
+            raise ValueError(f"Valor fuera de rango en {texto.strip()}: más de {BITS_MAXIMOS_EXPRESION} bits "
+                             f"(línea {num_linea})")
+        return valor
+
+# Resultado de ensamblar_codigo: código máquina (y .data) desde origen, tabla de símbolos,
+# direcciones de los campos absolutos (a corregir si el código se carga en otra dirección)
+# y bytes de .bss, que van en cero a continuación del código alineados (ver ubicar_secciones)
+ResultadoEnsamblado = namedtuple('ResultadoEnsamblado', ['codigo', 'origen', 'simbolos', 'reubicaciones', 'tamano_bss'])
+
+class EnsambladorIA32:
+    def __init__(self, tamano_cache=TAMANO_CACHE, relajar=False, estadisticas=False, optimizar=False):
+        # Relajación de saltos: jmp/jcc se emiten cortos y resolver_referencias_pendientes
+        # elige la forma más pequeña que alcanza. Las referencias se difieren hasta entonces.
+        self.relajar = relajar
+        self.codificadores = CODIFICADORES_RELAJADOS if relajar else CODIFICADORES
+
+        # Optimización de mirilla (desactivada por defecto, ver OptimizadorMirilla); también
+        # difiere las referencias, porque cambia el largo de las instrucciones
+        self.optimizador = None
+        if optimizar:
+            self.optimizador = OptimizadorMirilla()
+            self.optimizador.instalar(self)
+
+        # Colector de estadísticas (desactivado por defecto, ver Estadisticas)
+        self.medidor = None
+        if estadisticas:
+            self.medidor = Estadisticas()
+            self.medidor.instalar(self)
+
+        # Estado de un programa (ver reiniciar). Las tablas de codificación son globales e
+        # inmutables; lo único que se conserva entre programas es el cache de codificación.
+        self.reiniciar()
+
+        # Diccionario de registros a código (compartido, ver REGISTROS)
+        self.registros = REGISTROS
+
+        # Cache LRU de codificación: texto de la instrucción -> (bytes, ()). Solo guarda
+        # instrucciones sin etiquetas; las que usan etiquetas (saltos, call, [tabla+...])
+        # nunca se guardan ni cuentan como aciertos. Se suspende solo si no acierta (ver
+        # revisar_cache).
+        self.cache_codificacion = OrderedDict()
+        self.tamano_cache = tamano_cache
+        self.cache_aciertos = 0
+        self.cache_fallos = 0
+        self.guardar_en_cache = tamano_cache > 0
+        self.revision_cache = VENTANA_CACHE if tamano_cache > 0 else float('inf')  # Fallos en los que se revisa la tasa de aciertos.
+        self.aciertos_revision = self.fallos_revision = 0                         # Contadores en la revisión anterior.
+
+    def reiniciar(self, origen=0x1000):
+        # Deja el ensamblador listo para otro programa que empieza en origen, sin volver
+        # a construirlo: mucho más barato que crear una instancia nueva por programa.
+        self.tabla_simbolos = {}           # {label: direccion} Diccionario que guarda etiquetas y su dirección asignada.
+        self.referencias_pendientes = {}   # {label: [ReferenciaPendiente, ...]} Etiquetas usadas antes de ser definidas, con los campos que hay que parchear.
+        self.num_referencias_abiertas = 0  # Total de referencias en referencias_pendientes (aún sin parchear).
+        self.referencias_adelantadas = {}  # {label: [direccion, ...]} Referencias hacia adelante de cada etiqueta (para el reporte).
+        self.contador_posicion = origen    # Location counter: apunta a la dirección actual donde se insertará el siguiente código (inicia en origen, 0x1000 por defecto).
+        self.imagen = bytearray()          # Código máquina generado, contiguo desde base_imagen.
+        self.base_imagen = self.contador_posicion  # Dirección del primer byte de imagen.
+        self.inicios = array('I')          # Dirección de inicio de cada instrucción (para el listado por línea).
+        self.lineas_fuente = array('I')    # Línea fuente de cada entrada de inicios (0 = relleno entre secciones).
+        self.numeros_originales = None     # Modos por bloques con directivas: línea del archivo de cada línea expandida.
+        self.linea_actual = 0              # Número de línea fuente que se está procesando (para reportar errores).
+        self.bloques_reutilizados = 0      # Modo incremental: bloques tomados del cache en disco.
+        self.bloques_ensamblados = 0       # Modo incremental: bloques que hubo que ensamblar.
+        self.reubicaciones = array('I')    # Campos absolutos ya parcheados (para reubicar bloques y para el ELF reubicable).
+
+        # Estado del modo flujo: lo ya entregado se descarta del inicio de imagen e inicios
+        self.instrucciones_entregadas = 0  # Instrucciones de inicios ya entregadas al consumidor.
+        self.campos_abiertos = set()       # Direcciones de campos aún sin parchear.
+        self.anotar_adelantadas = True     # Si se anotan las referencias adelantadas (en flujo, solo con volcado).
+        self.anotar_reubicaciones = True   # Si se anotan los campos absolutos (en flujo no, nadie los lee).
+        self.volcado_referencias = None    # Archivo donde el modo flujo vuelca las adelantadas de cada etiqueta al definirla.
+        self.heap_campos_abiertos = []     # Heap con esas direcciones (puede tener entradas ya cerradas).
+
+        self.referencias_diferidas = []    # [(label, ReferenciaPendiente)] en modo relajado u optimizado.
+        self.direcciones_provisionales = self.relajar or self.optimizador is not None  # Hasta parchear_diferidas las direcciones de .text no son definitivas.
+        self.saltos_relajados = (0, 0)     # (cortos, cercanos) tras relajar_saltos.
+
+        # Secciones: el código de .text va directo a imagen (contador_posicion es su location
+        # counter); .data se acumula aparte y .bss solo cuenta bytes. Como en una pasada no se
+        # sabe dónde termina .text, ambas se ubican al final, en ubicar_secciones.
+        self.seccion = '.text'             # Sección activa.
+        self.datos = bytearray()           # Contenido de .data, desde el desplazamiento 0.
+        self.inicios_datos = array('I')    # Desplazamiento en .data de cada línea de datos.
+        self.lineas_datos = array('I')     # Línea fuente de cada entrada de inicios_datos.
+        self.contador_bss = 0              # Location counter de .bss (no ocupa lugar en la imagen).
+        self.alineaciones = {'.data': ALINEACION_SECCIONES, '.bss': ALINEACION_SECCIONES}  # Mayor align pedido en cada sección.
+        self.simbolos_secciones = {}       # {label: (seccion, desplazamiento)} Etiquetas de .data y .bss.
+        self.referencias_datos = []        # [(label, desplazamiento, linea)] Campos de .data que apuntan a etiquetas.
+        self.secciones = None              # {seccion: (inicio, fin)} una vez ubicadas.
+        self.preprocesador = Preprocesador()  # Constantes y macros definidas hasta ahora.
+        if self.optimizador is not None:
+            self.optimizador.reiniciar()
+        if self.medidor is not None:
+            self.medidor.reiniciar(self.contador_posicion)
+
+    def ensamblar_codigo(self, fuente, origen=0x1000):
+        # API en memoria: ensambla un programa completo (texto o iterable de líneas) que
+        # empieza en origen y devuelve un ResultadoEnsamblado, sin tocar el disco. Cada
+        # llamada reinicia el estado, así que la instancia se puede reutilizar, pero no
+        # compartir entre hilos a la vez (para eso está PoolEnsambladores).
+        self.reiniciar(origen)
+        if isinstance(fuente, str):
+            fuente = fuente.splitlines()
+        for num_linea, linea in self.preprocesador.expandir(enumerate(fuente, 1)):
+            self.linea_actual = num_linea
             self.procesar_linea(linea)
+        self.resolver_referencias_pendientes()
+        return ResultadoEnsamblado(bytes(self.imagen), origen, self.tabla_simbolos, self.reubicaciones,
+                                   self.contador_bss)
+
+    def ensamblar(self, archivo_entrada):
+        with open(archivo_entrada, 'r') as f:
+            for num_linea, linea in self.preprocesador.expandir(enumerate(f, 1)):
+                self.linea_actual = num_linea
+                self.procesar_linea(linea)
 
         #Impresión en pantalla para probar funcionamiento
         # print("=== Tabla de símbolos ===")
@@ -49,413 +1430,911 @@ class EnsambladorIA32:
         #     print(f"{hex(direccion)}: {bytes_hex}")
 
 
+    def ensamblar_paralelo(self, archivo_entrada, trabajadores=None, lineas_por_bloque=None):
+        # Divide el archivo en bloques de líneas que se ensamblan en procesos separados
+        # con direcciones relativas al bloque, y luego los enlaza en orden: reubica cada
+        # bloque a contador_posicion, une las tablas de símbolos y resuelve las
+        # referencias entre bloques. El resultado es idéntico al ensamblado en serie.
+        lineas = self.leer_expandido(archivo_entrada)
+        trabajadores = trabajadores or os.cpu_count() or 1
+        if lineas_por_bloque is None:
+            # Algunos bloques por trabajador para repartir mejor la carga
+            lineas_por_bloque = max(1, -(-len(lineas) // (trabajadores * 4)))
+        inicios_bloque = range(0, len(lineas), lineas_por_bloque)
+
+        with ProcessPoolExecutor(max_workers=trabajadores) as executor:
+            bloques = executor.map(
+                ensamblar_bloque,
+                [lineas[i:i + lineas_por_bloque] for i in inicios_bloque],
+                [i + 1 for i in inicios_bloque],
+                itertools.repeat(self.tamano_cache),
+                itertools.repeat(self.relajar),
+                itertools.repeat(self.optimizador is not None))
+            for bloque in bloques:
+                self.enlazar_bloque(bloque)
+
+    def ensamblar_incremental(self, archivo_entrada, directorio_cache,
+                              tamano_maximo=TAMANO_CACHE_DISCO, lineas_por_bloque=LINEAS_POR_BLOQUE_INCREMENTAL):
+        # Como ensamblar, pero reutiliza del cache en disco los bloques cuyo texto no
+        # cambió desde la última vez; solo los bloques nuevos se ensamblan (y se guardan).
+        # Después todos se enlazan como en el modo paralelo: se reubican las direcciones y
+        # se vuelven a resolver las referencias entre bloques.
+        lineas = self.leer_expandido(archivo_entrada)
+        cache = CacheBloques(directorio_cache, tamano_maximo)
+        optimizar = self.optimizador is not None
+        for primera_linea, lineas_bloque in dividir_en_bloques(lineas, lineas_por_bloque):
+            clave = cache.clave(lineas_bloque, self.relajar, optimizar)
+            guardado = cache.cargar(clave)
+            if guardado is None:
+                bloque = ensamblar_bloque(lineas_bloque, primera_linea, self.tamano_cache, self.relajar, optimizar)
+                cache.guardar(clave, bloque, primera_linea)
+                self.bloques_ensamblados += 1
+                self.enlazar_bloque(bloque)
+            else:
+                primera_linea_guardada, bloque = guardado
+                self.bloques_reutilizados += 1
+                self.enlazar_bloque(bloque, primera_linea - primera_linea_guardada)
+        cache.recortar()
+
+    def leer_expandido(self, archivo_entrada):
+        # Los modos por bloques necesitan las macros y constantes ya expandidas, porque un
+        # bloque no ve las definiciones de los anteriores. Sin directivas es el archivo tal
+        # cual; con ellas, los números de línea de los errores son los del texto expandido.
+        # Por lo mismo, las líneas de .data y .bss se ensamblan aquí, en este proceso, y se
+        # dejan vacías: los bloques reciben solo código y conservan la numeración.
+        # numeros_originales guarda la línea del archivo de cada línea expandida, para que
+        # el mapa de fuente y el listado den las mismas líneas que el ensamblado en serie.
+        numeros = array('I')
+        lineas = []
+        with open(archivo_entrada, 'r') as f:
+            for num_linea, linea in self.preprocesador.expandir(enumerate(f, 1)):
+                numeros.append(num_linea)
+                lineas.append(linea)
+        if numeros != array('I', range(1, len(numeros) + 1)):
+            self.numeros_originales = numeros
+        for i, linea in enumerate(lineas):
+            if self.seccion == '.text':
+                # Filtro barato: casi ninguna línea de código cambia de sección (las directivas
+                # no distinguen mayúsculas, como en SECCION y DIRECTIVA_DATOS)
+                minusculas = linea.lower()
+                if ('.data' not in minusculas and '.bss' not in minusculas and 'align' not in minusculas
+                        and 'section' not in minusculas and 'segment' not in minusculas):
+                    continue
+                texto = quitar_comentario(linea).strip()
+                directiva = DIRECTIVA_DATOS.match(texto)
+                if directiva is not None and directiva.group(2).lower() == 'align':
+                    # Un bloque se ensambla desde la dirección 0 y no sabe cuánto rellenar
+                    raise NotImplementedError(f"align en .text no se admite en los modos paralelo e "
+                                              f"incremental (línea {i + 1})")
+                if SECCION.match(texto) is None:
+                    continue
+            self.linea_actual = i + 1
+            self.procesar_linea(linea)
+            lineas[i] = ''
+        return lineas
+
+    def enlazar_bloque(self, bloque, desplazamiento_lineas=0):
+        # Agrega un BloqueEnsamblado al final del código ya enlazado. desplazamiento_lineas
+        # corrige las líneas de un bloque reutilizado que ahora empieza en otra línea.
+        base = self.contador_posicion
+        posicion = base - self.base_imagen
+        self.imagen += bloque.imagen
+        self.inicios.extend(inicio + base for inicio in bloque.inicios)
+        if desplazamiento_lineas:
+            self.lineas_fuente.extend(linea + desplazamiento_lineas for linea in bloque.lineas_fuente)
+        else:
+            self.lineas_fuente += bloque.lineas_fuente
+        if self.optimizador is not None:
+            self.optimizador.mnemonicos.extend(bloque.mnemonicos)
+        self.contador_posicion = base + len(bloque.imagen)
+        self.cache_aciertos += bloque.cache_aciertos
+        self.cache_fallos += bloque.cache_fallos
+
+        # Los campos absolutos resueltos dentro del bloque tienen direcciones relativas
+        for direccion in bloque.reubicaciones:
+            valor = struct.unpack_from('<I', self.imagen, posicion + direccion)[0]
+            struct.pack_into('<I', self.imagen, posicion + direccion, (valor + base) & 0xFFFFFFFF)
+            self.reubicaciones.append(direccion + base)
+
+        # Etiquetas adelantadas de este bloque que ya estaban definidas en uno anterior
+        # eran, en serie, referencias hacia atrás
+        for label, direcciones in bloque.referencias_adelantadas.items():
+            if label not in self.tabla_simbolos:
+                self.referencias_adelantadas.setdefault(label, []).extend(direccion + base for direccion in direcciones)
+
+        # Definir las etiquetas del bloque parchea las referencias de bloques anteriores
+        for etiqueta, direccion in bloque.tabla_simbolos.items():
+            if etiqueta in self.tabla_simbolos or etiqueta in self.simbolos_secciones:
+                raise ValueError(f"Etiqueta {etiqueta} redefinida")
+            self.tabla_simbolos[etiqueta] = direccion + base
+            referencias = self.referencias_pendientes.pop(etiqueta, None)
+            if referencias:
+                for ref in referencias:
+                    self.parchear_referencia(etiqueta, ref, direccion + base)
+                self.cerrar_referencias(referencias)
+
+        # Las referencias que el bloque no resolvió (o difirió) se tratan como recién emitidas
+        # (las adelantadas ya se anotaron arriba)
+        for label, referencias in bloque.referencias_pendientes.items():
+            for ref in referencias:
+                self.encolar_referencia(label, ReferenciaPendiente(
+                    ref.direccion + base, ref.ancho, ref.relativo, ref.linea + desplazamiento_lineas))
+        for label, ref in bloque.referencias_diferidas:
+            self.encolar_referencia(label, ReferenciaPendiente(
+                ref.direccion + base, ref.ancho, ref.relativo, ref.linea + desplazamiento_lineas))
+
+    @property
+    def codigo_hex(self):
+        return VistaCodigoHex(self)
+
+    def ensamblar_flujo(self, entrada, referencias=None):
+        # Generador del modo flujo: lee las líneas de forma perezosa (ruta, archivo o
+        # cualquier iterable de líneas) y entrega (direccion, bytes) de cada instrucción
+        # en cuanto ninguna referencia abierta apunta a ella ni a una anterior.
+        # La memoria depende del tramo más largo sin resolver, no del tamaño del archivo.
+        # Por lo mismo, las referencias adelantadas solo se anotan si hay dónde volcarlas:
+        # referencias (un objeto con write()) recibe el reporte de guardar_referencias_pendientes,
+        # con las de cada etiqueta escritas en cuanto se define (en orden de definición).
+        # Las reubicaciones no se anotan: solo sirven al ELF y al desensamblado, que no
+        # existen en flujo, y crecerían con cada referencia absoluta del archivo.
+        if self.direcciones_provisionales:
+            raise ValueError("El modo flujo no admite relajación de saltos ni optimización de mirilla")
+        self.anotar_adelantadas = referencias is not None
+        self.anotar_reubicaciones = False
+        if referencias is not None:
+            referencias.write("Label\tDirección\n")
+            self.volcado_referencias = referencias
+        try:
+            if isinstance(entrada, str):
+                with open(entrada, 'r') as f:
+                    yield from self._ensamblar_lineas_flujo(f)
+            else:
+                yield from self._ensamblar_lineas_flujo(entrada)
+        finally:
+            self.volcado_referencias = None
+
+    def _ensamblar_lineas_flujo(self, lineas):
+        for num_linea, linea in self.preprocesador.expandir(enumerate(lineas, 1)):
+            self.linea_actual = num_linea
+            self.procesar_linea(linea)
+            if len(self.inicios) > self.instrucciones_entregadas:
+                yield from self.instrucciones_terminadas()
+
+        self.resolver_referencias_pendientes()
+        yield from self.instrucciones_terminadas()
+
+    def ensamblar_a_archivo(self, entrada, salida, referencias=None):
+        # Sink del modo flujo: escribe el código en el formato de guardar_codigo_hex a
+        # medida que se termina, y las referencias adelantadas en referencias (ver
+        # ensamblar_flujo). salida y referencias pueden ser rutas u objetos con write().
+        if isinstance(salida, str):
+            with open(salida, 'w') as f:
+                self.ensamblar_a_archivo(entrada, f, referencias)
+            return
+        if isinstance(referencias, str):
+            with open(referencias, 'w') as f:
+                self.ensamblar_a_archivo(entrada, salida, f)
+            return
+        for direccion, bytes_ in self.ensamblar_flujo(entrada, referencias):
+            salida.write(self.formatear_segmento(direccion, bytes_))
+
+    def instrucciones_terminadas(self):
+        # El primer campo abierto limita lo que se puede entregar
+        heap = self.heap_campos_abiertos
+        while heap and heap[0] not in self.campos_abiertos:
+            heapq.heappop(heap)
+        limite = heap[0] if heap else self.contador_posicion
+
+        inicios = self.inicios
+        base = self.base_imagen
+        i = self.instrucciones_entregadas
+        n = len(inicios)
+        while i < n:
+            fin = inicios[i + 1] if i + 1 < n else self.contador_posicion
+            if fin > limite:
+                break
+            yield (inicios[i], bytes(self.imagen[inicios[i] - base:fin - base]))
+            i += 1
+        self.instrucciones_entregadas = i
+
+        # Se compacta solo cuando lo entregado es al menos la mitad de inicios,
+        # para que borrar el prefijo cueste O(1) amortizado por instrucción
+        if i and i * 2 >= n:
+            nueva_base = inicios[i] if i < n else self.contador_posicion
+            del self.imagen[:nueva_base - base]
+            del self.inicios[:i]
+            del self.lineas_fuente[:i]
+            self.base_imagen = nueva_base
+            self.instrucciones_entregadas = 0
+
     def procesar_linea(self, linea):
         # Limpiar línea: quitar comentarios y espacios extras
-        linea = linea.split(';')[0].strip()
+        if ';' in linea:
+            linea = quitar_comentario(linea)
+        linea = linea.strip()
         if not linea:
             return
 
         # Verificar si es etiqueta (termina con :)
-        if linea.endswith(':'):
+        if linea[-1] == ':':
             etiqueta = linea[:-1].strip()
             self.procesar_etiqueta(etiqueta)
             return
 
-        # Si es instrucción
-        self.procesar_instruccion(linea)
+        # Si es instrucción (en .data y .bss solo hay directivas)
+        if self.seccion == '.text':
+            self.procesar_instruccion(linea)
+        elif not self.procesar_directiva(linea):
+            raise ValueError(f"Solo se admiten datos en la sección {self.seccion}: {linea} (línea {self.linea_actual})")
 
         #print(f"Procesando línea: {linea}") #Verificar el procesado de linea imprimiendolo en pantalla
 
 
     def procesar_etiqueta(self, etiqueta):
-        if etiqueta in self.tabla_simbolos:
-            raise ValueError(f"Etiqueta {etiqueta} redefinida")
-        self.tabla_simbolos[etiqueta] = self.contador_posicion
+        if etiqueta in self.tabla_simbolos or etiqueta in self.simbolos_secciones:
+            raise ValueError(f"Etiqueta {etiqueta} redefinida (línea {self.linea_actual})")
+        if self.seccion == '.text':
+            self.definir_etiqueta(etiqueta, self.contador_posicion)
+        else:
+            # Su dirección se conoce recién en ubicar_secciones
+            desplazamiento = len(self.datos) if self.seccion == '.data' else self.contador_bss
+            self.simbolos_secciones[etiqueta] = (self.seccion, desplazamiento)
+
+    def definir_etiqueta(self, etiqueta, direccion):
+        self.tabla_simbolos[etiqueta] = direccion
 
-        # Si esta etiqueta estaba en referencias pendientes, no se elimina, porque
-        # las referencias pendientes son para parchear después.
-        # La resolución se hará después.
+        # Backpatching de una pasada: las referencias que esperaban esta etiqueta se
+        # parchean ya y se eliminan, así solo quedan abiertas las de etiquetas sin definir.
+        referencias = self.referencias_pendientes.pop(etiqueta, None)
+        if referencias:
+            for ref in referencias:
+                self.parchear_referencia(etiqueta, ref, direccion)
+            self.cerrar_referencias(referencias)
+        if self.volcado_referencias is not None:
+            # Modo flujo: la etiqueta ya no tendrá referencias adelantadas nuevas
+            direcciones = self.referencias_adelantadas.pop(etiqueta, None)
+            if direcciones:
+                self.escribir_referencias(self.volcado_referencias, etiqueta, direcciones)
 
     def procesar_instruccion(self, instruccion):
-        # Separa mnemónico y operandos
-        partes = instruccion.split(None, 1)
-        mnem = partes[0].lower()
-        operandos = partes[1] if len(partes) > 1 else ''
-
-        # Dispatch básico para instrucciones soportadas:
-        if mnem == 'mov':
-            self.codificar_mov(operandos)
-        elif mnem == 'add':
-            self.codificar_add(operandos)
-        elif mnem == 'div':
-            self.codificar_div(operandos)
-        elif mnem == 'inc':
-            self.codificar_inc(operandos)
-        elif mnem == 'call':
-            self.codificar_call(operandos)
-        elif mnem == 'jmp':
-            self.codificar_jmp(operandos)
-        elif mnem == 'ret':
-            self.codificar_ret()
-        elif mnem == 'hlt':
-            self.codificar_hlt()
-        elif mnem == 'cmp':
-            self.codificar_cmp(operandos)
-        elif mnem == 'jbe':
-            self.codificar_jcc(operandos, opcode=0x76)  # jbe/ jna
-        elif mnem == 'je':
-            self.codificar_jcc(operandos, opcode=0x74)  # je
-        elif mnem == 'jne':
-            self.codificar_jcc(operandos, opcode=0x75)  # jne
-        elif mnem == 'jl':
-            self.codificar_jcc(operandos, opcode=0x7C)  # jl 
-        elif mnem == 'jg':
-            self.codificar_jcc(operandos, opcode=0x7F)  # jg
-        elif mnem == 'dec':
-            self.codificar_dec(operandos)
-        elif mnem == 'shr':
-            self.codificar_shr(operandos)
-        elif mnem == 'xor':
-            self.codificar_xor(operandos)
-        elif mnem == 'push':
-            self.codificar_push(operandos)
-        elif mnem == 'pop':
-            self.codificar_pop(operandos)
-        elif mnem == 'xchg':
-            self.codificar_xchg(operandos)
-        elif mnem == 'ja':
-            self.codificar_jcc(operandos, opcode=0x77)  # ja/jnbe
-        elif mnem == 'jae':
-            self.codificar_jcc(operandos, opcode=0x73)  # jae/jnb
-        elif mnem == 'nop':
-            self.codificar_nop()
+        # Camino más frecuente del ensamblador, escrito en un solo método: cache por
+        # texto, separación de operandos, despacho por tabla y emisión, sin llamadas
+        # intermedias. Las líneas repetidas (muy comunes en código generado) se toman
+        # del cache.
+        cache = self.cache_codificacion
+        entrada = cache.get(instruccion)
+        if entrada is not None:
+            self.cache_aciertos += 1
+            cache.move_to_end(instruccion)
+            bytes_cod, referencias = entrada
         else:
-            raise NotImplementedError(f"Instrucción {mnem} no soportada aún")
-        
-    def es_registro(self, operando):
-        registros = ['eax', 'ebx', 'ecx', 'edx', 'esi', 'edi', 'esp', 'ebp']
-        return operando.lower() in registros
-
-    def codificar_mov(self, operandos):
-        # soporta mov reg, imm ; mov reg, reg ; mov reg, [label]
-        op1, op2 = [x.strip() for x in operandos.split(',', 1)]
-
-        if op1 in self.registros:
-            if op2 in self.registros:
-                # mov reg, reg => 0x8B /r (mov r32, r/m32)
-                # ModR/M byte: 11 reg dest reg src
-                opcode = 0x8B
-                modrm = 0xC0 | (self.registros[op1] << 3) | self.registros[op2]
-                bytes_cod = [opcode, modrm]
-                self.agregar_codigo(bytes_cod)
-            elif op2.startswith('0x') or op2.isdigit():
-                # mov reg, imm32 => B8+reg (mov r32, imm32)
-                imm = int(op2, 0)
-                opcode = 0xB8 + self.registros[op1]
-                imm_bytes = imm.to_bytes(4, 'little')
-                bytes_cod = [opcode] + list(imm_bytes)
-                self.agregar_codigo(bytes_cod)
+            tokens = LEXER_INSTRUCCION.match(instruccion)
+            # Las instrucciones empiezan con un mnemónico conocido; lo demás puede ser
+            # una directiva de datos (etiqueta dd ..., db 1, 2, 3)
+            if tokens is None or tokens.group(1).lower() not in INSTRUCCIONES:
+                if self.procesar_directiva(instruccion):
+                    return
+                if tokens is None:
+                    raise ValueError(f"Sintaxis no reconocida: {instruccion} (línea {self.linea_actual})")
+            mnem, op1, op2 = tokens.groups()
+            mnem = mnem.lower()
+            # Los registros (caso más común) no pasan por clasificar_operando
+            if op1 is None:
+                clases = valores = ()
             else:
-                # mov reg, [label]  -> mov r32, m32
-                # opcode 0x8B + ModRM mod=00 disp32 = addr etiqueta
-                # ModRM: mod=00 reg=dest reg r/m=100 (SIB) o r/m=101 (disp32)
-                # Aquí simplifico usamos mod=00 r/m=101 + disp32 (32bit displacement)
-                opcode = 0x8B
-                modrm = 0x05 | (self.registros[op1] << 3)  # mod=00, r/m=101 (disp32)
-                bytes_cod = [opcode, modrm]
-
-                # La dirección la dejo pendiente si no definida
-                direccion = self.obtener_direccion_label(op2)
-                disp_bytes = direccion.to_bytes(4, 'little')
-                bytes_cod += list(disp_bytes)
-                self.agregar_codigo(bytes_cod)
-        else:
-            raise NotImplementedError(f"mov con primer operando {op1} no soportado")
-
-    def codificar_add(self, operandos):
-        # soporta add reg, imm ; add reg, reg
-        op1, op2 = [x.strip() for x in operandos.split(',', 1)]
-
-        if op1 in self.registros:
-            if op2 in self.registros:
-                # add reg, reg -> 0x01 /r (add r/m32, r32)
-                opcode = 0x01
-                modrm = 0xC0 | (self.registros[op2] <<3) | self.registros[op1]
-                bytes_cod = [opcode, modrm]
-                self.agregar_codigo(bytes_cod)
-            elif op2.startswith('0x') or op2.isdigit():
-                # add reg, imm8/imm32 -> 83 /0 ib (si cabe en 8 bits) o 81 /0 id
-                imm = int(op2, 0)
-                if -128 <= imm <= 127:
-                    opcode = 0x83
-                    modrm = 0xC0 | (0 << 3) | self.registros[op1]  # /0 = add
-                    imm_bytes = imm.to_bytes(1, 'little', signed=True)
-                    bytes_cod = [opcode, modrm] + list(imm_bytes)
+                op1 = OPERANDOS_REGISTRO.get(op1) or self.clasificar_operando(op1)
+                if op2 is None:
+                    clases, valores = (op1[0],), (op1[1],)
                 else:
-                    opcode = 0x81
-                    modrm = 0xC0 | (0 << 3) | self.registros[op1]
-                    imm_bytes = imm.to_bytes(4, 'little', signed=True)
-                    bytes_cod = [opcode, modrm] + list(imm_bytes)
-                self.agregar_codigo(bytes_cod)
-            else:
-                raise NotImplementedError(f"add con segundo operando {op2} no soportado")
+                    op2 = OPERANDOS_REGISTRO.get(op2) or self.clasificar_operando(op2)
+                    clases, valores = (op1[0], op2[0]), (op1[1], op2[1])
+            self.cache_fallos += 1
+            codificador = self.buscar_codificador(instruccion, mnem, clases)
+            try:
+                entrada = codificador(valores)
+            except ValueError as error:
+                # empacar_inmediato y codificar_direccion no saben de qué línea viene el valor
+                raise ValueError(f"{error} (línea {self.linea_actual})") from None
+            bytes_cod, referencias = entrada
+            if not referencias and self.guardar_en_cache:
+                # Solo se guardan las líneas sin etiquetas: con etiquetas, lo que se
+                # ahorra es menos que separar los operandos para reconocerlas
+                cache[instruccion] = entrada
+                if len(cache) > self.tamano_cache:
+                    cache.popitem(last=False)  # descarta la menos usada
+            if self.cache_fallos >= self.revision_cache:
+                self.revisar_cache()
+
+        # Como agregar_codigo, en línea
+        inicio = self.contador_posicion
+        self.inicios.append(inicio)
+        self.lineas_fuente.append(self.linea_actual)
+        self.imagen += bytes_cod
+        self.contador_posicion = inicio + len(bytes_cod)
+        if referencias:
+            for label, offset, ancho, relativo in referencias:
+                self.agregar_referencia_pendiente(label, inicio + offset, ancho, relativo)
+
+    def procesar_directiva(self, linea):
+        # Directivas de sección (section .data) y de datos (db/dw/dd, resb/resw/resd,
+        # align). Devuelve False si la línea no es una directiva.
+        directiva = DIRECTIVA_DATOS.match(linea)
+        if directiva is None:
+            seccion = SECCION.match(linea)
+            if seccion is None:
+                return False
+            nombre = (seccion.group(1) or seccion.group(2)).lower()
+            if nombre not in SECCIONES:
+                raise NotImplementedError(f"Sección {nombre} no soportada aún (línea {self.linea_actual})")
+            self.seccion = nombre
+            return True
+
+        etiqueta, nombre, argumentos = directiva.groups()
+        nombre = nombre.lower()
+        if etiqueta is not None:
+            self.procesar_etiqueta(etiqueta)
+        if nombre == 'align':
+            self.alinear_seccion(self.evaluar_cantidad(nombre, argumentos))
+        elif nombre[0] == 'r':
+            self.reservar(self.evaluar_cantidad(nombre, argumentos) * ANCHOS_DATOS[nombre[3]])
+        elif self.seccion == '.bss':
+            raise ValueError(f"{nombre} en .bss: solo se puede reservar espacio con resb/resw/resd "
+                             f"(línea {self.linea_actual})")
         else:
-            raise NotImplementedError(f"add con primer operando {op1} no soportado")
-        
-    def codificar_div(self, operandos):
-        op = operandos.strip()
-
-        if op in self.registros:
-            # div reg -> F7 /6 modrm (mod=11, reg=6, rm=reg_code)
-            opcode = 0xF7
-            modrm = 0xC0 | (6 << 3) | self.registros[op]  # mod=11, reg=6, rm=reg_code
-            self.agregar_codigo([opcode, modrm])
+            self.emitir_datos(*self.empacar_datos(nombre, argumentos))
+        return True
+
+    def empacar_datos(self, nombre, texto):
+        # Convierte toda la lista de valores de db/dw/dd en un buffer de una vez y devuelve
+        # (bytes, [(etiqueta, desplazamiento), ...]). Camino rápido para tablas grandes: si
+        # son solo números se convierten con map y se empacan con un único struct.pack.
+        ancho = ANCHOS_DATOS[nombre[1]]
+        if "'" not in texto and '"' not in texto:
+            try:
+                valores = list(map(int, texto.split(','), itertools.repeat(0)))
+            except ValueError:
+                pass
+            else:
+                minimo, limite = -(1 << (8 * ancho - 1)), 1 << (8 * ancho)
+                menor = min(valores)
+                if menor < minimo or max(valores) >= limite:
+                    fuera = next(v for v in valores if not minimo <= v < limite)
+                    raise ValueError(f"Valor fuera de rango para {nombre}: {fuera} (línea {self.linea_actual})")
+                if menor < 0:
+                    valores = [valor & (limite - 1) for valor in valores]
+                return struct.pack(f'<{len(valores)}{FORMATOS_DATOS[ancho]}', *valores), ()
+
+        # Elemento por elemento: cadenas, números, expresiones constantes y etiquetas (dd)
+        datos = bytearray()
+        referencias = []
+        for elemento in self.preprocesador.separar_argumentos(texto):
+            if not elemento:
+                raise ValueError(f"Valor vacío en {nombre} (línea {self.linea_actual})")
+            if elemento[0] in '\'"':
+                if len(elemento) < 2 or elemento[-1] != elemento[0]:
+                    raise ValueError(f"Cadena mal formada: {elemento} (línea {self.linea_actual})")
+                cadena = elemento[1:-1].encode()
+                datos += cadena + bytes(-len(cadena) % ancho)  # en dw/dd se rellena con ceros
+                continue
+            try:
+                valor = int(elemento, 0)
+            except ValueError:
+                valor = self.preprocesador.evaluar(elemento, self.linea_actual)
+            if valor is None:
+                etiqueta = ELEMENTO_ETIQUETA.match(elemento)
+                if etiqueta is None or ancho != 4:
+                    raise ValueError(f"Valor inválido en {nombre}: {elemento} (solo dd admite etiquetas) "
+                                     f"(línea {self.linea_actual})")
+                # El campo guarda el desplazamiento de etiqueta+n, que se suma al parchear
+                try:
+                    valor = int(etiqueta.group(2).replace(' ', ''), 0) if etiqueta.group(2) else 0
+                except ValueError:
+                    raise ValueError(f"Desplazamiento inválido en {nombre}: {elemento} (solo etiqueta+número) "
+                                     f"(línea {self.linea_actual})") from None
+                referencias.append((etiqueta.group(1), len(datos)))
+            if not -(1 << (8 * ancho - 1)) <= valor < 1 << (8 * ancho):
+                raise ValueError(f"Valor fuera de rango para {nombre}: {valor} (línea {self.linea_actual})")
+            datos += (valor & ((1 << (8 * ancho)) - 1)).to_bytes(ancho, 'little')
+        return datos, referencias
+
+    def emitir_datos(self, datos, referencias):
+        # Agrega los datos de una línea en la sección activa; los campos con etiquetas se
+        # registran como referencias absolutas de 4 bytes
+        if not datos:
+            return
+        if self.seccion == '.text':
+            inicio = self.contador_posicion
+            self.agregar_codigo(datos)
+            for etiqueta, desplazamiento in referencias:
+                self.agregar_referencia_pendiente(etiqueta, inicio + desplazamiento, 4, False)
         else:
-            # div [label] -> F7 /6 modrm disp32
-            # Se usa mod=00 rm=101 para disp32
-            opcode = 0xF7
-            modrm = 0x05 | (6 << 3)  # mod=00, reg=6(div), rm=101 (disp32)
-            bytes_cod = [opcode, modrm]
-
-            direccion = self.obtener_direccion_label(op)
-            disp_bytes = direccion.to_bytes(4, 'little')
-            bytes_cod += list(disp_bytes)
-            self.agregar_codigo(bytes_cod)
-
-    def codificar_inc(self, operandos):
-        op = operandos.strip()
-
-        if op in self.registros:
-            # inc reg32 = 0x40 + reg_code
-            opcode = 0x40 + self.registros[op]
-            self.agregar_codigo([opcode])
+            inicio = len(self.datos)
+            self.inicios_datos.append(inicio)
+            self.lineas_datos.append(self.linea_actual)
+            self.datos += datos
+            if referencias:
+                self.referencias_datos.extend((etiqueta, inicio + desplazamiento, self.linea_actual)
+                                              for etiqueta, desplazamiento in referencias)
+
+    def reservar(self, cantidad):
+        # resb/resw/resd: en .bss solo avanza el contador; en .text y .data son ceros
+        if self.seccion == '.bss':
+            self.contador_bss += cantidad
         else:
-            # inc [label] = FF /0 modrm disp32
-            opcode = 0xFF
-            modrm = 0x05 | (0 << 3)  # mod=00, reg=000 (inc), rm=101 (disp32)
-            bytes_cod = [opcode, modrm]
-
-            direccion = self.obtener_direccion_label(op)
-            disp_bytes = direccion.to_bytes(4, 'little')
-            bytes_cod += list(disp_bytes)
-
-            self.agregar_codigo(bytes_cod)
-
-
-    def codificar_call(self, operandos):
-        label = operandos.strip()
-        opcode = 0xE8
-        # La llamada es relativa a siguiente instrucción
-        # Se reservan 4 bytes para el desplazamiento y parchea luego
-        bytes_cod = [opcode, 0,0,0,0]
-        self.agregar_codigo(bytes_cod)
-
-        # Agregar referencia pendiente para parchear desplazamiento luego
-        dir_referencia = self.contador_posicion - 4  # donde empieza el desplazamiento (inmediatamente después de opcode)
-        self.agregar_referencia_pendiente(label, dir_referencia)
-
-    def codificar_jmp(self, operandos):
-        label = operandos.strip()
-        opcode = 0xE9
-        # Igual que call, desplazamiento relativo 4 bytes
-        bytes_cod = [opcode, 0,0,0,0]
-        self.agregar_codigo(bytes_cod)
-        dir_referencia = self.contador_posicion - 4
-        self.agregar_referencia_pendiente(label, dir_referencia)
-
-    def codificar_ret(self):
-        # opcode 0xC3
-        self.agregar_codigo([0xC3])
-
-    def codificar_hlt(self):
-        # opcode 0xF4
-        self.agregar_codigo([0xF4])
-
-    def codificar_cmp(self, operandos):
-        op1, op2 = [x.strip() for x in operandos.split(',', 1)]
-        if op1 in self.registros:
-            if op2.startswith('0x') or op2.isdigit():
-                """imm = int(op2,0)
-                opcode = 0x81
-                modrm = 0xF8 | self.registros[op1]  # /7 cmp r/m32, imm32
-                imm_bytes = imm.to_bytes(4, 'little', signed=True)
-                self.agregar_codigo([opcode, modrm] + list(imm_bytes))"""
-                imm = int(op2, 0)
-                if -128 <= imm <= 127:
-                    # cmp reg, imm8 -> 83 /7 ib
-                    opcode = 0x83
-                    modrm = 0xC0 | (7 << 3) | self.registros[op1]
-                    imm_bytes = imm.to_bytes(1, 'little', signed=True)
-                    self.agregar_codigo([opcode, modrm] + list(imm_bytes))
-                else:
-                    # cmp reg, imm32 -> 81 /7 id
-                    opcode = 0x81
-                    modrm = 0xC0 | (7 << 3) | self.registros[op1]
-                    imm_bytes = imm.to_bytes(4, 'little', signed=True)
-                    self.agregar_codigo([opcode, modrm] + list(imm_bytes))
-            elif op2 in self.registros:
-                # cmp reg, reg -> 39 /r
-                opcode = 0x39
-                modrm = 0xC0 | (self.registros[op2]<<3) | self.registros[op1]
-                self.agregar_codigo([opcode, modrm])
-            else:
-                raise NotImplementedError("cmp con segundo operando no soportado")
+            self.emitir_datos(bytes(cantidad), ())
+
+    def alinear_seccion(self, alineacion):
+        if alineacion & (alineacion - 1) or not alineacion:
+            raise ValueError(f"align {alineacion}: la alineación debe ser una potencia de 2 (línea {self.linea_actual})")
+        if self.seccion == '.text':
+            if self.direcciones_provisionales:
+                # Los saltos que crecen al relajar (o el código que se achica al optimizar)
+                # moverían el código ya alineado
+                raise NotImplementedError(f"align en .text no se combina con la relajación de saltos "
+                                          f"ni con la optimización de mirilla (línea {self.linea_actual})")
+            self.emitir_datos(b'\x90' * (-self.contador_posicion % alineacion), ())  # relleno con nop
+            return
+        # En .data y .bss la alineación es relativa al inicio de la sección, que se
+        # ubica alineada a la mayor alineación pedida
+        self.alineaciones[self.seccion] = max(self.alineaciones[self.seccion], alineacion)
+        if self.seccion == '.data':
+            self.emitir_datos(bytes(-len(self.datos) % alineacion), ())
         else:
-            raise NotImplementedError("cmp con primer operando no soportado")
-
-    def codificar_jcc(self, operandos, opcode):
-        # salto condicional corto (8-bit relative)
-        label = operandos.strip()
-        # se reservan 2 bytes: opcode + disp8
-        bytes_cod = [opcode, 0]
-        self.agregar_codigo(bytes_cod)
-        dir_referencia = self.contador_posicion -1  # el byte de desplazamiento es el siguiente al opcode
-        self.agregar_referencia_pendiente(label, dir_referencia)
-
-    def codificar_dec(self, operandos):
-        op = operandos.strip()
-        if op in self.registros:
-            opcode = 0x48 + self.registros[op]  # dec reg32 = 48+reg
-            self.agregar_codigo([opcode])
+            self.contador_bss += -self.contador_bss % alineacion
+
+    def evaluar_cantidad(self, nombre, texto):
+        try:
+            cantidad = int(texto, 0)
+        except ValueError:
+            cantidad = self.preprocesador.evaluar(texto, self.linea_actual)
+        if cantidad is None or cantidad < 0:
+            raise ValueError(f"Cantidad inválida para {nombre}: {texto} (línea {self.linea_actual})")
+        return cantidad
+
+    def buscar_codificador(self, instruccion, mnem, clases):
+        # Despacho por tabla: (mnemónico, forma de los operandos) -> codificador
+        codificador = self.codificadores.get((mnem, clases))
+        if codificador is None:
+            if mnem not in INSTRUCCIONES:
+                raise NotImplementedError(f"Instrucción {mnem} no soportada aún (línea {self.linea_actual})")
+            raise NotImplementedError(f"{mnem} con operandos {instruccion[len(mnem):].strip()} no soportado "
+                                      f"(línea {self.linea_actual})")
+        return codificador
+
+    def revisar_cache(self):
+        # Un fallo cuesta poco más que no tener cache, pero en código sin repeticiones son
+        # casi todos fallos. Si la última ventana acertó poco, el cache se vacía y se
+        # suspende; al terminar la pausa se vuelve a activar, por si el programa cambió.
+        aciertos = self.cache_aciertos - self.aciertos_revision
+        fallos = self.cache_fallos - self.fallos_revision
+        if self.guardar_en_cache and aciertos < TASA_MINIMA_CACHE * (aciertos + fallos):
+            self.guardar_en_cache = False
+            self.cache_codificacion.clear()
+            ventana = VENTANA_CACHE * PAUSA_CACHE
         else:
-            raise NotImplementedError("dec solo para registros soportado")
-        
-    def codificar_shr(self, operandos):
-        op1, op2 = [x.strip() for x in operandos.split(',', 1)]
-        
-        # Parseamos inmediato (puede ser decimal o hex)
-        imm = int(op2, 0) & 0xFF  # solo un byte, el CPU usará 5 bits
-        
-        # Determinar si op1 es registro o memoria (suponiendo que self.es_registro y self.es_memoria existen)
-        if self.es_registro(op1):
-            reg_code = self.registros[op1]
-            # Mod = 11 (registro directo)
-            modrm = 0xC0 | (5 << 3) | reg_code  # 0xC0 = mod=11, reg=5 (shr), r/m=reg_code
-            bytes_cod = [0xC1, modrm, imm]
-            self.agregar_codigo(bytes_cod)
-            
-        elif self.es_memoria(op1):
-            # Aquí tiene que obtener mod, rm, sib y desplazamiento según la dirección
-            mod, rm, sib, disp_bytes = self.parsear_direccion(op1)
-            modrm = (mod << 6) | (5 << 3) | rm
-            bytes_cod = [0xC1, modrm]
-            if sib is not None:
-                bytes_cod.append(sib)
-            bytes_cod.extend(disp_bytes)
-            bytes_cod.append(imm)
-            self.agregar_codigo(bytes_cod)
+            self.guardar_en_cache = True
+            ventana = VENTANA_CACHE
+        self.aciertos_revision, self.fallos_revision = self.cache_aciertos, self.cache_fallos
+        self.revision_cache = self.cache_fallos + ventana
+
+    def estadisticas_cache(self):
+        consultas = self.cache_aciertos + self.cache_fallos
+        return {
+            'aciertos': self.cache_aciertos,
+            'fallos': self.cache_fallos,
+            'tasa_aciertos': self.cache_aciertos / consultas if consultas else 0.0,
+            'entradas': len(self.cache_codificacion),
+            'capacidad': self.tamano_cache,
+            'activo': self.guardar_en_cache,
+        }
+
+    def reporte_estadisticas(self):
+        if self.medidor is None:
+            raise ValueError("Estadísticas desactivadas: crea el ensamblador con estadisticas=True")
+        return self.medidor.como_dict(self)
+
+    def guardar_estadisticas(self, nombre_archivo):
+        # JSON con reporte_estadisticas(); '-' lo escribe en la salida estándar
+        texto = json.dumps(self.reporte_estadisticas(), indent=2, ensure_ascii=False)
+        if nombre_archivo == '-':
+            print(texto)
         else:
-            raise ValueError("Operando no reconocido para shr")
-        
-    def codificar_xor(self, operandos):
-        op1, op2 = [x.strip() for x in operandos.split(',', 1)]
-
-        if op1 in self.registros:
-            if op2 in self.registros:
-                # xor reg, reg -> 0x31 /r (xor r/m32, r32)
-                opcode = 0x31
-                modrm = 0xC0 | (self.registros[op2] << 3) | self.registros[op1]
-                self.agregar_codigo([opcode, modrm])
-            elif op2.startswith('0x') or op2.lstrip('-').isdigit():
-                imm = int(op2, 0)
-                if -128 <= imm <= 127:
-                    # xor reg, imm8 -> 0x83 /6 ib
-                    opcode = 0x83
-                    modrm = 0xC0 | (6 << 3) | self.registros[op1]  # /6 es XOR
-                    imm_bytes = imm.to_bytes(1, 'little', signed=True)
-                    self.agregar_codigo([opcode, modrm] + list(imm_bytes))
+            with open(nombre_archivo, 'w') as f:
+                f.write(texto + '\n')
+
+    def clasificar_operando(self, operando):
+        # Devuelve (clase, valor): ('reg', código), ('imm' o 'imm8', entero),
+        # ('mem', Direccion) o ('label', nombre)
+        op = operando.strip()
+        if not op:
+            raise ValueError(f"Operando vacío (línea {self.linea_actual})")
+        if op[0] in '+-0123456789':
+            try:
+                valor = int(op, 0)
+            except ValueError:
+                raise ValueError(f"Inmediato inválido: {op} (línea {self.linea_actual})") from None
+            return ('imm8' if -128 <= valor <= 127 else 'imm', valor)
+        if op[0] == '[':
+            if op[-1] != ']':
+                raise ValueError(f"Operando de memoria mal formado: {op} (línea {self.linea_actual})")
+            return ('mem', self.parsear_direccion(op[1:-1]))
+        clave = op.lower()
+        if clave in REGISTROS:
+            return OPERANDOS_REGISTRO[clave]
+        return ('label', op)
+
+    def parsear_direccion(self, texto):
+        # Contenido de [ ... ]: suma de términos base, indice*escala, números y a lo sumo
+        # una etiqueta, en cualquier orden (p. ej. ebx+esi*4+8, tabla+ecx*4, ebp-4)
+        base = indice = etiqueta = None
+        escala = 1
+        desplazamiento = 0
+        for termino in texto.replace('-', '+-').split('+'):
+            termino = termino.strip()
+            negativo = termino.startswith('-')
+            if negativo:
+                termino = termino[1:].strip()
+            if not termino:
+                if negativo or not texto.strip():
+                    raise ValueError(f"Dirección mal formada: [{texto}] (línea {self.linea_actual})")
+                continue
+            if termino[0] in '0123456789':
+                # Número o producto de números (p. ej. tras sustituir constantes: 4*8)
+                try:
+                    valor = 1
+                    for factor in termino.split('*'):
+                        valor *= int(factor.strip(), 0)
+                except ValueError:
+                    if '*' not in termino:
+                        raise ValueError(f"Desplazamiento inválido en [{texto}]: {termino} "
+                                         f"(línea {self.linea_actual})") from None
+                else:
+                    desplazamiento += -valor if negativo else valor
+                    continue
+            if negativo:
+                raise ValueError(f"Solo se pueden restar números en [{texto}] (línea {self.linea_actual})")
+            if '*' in termino:
+                factores = [f.strip().lower() for f in termino.split('*')]
+                if len(factores) != 2:
+                    raise ValueError(f"Índice mal formado en [{texto}]: {termino} (línea {self.linea_actual})")
+                registro, factor = factores if factores[0] in REGISTROS else factores[::-1]
+                if registro not in REGISTROS or not factor.isdigit() or int(factor) not in ESCALAS:
+                    raise ValueError(f"Índice inválido en [{texto}]: {termino} (escala 1, 2, 4 u 8, "
+                                     f"línea {self.linea_actual})")
+                if indice is not None:
+                    raise ValueError(f"Más de un índice en [{texto}] (línea {self.linea_actual})")
+                indice, escala = REGISTROS[registro], int(factor)
+            elif termino.lower() in REGISTROS:
+                if base is None:
+                    base = REGISTROS[termino.lower()]
+                elif indice is None:
+                    indice = REGISTROS[termino.lower()]
                 else:
-                    # xor reg, imm32 -> 0x81 /6 id
-                    opcode = 0x81
-                    modrm = 0xC0 | (6 << 3) | self.registros[op1]
-                    imm_bytes = imm.to_bytes(4, 'little', signed=True)
-                    self.agregar_codigo([opcode, modrm] + list(imm_bytes))
+                    raise ValueError(f"Demasiados registros en [{texto}] (línea {self.linea_actual})")
+            elif etiqueta is None:
+                etiqueta = termino
             else:
-                raise NotImplementedError(f"xor con segundo operando {op2} no soportado")
-        else:
-            raise NotImplementedError(f"xor con primer operando {op1} no soportado")
+                raise ValueError(f"Más de una etiqueta en [{texto}] (línea {self.linea_actual})")
 
-    def codificar_push(self, operandos):
-        op = operandos.strip()
-        if op in self.registros:
-            opcode = 0x50 + self.registros[op]
-            self.agregar_codigo([opcode])
-        else:
-            raise NotImplementedError("push solo para registros soportado")
+        # Formas equivalentes más cortas y restricciones de la codificación
+        if base is None and indice is not None and escala <= 2:
+            # [eax] sin SIB ni disp32; [eax*2] como [eax+eax]
+            base, indice, escala = indice, (indice if escala == 2 else None), 1
+        if indice == REGISTROS['esp']:
+            if escala != 1 or base == REGISTROS['esp']:
+                raise ValueError(f"esp no puede ser índice en [{texto}] (línea {self.linea_actual})")
+            base, indice = indice, base
+        return Direccion(base, indice, escala, desplazamiento, etiqueta)
 
-    def codificar_pop(self, operandos):
-        op = operandos.strip()
-        if op in self.registros:
-            opcode = 0x58 + self.registros[op]
-            self.agregar_codigo([opcode])
-        else:
-            raise NotImplementedError("pop solo para registros soportado")
-
-    def codificar_xchg(self, operandos):
-        op1, op2 = [x.strip() for x in operandos.split(',',1)]
-        if op1 in self.registros and op2 in self.registros:
-            # xchg reg, reg -> 0x87 /r
-            opcode = 0x87
-            modrm = 0xC0 | (self.registros[op2]<<3) | self.registros[op1]
-            self.agregar_codigo([opcode, modrm])
-        else:
-            raise NotImplementedError("xchg solo entre registros soportado")
-        
-    def codificar_nop(self):
-        # opcode NOP = 0x90, un solo byte
-        self.agregar_codigo([0x90])
+    def es_registro(self, operando):
+        return operando.lower() in REGISTROS
 
     def agregar_codigo(self, bytes_lista):
-        # Guarda la secuencia de bytes en codigo_hex con direccion actual
-        self.codigo_hex.append( (self.contador_posicion, bytes_lista) )
+        # Agrega los bytes a la imagen y registra el inicio y la línea de la instrucción
+        self.inicios.append(self.contador_posicion)
+        self.lineas_fuente.append(self.linea_actual)
+        self.imagen += bytes_lista
         self.contador_posicion += len(bytes_lista)
 
-    def agregar_referencia_pendiente(self, label, direccion_referencia):
+    def agregar_referencia_pendiente(self, label, direccion, ancho, relativo):
+        # Registra el campo a parchear en la dirección absoluta indicada
+        ref = ReferenciaPendiente(direccion, ancho, relativo, self.linea_actual)
+        if label not in self.tabla_simbolos and self.anotar_adelantadas:
+            # Referencia hacia adelante: se anota para el reporte de referencias pendientes
+            adelantadas = self.referencias_adelantadas.get(label)
+            if adelantadas is None:
+                adelantadas = self.referencias_adelantadas[label] = []
+            adelantadas.append(direccion)
+
+        if self.direcciones_provisionales:
+            # Las direcciones pueden cambiar al relajar u optimizar, así que nada se parchea todavía
+            self.referencias_diferidas.append((label, ref))
+            return
+        self.registrar_referencia(label, ref)
+
+    def encolar_referencia(self, label, ref):
+        # Como agregar_referencia_pendiente, para una referencia ya anotada (al enlazar bloques)
+        if self.direcciones_provisionales:
+            # Las direcciones pueden cambiar al relajar u optimizar, así que nada se parchea todavía
+            self.referencias_diferidas.append((label, ref))
+            return
+        self.registrar_referencia(label, ref)
+
+    def registrar_referencia(self, label, ref):
+        direccion = ref.direccion
+        if label in self.tabla_simbolos:
+            # Referencia hacia atrás: la dirección ya se conoce, se parchea de inmediato
+            self.parchear_referencia(label, ref, self.tabla_simbolos[label])
+            return
+
         if label not in self.referencias_pendientes:
             self.referencias_pendientes[label] = []
-        self.referencias_pendientes[label].append(direccion_referencia)
+        self.referencias_pendientes[label].append(ref)
+        self.num_referencias_abiertas += 1
+        self.campos_abiertos.add(direccion)
+        heapq.heappush(self.heap_campos_abiertos, direccion)
 
-    def obtener_direccion_label(self, label):
-        # Retorna la direccion si ya esta definida, si no, 0 y agrega referencia pendiente
-        if label in self.tabla_simbolos:
-            return self.tabla_simbolos[label]
+    def referencias_abiertas(self):
+        # Cuántas referencias siguen sin parchear: las que esperan a que se defina su
+        # etiqueta y, al relajar u optimizar, las diferidas hasta que las direcciones
+        # sean definitivas
+        return self.num_referencias_abiertas + len(self.referencias_diferidas)
+
+    def parchear_referencia(self, label, ref, addr_label):
+        # Escribe el valor final del campo en O(1) directamente sobre la imagen
+        posicion = ref.direccion - self.base_imagen
+        if ref.relativo:
+            # Rel = Addr_label - (Dir_campo + ancho), i.e. relativo a la siguiente instrucción
+            valor = addr_label - (ref.direccion + ref.ancho)
+        else:
+            valor = addr_label + struct.unpack_from('<i', self.imagen, posicion)[0]
+            if self.anotar_reubicaciones:
+                self.reubicaciones.append(ref.direccion)
+
+        if ref.ancho == 1:
+            if not (-128 <= valor <= 127):
+                raise ValueError(f"Salto corto fuera de rango para etiqueta {label} (línea {ref.linea})")
+            struct.pack_into('<b', self.imagen, posicion, valor)
+        elif ref.ancho == 4:
+            struct.pack_into('<i' if ref.relativo else '<I', self.imagen, posicion, valor)
         else:
-            # Direccion 0 como placeholder, se parcheará despues
-            dir_ref = self.contador_posicion + 2  # La direccion donde aparece la etiqueta en codigo
-            self.agregar_referencia_pendiente(label, dir_ref)
-            return 0
+            raise ValueError(f"Error al parchear referencia a {label} (línea {ref.linea})")
+
+    def cerrar_referencias(self, referencias):
+        # Descuenta referencias ya parcheadas de los contadores de abiertas
+        self.num_referencias_abiertas -= len(referencias)
+        for ref in referencias:
+            self.campos_abiertos.discard(ref.direccion)
+        # El heap conserva las entradas cerradas hasta que llegan a su tope (en el modo
+        # flujo) o hasta aquí: cuando la mayoría ya están cerradas se reconstruye con las
+        # abiertas, así su tamaño sigue acotado por las referencias abiertas en todos los
+        # modos, con costo O(1) amortizado por referencia
+        if len(self.heap_campos_abiertos) > 2 * len(self.campos_abiertos) + 64:
+            self.heap_campos_abiertos = list(self.campos_abiertos)
+            heapq.heapify(self.heap_campos_abiertos)
 
     def resolver_referencias_pendientes(self):
-        # Recorre referencias y parchea código en codigo_hex
-        for label, lista_dir in self.referencias_pendientes.items():
+        # Las referencias se parchean en cuanto procesar_etiqueta define la etiqueta,
+        # así que al final del archivo solo deberían quedar etiquetas nunca definidas
+        # (y las de .data y .bss, que se definen al ubicar las secciones).
+        if self.direcciones_provisionales:
+            if self.optimizador is not None:
+                self.optimizar_mirilla()
+            if self.relajar:
+                self.relajar_saltos()
+            else:
+                self.parchear_diferidas()
+        self.ubicar_secciones()
+        for label in list(self.referencias_pendientes):
             if label not in self.tabla_simbolos:
-                raise ValueError(f"Etiqueta {label} usada pero no definida")
+                ref = self.referencias_pendientes[label][0]
+                raise ValueError(f"Etiqueta {label} usada pero no definida (línea {ref.linea})")
             addr_label = self.tabla_simbolos[label]
 
-            for dir_ref in lista_dir:
-                # Buscar el segmento en codigo_hex donde se encuentra dir_ref
-                for i, (dir_base, bytes_lista) in enumerate(self.codigo_hex):
-                    if dir_base <= dir_ref < dir_base + len(bytes_lista):
-                        offset = dir_ref - dir_base
-                        # Se parchea segun tipo de salto o llamada:
-                        # Ejemplo para call/jmp (rel32):
-                        # Rel = Addr_label - (Dir_ref + 4)
-                        if len(bytes_lista) >= offset+4:
-                            rel = addr_label - (dir_ref + 4)
-                            rel_bytes = rel.to_bytes(4, 'little', signed=True)
-                            for j in range(4):
-                                bytes_lista[offset+j] = rel_bytes[j]
-                        elif len(bytes_lista) >= offset+1:
-                            # Para saltos cortos (jcc 8 bits)
-                            rel8 = addr_label - (dir_ref + 1)
-                            if not (-128 <= rel8 <= 127):
-                                raise ValueError(f"Salto corto fuera de rango para etiqueta {label}")
-                            bytes_lista[offset] = rel8 & 0xFF
-                        else:
-                            raise ValueError("Error al parchear referencia")
-                        # Actualizar el segmento
-                        self.codigo_hex[i] = (dir_base, bytes_lista)
-                        break
+            referencias = self.referencias_pendientes.pop(label)
+            for ref in referencias:
+                self.parchear_referencia(label, ref, addr_label)
+            self.cerrar_referencias(referencias)
+
+    def ubicar_secciones(self):
+        # Coloca .data al final de la imagen, después de .text, y .bss a continuación sin
+        # ocupar lugar en ella (cada una alineada a su mayor align). Recién aquí se conocen
+        # las direcciones de sus etiquetas, que parchean las referencias que las esperaban,
+        # y las de los campos de .data que apuntan a etiquetas.
+        if self.secciones is not None:
+            return
+        fin_texto = self.contador_posicion
+        self.secciones = {'.text': (self.base_imagen, fin_texto)}
+        if not (self.datos or self.contador_bss or self.simbolos_secciones):
+            return
+
+        inicio_datos = fin_texto + (-fin_texto % self.alineaciones['.data']) if self.datos else fin_texto
+        if inicio_datos > fin_texto:
+            self.linea_actual = 0  # el relleno no viene de ninguna línea
+            self.agregar_codigo(bytes(inicio_datos - fin_texto))
+        self.imagen += self.datos
+        self.inicios.extend(inicio_datos + inicio for inicio in self.inicios_datos)
+        self.lineas_fuente += self.lineas_datos
+        self.contador_posicion = fin_datos = inicio_datos + len(self.datos)
+        inicio_bss = fin_datos + (-fin_datos % self.alineaciones['.bss'])
+        self.datos = bytearray()
+        self.inicios_datos = array('I')
+        self.lineas_datos = array('I')
+
+        usadas = {seccion for seccion, _ in self.simbolos_secciones.values()}
+        if fin_datos > inicio_datos or '.data' in usadas:
+            self.secciones['.data'] = (inicio_datos, fin_datos)
+        if self.contador_bss or '.bss' in usadas:
+            self.secciones['.bss'] = (inicio_bss, inicio_bss + self.contador_bss)
+
+        bases = {'.data': inicio_datos, '.bss': inicio_bss}
+        for etiqueta, (seccion, desplazamiento) in self.simbolos_secciones.items():
+            self.definir_etiqueta(etiqueta, bases[seccion] + desplazamiento)
+        for etiqueta, desplazamiento, linea in self.referencias_datos:
+            self.linea_actual = linea
+            self.agregar_referencia_pendiente(etiqueta, inicio_datos + desplazamiento, 4, False)
+        self.referencias_datos = []
+
+    def relajar_saltos(self):
+        # Elige para cada jmp/jcc la forma más pequeña que alcanza su destino. Todos
+        # empiezan cortos (2 bytes); un salto solo puede crecer, así que se itera hasta
+        # un punto fijo con una cola de trabajo y un árbol de Fenwick para el corrimiento
+        # de direcciones. Cuando un salto crece solo se vuelven a revisar los cortos cuyo
+        # tramo [origen, destino) lo contiene: un salto corto abarca a lo sumo 127 bytes
+        # originales, así que se buscan por bisect entre los saltos cercanos a él, y como
+        # cada crecimiento dentro de su tramo le resta al menos 3 de sus 127 bytes de
+        # margen, cada uno se revisa un número acotado de veces: O(n log n) en total.
+        # Al final se reconstruye la imagen una sola vez y se parchean todas las
+        # referencias. Deja en saltos_relajados cuántos quedaron cortos y cuántos cercanos.
+        diferidas = self.referencias_diferidas
+        for label, ref in diferidas:
+            if label not in self.tabla_simbolos and label not in self.simbolos_secciones:
+                raise ValueError(f"Etiqueta {label} usada pero no definida (línea {ref.linea})")
+
+        # Saltos cortos ordenados por dirección: el campo rel8 sigue al opcode
+        saltos = sorted((ref.direccion - 1, i) for i, (label, ref) in enumerate(diferidas)
+                        if ref.relativo and ref.ancho == 1)
+        inicios_saltos = [inicio for inicio, _ in saltos]
+        crecimiento = [len(FORMA_CERCANA[self.imagen[inicio - self.base_imagen]]) + 4 - 2
+                       for inicio in inicios_saltos]
+        corrimiento = SumasPrefijo(len(saltos))
+
+        def desplazamiento(direccion):
+            # Cuánto se mueve una dirección original por los saltos crecidos antes de ella
+            return corrimiento.suma(bisect.bisect_left(inicios_saltos, direccion))
+
+        # Un salto a una etiqueta de .data o .bss (ubicadas después de .text) es cercano
+        destinos = [self.tabla_simbolos.get(diferidas[i][0]) for _, i in saltos]
+        alcance = 127 + 2   # distancia original máxima entre el inicio de un salto corto y su tramo
+
+        cercanos = [False] * len(saltos)
+        en_cola = [True] * len(saltos)
+        trabajo = deque(range(len(saltos)))
+        while trabajo:
+            j = trabajo.popleft()
+            en_cola[j] = False
+            inicio = inicios_saltos[j]
+            destino = destinos[j]
+            fin = inicio + 2
+            if destino is not None and -128 <= destino + desplazamiento(destino) - fin - desplazamiento(fin) <= 127:
+                continue
+            cercanos[j] = True
+            corrimiento.agregar(j, crecimiento[j])
+            # Los cortos cuyo tramo [min(fin, destino), max(fin, destino)) contiene este salto
+            # se acercan al límite: se vuelven a revisar
+            for k in range(bisect.bisect_left(inicios_saltos, inicio - alcance),
+                           bisect.bisect_right(inicios_saltos, inicio + alcance)):
+                if cercanos[k] or en_cola[k]:
+                    continue
+                fin_k, destino_k = inicios_saltos[k] + 2, destinos[k]
+                if min(fin_k, destino_k) <= inicio < max(fin_k, destino_k):
+                    en_cola[k] = True
+                    trabajo.append(k)
+
+        crecidos = [j for j in range(len(saltos)) if cercanos[j]]
+        if crecidos:
+            base = self.base_imagen
+            ediciones = []
+            for j in crecidos:
+                inicio = saltos[j][0]
+                opcode = FORMA_CERCANA[self.imagen[inicio - base]]
+                ediciones.append((inicio, 2, opcode + bytes(4), (len(opcode), 4)))
+            self.reconstruir_imagen(ediciones)
+        self.parchear_diferidas()
+        self.saltos_relajados = (len(saltos) - len(crecidos), len(crecidos))
+
+    def optimizar_mirilla(self):
+        # Aplica la optimización de mirilla (ver OptimizadorMirilla) antes de parchear
+        self.optimizador.aplicar(self)
+
+    def reconstruir_imagen(self, ediciones):
+        # Reemplaza de una vez instrucciones de .text por otras de distinto largo (bytes
+        # vacíos la borran) y reubica inicios, símbolos y referencias diferidas.
+        # ediciones: [(inicio, largo, bytes_nuevos, campo)] ordenadas por inicio, con campo
+        # (desplazamiento, ancho) de la referencia de la instrucción dentro de los bytes
+        # nuevos, o None si la instrucción ya no tiene referencia. O(n + r log k).
+        base = self.base_imagen
+        inicios_editados = [inicio for inicio, _, _, _ in ediciones]
+        prefijos = [0]
+        for _, largo, nuevos, _ in ediciones:
+            prefijos.append(prefijos[-1] + len(nuevos) - largo)
+
+        def reubicar(direccion):
+            # Válido para inicios de instrucción; los campos de las editadas van por campo_nuevo
+            return direccion + prefijos[bisect.bisect_left(inicios_editados, direccion)]
+
+        def campo_nuevo(direccion):
+            # (dirección, ancho) de un campo tras la edición; ancho None si no cambia y
+            # dirección None si la instrucción perdió su referencia
+            k = bisect.bisect_right(inicios_editados, direccion) - 1
+            if k < 0 or direccion >= inicios_editados[k] + ediciones[k][1]:
+                return reubicar(direccion), None
+            campo = ediciones[k][3]
+            if campo is None:
+                return None, None
+            return reubicar(inicios_editados[k]) + campo[0], campo[1]
+
+        # Imagen e inicios se copian por tramos entre ediciones; cada tramo se corre igual.
+        # Las líneas solo cambian si se borra alguna instrucción (la relajación nunca borra).
+        imagen = bytearray()
+        inicios, lineas = self.inicios, self.lineas_fuente
+        nuevos_inicios = array('I')
+        nuevas_lineas = array('I') if not all(nuevos for _, _, nuevos, _ in ediciones) else None
+        anterior = desde = 0
+        for k, (inicio, largo, nuevos, _) in enumerate(ediciones):
+            imagen += self.imagen[anterior:inicio - base]
+            imagen += nuevos
+            anterior = inicio - base + largo
+            hasta = bisect.bisect_right(inicios, inicio, desde)
+            fin_tramo = hasta if nuevos else hasta - 1  # una instrucción borrada no sigue
+            tramo = inicios[desde:fin_tramo]
+            nuevos_inicios.extend([direccion + prefijos[k] for direccion in tramo] if prefijos[k] else tramo)
+            if nuevas_lineas is not None:
+                nuevas_lineas += lineas[desde:fin_tramo]
+            desde = hasta
+        imagen += self.imagen[anterior:]
+        tramo = inicios[desde:]
+        nuevos_inicios.extend([direccion + prefijos[-1] for direccion in tramo] if prefijos[-1] else tramo)
+
+        self.imagen = imagen
+        self.contador_posicion = base + len(imagen)
+        self.inicios = nuevos_inicios
+        if nuevas_lineas is not None:
+            nuevas_lineas += lineas[desde:]
+            self.lineas_fuente = nuevas_lineas
+        self.tabla_simbolos = {etiqueta: reubicar(direccion)
+                               for etiqueta, direccion in self.tabla_simbolos.items()}
+        self.reubicaciones = array('I', (reubicar(direccion) for direccion in self.reubicaciones))
+        # Las referencias de instrucciones borradas desaparecen también del reporte. Las
+        # listas se reescriben en su lugar: tienen todas las referencias adelantadas.
+        vacias = []
+        for etiqueta, direcciones in self.referencias_adelantadas.items():
+            direcciones[:] = [direccion for direccion, _ in map(campo_nuevo, direcciones) if direccion is not None]
+            if not direcciones:
+                vacias.append(etiqueta)
+        for etiqueta in vacias:
+            del self.referencias_adelantadas[etiqueta]
+        diferidas = []
+        primera = inicios_editados[0]
+        for label, ref in self.referencias_diferidas:
+            if ref.direccion < primera:
+                diferidas.append((label, ref))
+                continue
+            direccion, ancho = campo_nuevo(ref.direccion)
+            if direccion is not None:
+                diferidas.append((label, ReferenciaPendiente(direccion, ancho or ref.ancho, ref.relativo, ref.linea)))
+        self.referencias_diferidas = diferidas
+
+    def parchear_diferidas(self):
+        # Las direcciones de .text ya son definitivas; las referencias a etiquetas de .data
+        # y .bss quedan pendientes hasta ubicar_secciones
+        self.direcciones_provisionales = False
+        for label, ref in self.referencias_diferidas:
+            if label in self.tabla_simbolos:
+                self.parchear_referencia(label, ref, self.tabla_simbolos[label])
+            else:
+                self.registrar_referencia(label, ref)
+        self.referencias_diferidas = []
 
     def generar_hex(self, archivo_salida):
         with open(archivo_salida, 'w') as f:
@@ -475,6 +2354,156 @@ class EnsambladorIA32:
                 for d in dirs:
                     f.write(f"{simb}\t0x{d:04X}\n")"""
 
+    def guardar_binario(self, nombre_archivo):
+        # Binario plano: la imagen tal cual, cargada en base_imagen
+        with open(nombre_archivo, 'wb') as f:
+            f.write(self.imagen)
+
+    def construir_intel_hex(self, bytes_por_registro=16):
+        # Registros de datos (tipo 00) de hasta bytes_por_registro bytes, con un registro
+        # de dirección lineal extendida (tipo 04) cada vez que cambian los 16 bits altos
+        registros = []
+        imagen = memoryview(self.imagen)
+        segmento = 0
+        direccion = self.base_imagen
+        posicion = 0
+        while posicion < len(imagen):
+            if direccion >> 16 != segmento:
+                segmento = direccion >> 16
+                registros.append(f":02000004{segmento:04X}{-(6 + (segmento >> 8) + (segmento & 0xFF)) & 0xFF:02X}")
+            # Un registro no cruza un límite de 64 KiB
+            desplazamiento = direccion & 0xFFFF
+            datos = imagen[posicion:posicion + min(bytes_por_registro, 0x10000 - desplazamiento)]
+            suma = len(datos) + (desplazamiento >> 8) + (desplazamiento & 0xFF) + sum(datos)
+            registros.append(f":{len(datos):02X}{desplazamiento:04X}00{datos.hex().upper()}{-suma & 0xFF:02X}")
+            posicion += len(datos)
+            direccion += len(datos)
+        registros.append(":00000001FF\n")
+        return '\n'.join(registros)
+
+    def guardar_intel_hex(self, nombre_archivo):
+        with open(nombre_archivo, 'w') as f:
+            f.write(self.construir_intel_hex())
+
+    def construir_elf(self, reubicable=False):
+        # ELF32 mínimo para i386 con .text, .data y .bss (las que haya) y la tabla de
+        # símbolos. Ejecutable (ET_EXEC): un segmento PT_LOAD en base_imagen con la imagen
+        # y .bss, y punto de entrada en _start (o al inicio del código). Reubicable (ET_REL):
+        # direcciones relativas a cada sección y una reubicación R_386_32 por cada campo
+        # absoluto (en .rel.text o .rel.data) contra la sección a la que apunta.
+        base = self.base_imagen
+        secciones = self.secciones or {'.text': (base, self.contador_posicion)}
+        alojadas = list(secciones)  # en orden de dirección: .text, .data, .bss
+        indice = {nombre: i + 1 for i, nombre in enumerate(alojadas)}  # cabecera y símbolo de sección
+
+        def seccion_de(direccion):
+            for nombre in reversed(alojadas):
+                if direccion >= secciones[nombre][0]:
+                    return nombre
+            return '.text'
+
+        texto = self.imagen
+        reubicaciones = {'.text': bytearray(), '.data': bytearray()}
+        if reubicable:
+            texto = bytearray(self.imagen)
+            for direccion in self.reubicaciones:
+                posicion = direccion - base
+                valor = struct.unpack_from('<I', texto, posicion)[0]
+                destino = seccion_de(valor)
+                struct.pack_into('<I', texto, posicion, (valor - secciones[destino][0]) & 0xFFFFFFFF)
+                campo = seccion_de(direccion)
+                reubicaciones[campo] += ELF_REUBICACION.pack(direccion - secciones[campo][0],
+                                                             (indice[destino] << 8) | R_386_32)
+
+        # .strtab y .symtab: símbolo nulo, un símbolo por sección y una entrada por etiqueta
+        nombres = bytearray(b'\0')
+        simbolos = bytearray(ELF_SIMBOLO.size)
+        for nombre in alojadas:
+            simbolos += ELF_SIMBOLO.pack(0, 0, 0, STT_SECTION, 0, indice[nombre])
+        for etiqueta, direccion in self.tabla_simbolos.items():
+            seccion = self.simbolos_secciones[etiqueta][0] if etiqueta in self.simbolos_secciones else '.text'
+            valor = direccion - secciones[seccion][0] if reubicable else direccion
+            simbolos += ELF_SIMBOLO.pack(len(nombres), valor, 0, STB_GLOBAL << 4, 0, indice[seccion])
+            nombres += etiqueta.encode() + b'\0'
+
+        rel = []
+        if reubicable:
+            rel = ['.text'] + (['.data'] if '.data' in secciones else [])
+        nombres_todas = alojadas + ['.symtab', '.strtab', '.shstrtab'] + ['.rel' + nombre for nombre in rel]
+        indice_tablas = len(alojadas) + 1  # .symtab; le siguen .strtab y .shstrtab
+        nombres_secciones = bytearray(b'\0')
+        indice_nombre = []
+        for nombre in nombres_todas:
+            indice_nombre.append(len(nombres_secciones))
+            nombres_secciones += nombre.encode() + b'\0'
+
+        # Disposición: cabecera, [cabecera de programa], imagen (.text y .data), tablas y
+        # cabeceras de sección
+        num_programas = 0 if reubicable else 1
+        desplazamiento_texto = ELF_CABECERA.size + num_programas * ELF_PROGRAMA.size
+        if reubicable:
+            desplazamiento_texto = -(-desplazamiento_texto // 16) * 16
+        else:
+            # p_offset y p_vaddr deben coincidir módulo el tamaño de página
+            desplazamiento_texto += (base - desplazamiento_texto) % ALINEACION_PAGINA
+        desplazamiento_simbolos = -(-(desplazamiento_texto + len(texto)) // 4) * 4
+        desplazamiento_nombres = desplazamiento_simbolos + len(simbolos)
+        desplazamiento_nombres_secciones = desplazamiento_nombres + len(nombres)
+        desplazamiento_reubicaciones = -(-(desplazamiento_nombres_secciones + len(nombres_secciones)) // 4) * 4
+        desplazamiento_secciones = desplazamiento_reubicaciones + sum(len(reubicaciones[nombre]) for nombre in rel)
+
+        entrada = 0 if reubicable else self.tabla_simbolos.get('_start', base)
+        elf = bytearray(ELF_CABECERA.pack(
+            ELF_IDENT, ET_REL if reubicable else ET_EXEC, EM_386, 1, entrada,
+            ELF_CABECERA.size if num_programas else 0, desplazamiento_secciones, 0,
+            ELF_CABECERA.size, ELF_PROGRAMA.size, num_programas,
+            ELF_SECCION.size, len(nombres_todas) + 1, indice_tablas + 2))
+        if not reubicable:
+            fin_memoria = secciones['.bss'][1] if '.bss' in secciones else base + len(texto)
+            elf += ELF_PROGRAMA.pack(PT_LOAD, desplazamiento_texto, base, base, len(texto), fin_memoria - base,
+                                     PF_R_X if len(alojadas) == 1 else PF_RWX, ALINEACION_PAGINA)
+        elf += bytes(desplazamiento_texto - len(elf))
+        elf += texto
+        elf += bytes(desplazamiento_simbolos - len(elf))
+        elf += simbolos + nombres + nombres_secciones
+        elf += bytes(desplazamiento_reubicaciones - len(elf))
+        for nombre in rel:
+            elf += reubicaciones[nombre]
+
+        elf += bytes(ELF_SECCION.size)
+        for i, nombre in enumerate(alojadas):
+            inicio, fin = secciones[nombre]
+            direccion = 0 if reubicable else inicio
+            if nombre == '.text':
+                elf += ELF_SECCION.pack(indice_nombre[i], SHT_PROGBITS, SHF_ALLOC_EXEC, direccion,
+                                        desplazamiento_texto + inicio - base, fin - inicio, 0, 0, 16, 0)
+            elif nombre == '.data':
+                elf += ELF_SECCION.pack(indice_nombre[i], SHT_PROGBITS, SHF_ALLOC_WRITE, direccion,
+                                        desplazamiento_texto + inicio - base, fin - inicio, 0, 0,
+                                        self.alineaciones['.data'], 0)
+            else:
+                elf += ELF_SECCION.pack(indice_nombre[i], SHT_NOBITS, SHF_ALLOC_WRITE, direccion,
+                                        desplazamiento_texto + len(texto), fin - inicio, 0, 0,
+                                        self.alineaciones['.bss'], 0)
+        i = indice_tablas - 1
+        elf += ELF_SECCION.pack(indice_nombre[i], SHT_SYMTAB, 0, 0, desplazamiento_simbolos,
+                                len(simbolos), indice_tablas + 1, len(alojadas) + 1, 4, ELF_SIMBOLO.size)
+        elf += ELF_SECCION.pack(indice_nombre[i + 1], SHT_STRTAB, 0, 0, desplazamiento_nombres,
+                                len(nombres), 0, 0, 1, 0)
+        elf += ELF_SECCION.pack(indice_nombre[i + 2], SHT_STRTAB, 0, 0, desplazamiento_nombres_secciones,
+                                len(nombres_secciones), 0, 0, 1, 0)
+        desplazamiento = desplazamiento_reubicaciones
+        for j, nombre in enumerate(rel):
+            elf += ELF_SECCION.pack(indice_nombre[i + 3 + j], SHT_REL, 0, 0, desplazamiento,
+                                    len(reubicaciones[nombre]), indice_tablas, indice[nombre], 4,
+                                    ELF_REUBICACION.size)
+            desplazamiento += len(reubicaciones[nombre])
+        return elf
+
+    def guardar_elf(self, nombre_archivo, reubicable=False):
+        with open(nombre_archivo, 'wb') as f:
+            f.write(self.construir_elf(reubicable))
+
     def guardar_tabla_simbolos(self, nombre_archivo):
         with open(nombre_archivo, 'w') as f:
             f.write("Label\tDirección\n")
@@ -482,29 +2511,556 @@ class EnsambladorIA32:
                 f.write(f"{etiqueta}\t0x{direccion:04X}\n")
 
     def guardar_referencias_pendientes(self, nombre_archivo):
+        # Cada campo que usó una etiqueta antes de que se definiera
         with open(nombre_archivo, 'w') as f:
             f.write("Label\tDirección\n")
-            for etiqueta, direcciones in self.referencias_pendientes.items():
-                if direcciones:  # Si hay al menos una dirección
-                    f.write(f"{etiqueta}\t0x{direcciones[0]:04X}\n")
+            for etiqueta, direcciones in self.referencias_adelantadas.items():
+                self.escribir_referencias(f, etiqueta, direcciones)
+
+    def escribir_referencias(self, archivo, etiqueta, direcciones):
+        archivo.write(''.join(f"{etiqueta}\t0x{direccion:04X}\n" for direccion in direcciones))
+
+    def formatear_segmento(self, direccion, bytes_):
+        bytes_str = ' '.join(f"{b:02X}" for b in bytes_)
+        return f"0x{direccion:04X}: {bytes_str}\n"
 
     def guardar_codigo_hex(self, nombre_archivo):
         with open(nombre_archivo, 'w') as f:
             for direccion, bytes_ in self.codigo_hex:
-                bytes_str = ' '.join(f"{b:02X}" for b in bytes_)
-                f.write(f"0x{direccion:04X}: {bytes_str}\n")
+                f.write(self.formatear_segmento(direccion, bytes_))
+
+    def mapa_fuente(self):
+        # MapaFuente de todo lo emitido (.text y .data), una vez resueltas las referencias
+        lineas = self.lineas_fuente
+        if self.numeros_originales is not None:
+            numeros = self.numeros_originales
+            lineas = (numeros[linea - 1] if linea else 0 for linea in lineas)
+        return MapaFuente(array('I', self.inicios), array('I', lineas), self.contador_posicion)
+
+    def guardar_mapa(self, nombre_archivo):
+        self.mapa_fuente().guardar(nombre_archivo)
+
+    def listado(self, fuente):
+        # Filas del listado en orden de direcciones: línea, dirección, bytes (los que no caben
+        # en una fila siguen en filas de continuación) y texto fuente. fuente es la lista de
+        # líneas del archivo (la línea 1 en el índice 0). Las líneas sin bytes (etiquetas,
+        # comentarios, directivas) se intercalan en su lugar; el texto de una línea que emite
+        # varias veces seguidas (times, macros) se muestra solo en la primera.
+        mapa = self.mapa_fuente()
+        direcciones, lineas = mapa.direcciones, mapa.lineas
+        con_bytes = set(lineas)
+        base = self.base_imagen
+
+        def fila(linea, direccion, bytes_, texto):
+            numero = f"{linea:6}" if linea else ' ' * 6
+            posicion = f"{direccion:08X}" if direccion is not None else ' ' * 8
+            bytes_str = ' '.join(f"{b:02X}" for b in bytes_)
+            return f"{numero} {posicion} {bytes_str:<{3 * BYTES_POR_FILA_LISTADO - 1}}  {texto}".rstrip()
+
+        def texto(linea):
+            return fuente[linea - 1].rstrip('\r\n') if 0 < linea <= len(fuente) else ''
+
+        siguiente = 1
+        anterior = None
+        for i, (direccion, linea) in enumerate(zip(direcciones, lineas)):
+            if linea >= siguiente:
+                for sin_bytes in range(siguiente, linea):
+                    if sin_bytes not in con_bytes:
+                        yield fila(sin_bytes, None, b'', texto(sin_bytes))
+                siguiente = linea + 1
+            fin = direcciones[i + 1] if i + 1 < len(direcciones) else mapa.fin
+            bytes_ = self.imagen[direccion - base:fin - base]
+            yield fila(linea, direccion, bytes_[:BYTES_POR_FILA_LISTADO], texto(linea) if linea != anterior else '')
+            for k in range(BYTES_POR_FILA_LISTADO, len(bytes_), BYTES_POR_FILA_LISTADO):
+                yield fila(0, direccion + k, bytes_[k:k + BYTES_POR_FILA_LISTADO], '')
+            anterior = linea
+        for sin_bytes in range(siguiente, len(fuente) + 1):
+            if sin_bytes not in con_bytes:
+                yield fila(sin_bytes, None, b'', texto(sin_bytes))
+
+    def guardar_listado(self, nombre_archivo, fuente):
+        # Escribe listado(fuente); '-' lo escribe en la salida estándar
+        if nombre_archivo == '-':
+            for fila in self.listado(fuente):
+                print(fila)
+            return
+        with open(nombre_archivo, 'w') as f:
+            for fila in self.listado(fuente):
+                f.write(fila + '\n')
+
+    def desensamblar(self):
+        # (direccion, bytes, texto) de cada instrucción de .text, una vez resueltas las
+        # referencias, con los límites de instrucción de inicios
+        fin = self.secciones['.text'][1] if self.secciones else self.contador_posicion
+        desensamblador = Desensamblador(self.tabla_simbolos, self.reubicaciones)
+        return desensamblador.desensamblar(self.imagen, self.base_imagen, self.inicios, fin)
+
+    def guardar_desensamblado(self, nombre_archivo):
+        # Texto que este ensamblador vuelve a ensamblar en los mismos bytes: etiquetas e
+        # instrucciones de .text (con dirección y bytes como comentario), .data como db y
+        # .bss como resb. '-' lo escribe en la salida estándar.
+        # {sección: {dirección: [etiquetas]}}: una etiqueta en el borde entre dos secciones
+        # va en la suya (según simbolos_secciones), después de su directiva section
+        etiquetas = {'.text': {}, '.data': {}, '.bss': {}}
+        for etiqueta, direccion in self.tabla_simbolos.items():
+            seccion = self.simbolos_secciones[etiqueta][0] if etiqueta in self.simbolos_secciones else '.text'
+            etiquetas[seccion].setdefault(direccion, []).append(etiqueta)
+        lineas = []
+
+        def escribir_etiquetas(seccion, direccion):
+            lineas.extend(f"{etiqueta}:" for etiqueta in etiquetas[seccion].pop(direccion, ()))
+
+        for direccion, bytes_, texto in self.desensamblar():
+            escribir_etiquetas('.text', direccion)
+            lineas.append(f"    {texto:<40}; {self.formatear_segmento(direccion, bytes_).rstrip()}")
+        secciones = self.secciones or {'.text': (self.base_imagen, self.contador_posicion)}
+        escribir_etiquetas('.text', secciones['.text'][1])
+
+        for seccion in ('.data', '.bss'):
+            if seccion not in secciones:
+                continue
+            inicio, fin = secciones[seccion]
+            lineas.append(f"section {seccion}")
+            if self.alineaciones[seccion] > ALINEACION_SECCIONES:
+                lineas.append(f"    align {self.alineaciones[seccion]}")
+            # Tramos entre etiquetas: db de a 16 bytes en .data, resb en .bss
+            cortes = sorted({inicio, fin, *(d for d in etiquetas[seccion] if inicio < d < fin)})
+            for desde, hasta in zip(cortes, cortes[1:]):
+                escribir_etiquetas(seccion, desde)
+                if seccion == '.bss':
+                    lineas.append(f"    resb {hasta - desde}")
+                    continue
+                for d in range(desde, hasta, 16):
+                    fragmento = self.imagen[d - self.base_imagen:min(d + 16, hasta) - self.base_imagen]
+                    lineas.append(f"    {formatear_datos(fragmento)}")
+            escribir_etiquetas(seccion, fin)
+
+        texto = '\n'.join(lineas) + '\n'
+        if nombre_archivo == '-':
+            print(texto, end='')
+        else:
+            with open(nombre_archivo, 'w') as f:
+                f.write(texto)
 
     def generar_reportes(self):
         self.guardar_tabla_simbolos('tabla_simbolos.txt')
         self.guardar_referencias_pendientes('referencias_pendientes.txt')
         self.guardar_codigo_hex('codigo_hex.txt')
 
+def generar_instrucciones_aleatorias(rng, cantidad, relajar):
+    # Programa válido al azar con todas las formas de TABLA_CODIFICACION y una etiqueta
+    # cada 4 instrucciones. Devuelve (líneas, [(mnemónico, forma, valores)] por instrucción).
+    # Sin relajación, los saltos cortos van a la etiqueta anterior o a la siguiente.
+    formas = sorted(TABLA_CODIFICACION)
+    registros = sorted(NOMBRES_REGISTRO)
+    etiquetas = [f"L{k}" for k in range(cantidad // 4 + 2)]
+    lineas, esperadas = [], []
+    for i in range(cantidad):
+        if i % 4 == 0:
+            lineas.append(f"{etiquetas[i // 4]}:")
+        mnem, forma = rng.choice(formas)
+        codificacion = TABLA_CODIFICACION[(mnem, forma)]
+        textos, valores = [], []
+        for clase in forma:
+            if clase == 'reg':
+                valor = rng.choice(registros)
+                texto = NOMBRES_REGISTRO[valor]
+            elif clase == 'imm8':
+                valor = rng.randrange(0, 128) if mnem in INMEDIATOS_SIN_SIGNO else rng.randrange(-128, 128)
+                texto = str(valor)
+            elif clase == 'imm':
+                if mnem in INMEDIATOS_SIN_SIGNO:
+                    valor = rng.randrange(128, 256)
+                else:
+                    valor = rng.choice((rng.randrange(128, 2**32), rng.randrange(-2**31, -128)))
+                texto = str(valor)
+            elif clase == 'label':
+                if codificacion.op_en == 'D' and codificacion.ancho_rel == 1 and not relajar:
+                    valor = etiquetas[i // 4 + rng.randrange(2)]
+                else:
+                    valor = rng.choice(etiquetas)
+                texto = valor
+            else:
+                base = rng.choice(registros + [None])
+                indice = rng.choice([r for r in registros if r != REGISTROS['esp']] + [None] * 3)
+                escala = rng.choice(tuple(ESCALAS)) if indice is not None else 1
+                etiqueta = rng.choice(etiquetas) if rng.random() < 0.25 else None
+                if etiqueta is not None:
+                    desplazamiento = rng.randrange(-64, 4096)  # la suma con la etiqueta no debe quedar negativa
+                else:
+                    desplazamiento = rng.choice((0, rng.randrange(-128, 128), rng.randrange(-2**31, 2**31)))
+                partes = [NOMBRES_REGISTRO[base]] if base is not None else []
+                if indice is not None:
+                    partes.append(f"{NOMBRES_REGISTRO[indice]}*{escala}")
+                if etiqueta is not None:
+                    partes.append(etiqueta)
+                texto = '+'.join(partes)
+                if desplazamiento or not partes:
+                    texto += f"{desplazamiento:+d}" if partes else str(desplazamiento)
+                texto = f"[{texto}]"
+                valor = texto
+            textos.append(texto)
+            valores.append(valor)
+        lineas.append(f"{mnem} {', '.join(textos)}" if textos else mnem)
+        esperadas.append((mnem, forma, valores))
+    lineas.extend(f"{etiqueta}:" for etiqueta in etiquetas[(cantidad - 1) // 4 + 1:])
+    return lineas, esperadas
+
+def verificar_ida_y_vuelta(cantidad, semilla=0, por_programa=4096):
+    # Verificación para cada compilación: genera instrucciones válidas al azar, las ensambla
+    # (un programa de cada dos con relajación de saltos), decodifica cada una y compara
+    # mnemónico y operandos ya resueltos con lo generado; además vuelve a ensamblar el
+    # texto desensamblado y exige los mismos bytes. Devuelve (instrucciones verificadas,
+    # diferencias), con a lo sumo 20 diferencias descritas.
+    rng = random.Random(semilla)
+    diferencias = []
+    verificadas = 0
+    programa = 0
+    while verificadas < cantidad and len(diferencias) < 20:
+        relajar = programa % 2 == 1
+        programa += 1
+        lineas, esperadas = generar_instrucciones_aleatorias(rng, min(por_programa, cantidad - verificadas), relajar)
+        ensamblador = EnsambladorIA32(relajar=relajar)
+        ensamblador.ensamblar_codigo(lineas)
+        simbolos = ensamblador.tabla_simbolos
+        desensamblador = Desensamblador(simbolos, ensamblador.reubicaciones)
+        imagen, base = ensamblador.imagen, ensamblador.base_imagen
+        instrucciones = [linea for linea in lineas if not linea.endswith(':')]
+
+        for direccion, (mnem, forma, valores), linea in zip(ensamblador.inicios, esperadas, instrucciones):
+            decodificada = decodificar_instruccion(imagen, direccion - base, direccion)
+            esperados = []
+            for clase, valor in zip(forma, valores):
+                if clase == 'mem':
+                    valor = ensamblador.parsear_direccion(valor[1:-1])
+                elif clase == 'label' and TABLA_CODIFICACION[(mnem, forma)].op_en != 'D':
+                    clase, valor = 'mem', Direccion(None, None, 1, 0, valor)
+                if clase == 'mem':
+                    desplazamiento = valor.desplazamiento + (simbolos[valor.etiqueta] if valor.etiqueta else 0)
+                    indice = valor.indice
+                    esperados.append(('mem', (valor.base, indice, valor.escala if indice is not None else 1,
+                                              desplazamiento & 0xFFFFFFFF)))
+                elif clase == 'label':
+                    esperados.append(('rel', simbolos[valor]))
+                elif clase == 'reg':
+                    esperados.append(('reg', valor))
+                else:
+                    esperados.append(('imm', valor & 0xFFFFFFFF))
+            if decodificada is not None:
+                largo, mnem_decodificado, operandos, _ = decodificada
+                obtenidos = [('mem', (op[1].base, op[1].indice, op[1].escala, op[1].desplazamiento & 0xFFFFFFFF))
+                             if op[0] == 'mem' else ('imm', op[1] & 0xFFFFFFFF) if op[0] == 'imm' else op
+                             for op in operandos]
+                # xchg reg, mem se decodifica como xchg mem, reg (mismo opcode, mismo efecto)
+                if mnem_decodificado == mnem and (obtenidos == esperados or obtenidos == esperados[::-1]
+                                                  and len(set(c for c, _ in esperados)) > 1 and mnem == 'xchg'):
+                    continue
+            texto = 'no decodifica' if decodificada is None else desensamblador.formatear(*decodificada[1:])
+            diferencias.append(f"0x{direccion:X}: {linea} -> {texto}")
+
+        # El texto desensamblado tiene que volver a dar los mismos bytes
+        etiquetas = {}
+        for etiqueta, direccion in simbolos.items():
+            etiquetas.setdefault(direccion, []).append(f"{etiqueta}:")
+        fuente = []
+        for direccion, _, texto in desensamblador.desensamblar(imagen, base, ensamblador.inicios):
+            fuente.extend(etiquetas.pop(direccion, ()))
+            fuente.append(texto)
+        fuente.extend(itertools.chain.from_iterable(etiquetas.values()))
+        try:
+            codigo = EnsambladorIA32(relajar=relajar).ensamblar_codigo(fuente).codigo
+        except (ValueError, NotImplementedError) as error:
+            diferencias.append(f"el desensamblado no vuelve a ensamblar: {error}")
+        else:
+            if codigo != bytes(imagen):
+                diferencias.append(f"el desensamblado vuelve a ensamblar en otros bytes (programa {programa})")
+        verificadas += len(esperadas)
+    return verificadas, diferencias[:20]
+
+# Formatos binarios de la línea de comandos (además del texto hex): nombre -> (método de guardado, extensión)
+FORMATOS_SALIDA = {
+    'bin': (lambda ensamblador, nombre: ensamblador.guardar_binario(nombre), '.bin'),
+    'ihex': (lambda ensamblador, nombre: ensamblador.guardar_intel_hex(nombre), '.hex'),
+    'elf': (lambda ensamblador, nombre: ensamblador.guardar_elf(nombre), '.elf'),
+    'obj': (lambda ensamblador, nombre: ensamblador.guardar_elf(nombre, reubicable=True), '.o'),
+}
+
+# Modo lote: salida de cada formato construida en memoria (el trabajador la devuelve y el
+# front-end la escribe) y extensión del archivo escrito junto a la entrada
+SALIDAS_LOTE = {
+    'hex': (lambda ensamblador: ''.join(ensamblador.formatear_segmento(direccion, bytes_)
+                                        for direccion, bytes_ in ensamblador.codigo_hex).encode(), '.txt'),
+    'bin': (lambda ensamblador: bytes(ensamblador.imagen), '.bin'),
+    'ihex': (lambda ensamblador: ensamblador.construir_intel_hex().encode(), '.hex'),
+    'elf': (lambda ensamblador: ensamblador.construir_elf(), '.elf'),
+    'obj': (lambda ensamblador: ensamblador.construir_elf(reubicable=True), '.o'),
+}
+
+# Ensambladores de cada proceso trabajador del modo lote, uno por configuración: se
+# reutilizan entre archivos (ensamblar_codigo reinicia el estado) y conservan el cache
+# de codificación caliente
+ENSAMBLADORES_LOTE = {}
+
+# Resultado de ensamblar_lote: archivos procesados, [(ruta, mensaje)] de los que fallaron,
+# segundos totales y latencia de cada archivo (de empezar a leerlo a terminar de escribirlo)
+ResultadoLote = namedtuple('ResultadoLote', ['archivos', 'errores', 'segundos', 'latencias'])
+
+def ensamblar_archivo_lote(texto, formato, relajar, optimizar, tamano_cache):
+    # Trabajador del modo lote: devuelve (salida, None), o (None, mensaje) si el programa
+    # tiene errores, para que un archivo inválido no corte el lote
+    configuracion = (relajar, optimizar, tamano_cache)
+    ensamblador = ENSAMBLADORES_LOTE.get(configuracion)
+    if ensamblador is None:
+        ensamblador = ENSAMBLADORES_LOTE[configuracion] = EnsambladorIA32(
+            tamano_cache=tamano_cache, relajar=relajar, optimizar=optimizar)
+    try:
+        ensamblador.ensamblar_codigo(texto)
+        return SALIDAS_LOTE[formato][0](ensamblador), None
+    except (ValueError, NotImplementedError) as error:
+        return None, str(error)
+
+async def ensamblar_lote(archivos, formato='bin', directorio_salida=None, trabajadores=None, en_vuelo=None,
+                         relajar=False, optimizar=False, tamano_cache=TAMANO_CACHE):
+    # Front-end asíncrono para ensamblar muchos archivos. Lecturas y escrituras van a un
+    # pool de hilos y el ensamblado, que usa CPU, a un pool de trabajadores procesos, así
+    # que mientras un archivo se ensambla otros se leen y se escriben. en_vuelo corrutinas
+    # toman archivos de la lista de a uno: nunca hay más de en_vuelo archivos entre leídos
+    # y escritos, así que si la escritura se atrasa se deja de leer (contrapresión) y la
+    # memoria no depende del tamaño del lote. Cada salida se escribe junto a su entrada
+    # (o en directorio_salida) con la extensión de SALIDAS_LOTE. Cualquier error de un
+    # archivo (del ensamblador, de lectura y escritura o inesperado) se anota y el lote
+    # sigue; si un trabajador muere, el pool de procesos se reemplaza por uno nuevo.
+    loop = asyncio.get_running_loop()
+    trabajadores = trabajadores or os.cpu_count() or 1
+    en_vuelo = en_vuelo or 2 * trabajadores
+    extension = SALIDAS_LOTE[formato][1]
+    pendientes = iter(archivos)
+    errores = []
+    latencias = []
+
+    def leer(ruta):
+        with open(ruta, 'r') as f:
+            return f.read()
+
+    def escribir(ruta, salida):
+        with open(ruta, 'wb') as f:
+            f.write(salida)
+
+    # Pool de procesos actual (en una lista para poder reemplazarlo si se rompe)
+    procesos = [ProcessPoolExecutor(max_workers=trabajadores)]
+
+    async def ensamblar(texto):
+        # Si un trabajador muere (falta de memoria, señal) el pool entero queda roto: se
+        # reemplaza y el archivo se reintenta una vez en un proceso propio, porque el que
+        # lo rompió pudo ser otro de los que estaban en vuelo
+        pool = procesos[0]
+        argumentos = (ensamblar_archivo_lote, texto, formato, relajar, optimizar, tamano_cache)
+        try:
+            return await loop.run_in_executor(pool, *argumentos)
+        except BrokenProcessPool:
+            if procesos[0] is pool:
+                pool.shutdown(wait=False)
+                procesos[0] = ProcessPoolExecutor(max_workers=trabajadores)
+        # El pool aislado se cierra desde un hilo: shutdown() espera al proceso y,
+        # llamado aquí, bloquearía el bucle de eventos y con él al resto del lote
+        aislado = ProcessPoolExecutor(max_workers=1)
+        try:
+            return await loop.run_in_executor(aislado, *argumentos)
+        finally:
+            await loop.run_in_executor(None, aislado.shutdown)
+
+    async def atender(hilos):
+        for ruta in pendientes:
+            comienzo = time.perf_counter()
+            try:
+                texto = await loop.run_in_executor(hilos, leer, ruta)
+                salida, error = await ensamblar(texto)
+                if error is None:
+                    nombre = os.path.splitext(os.path.basename(ruta))[0] + extension
+                    destino = os.path.join(directorio_salida or os.path.dirname(ruta), nombre)
+                    await loop.run_in_executor(hilos, escribir, destino, salida)
+            except (OSError, UnicodeDecodeError) as excepcion:
+                error = str(excepcion)
+            except BrokenProcessPool:
+                error = "El proceso trabajador terminó abruptamente con este archivo"
+            except Exception as excepcion:
+                # Error inesperado del ensamblador con este archivo
+                error = f"{type(excepcion).__name__}: {excepcion}"
+            if error is not None:
+                errores.append((ruta, error))
+            latencias.append(time.perf_counter() - comienzo)
+
+    inicio = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=en_vuelo) as hilos:
+            await asyncio.gather(*(atender(hilos) for _ in range(en_vuelo)))
+    finally:
+        await loop.run_in_executor(None, procesos[0].shutdown)
+    return ResultadoLote(len(latencias), errores, time.perf_counter() - inicio, latencias)
+
+def percentil(ordenados, fraccion):
+    # Valor en la fracción dada de una lista ordenada (sin interpolar)
+    return ordenados[min(len(ordenados) - 1, int(fraccion * len(ordenados)))] if ordenados else 0.0
+
+def ejecutar(args, ensamblador):
+    # Ensambla y escribe las salidas según los argumentos de la línea de comandos
+    if args.flujo:
+        # Ensambla y escribe incrementalmente (también las referencias adelantadas)
+        ensamblador.ensamblar_a_archivo(args.entrada, 'codigo_hex.txt', 'referencias_pendientes.txt')
+        ensamblador.guardar_tabla_simbolos('tabla_simbolos.txt')
+    else:
+        if args.paralelo is not None:
+            ensamblador.ensamblar_paralelo(args.entrada, trabajadores=args.paralelo or None)
+        elif args.incremental:
+            ensamblador.ensamblar_incremental(args.entrada, args.incremental,
+                                              tamano_maximo=args.incremental_max * 2**20)
+            print(f"Cache incremental: {ensamblador.bloques_reutilizados} bloques reutilizados, "
+                  f"{ensamblador.bloques_ensamblados} ensamblados")
+        else:
+            ensamblador.ensamblar(args.entrada)  # Carga y procesa el archivo asm
+        ensamblador.resolver_referencias_pendientes()  # Arregla saltos y llamadas pendientes
+        if args.formato == 'hex':
+            ensamblador.generar_hex('codigo_hex.txt')  # Genera archivo con código máquina
+            ensamblador.generar_reportes()  # Genera archivos de tabla de símbolos y referencias
+        else:
+            metodo, extension = FORMATOS_SALIDA[args.formato]
+            salida = args.salida or os.path.splitext(args.entrada)[0] + extension
+            metodo(ensamblador, salida)
+            ensamblador.guardar_tabla_simbolos('tabla_simbolos.txt')
+            ensamblador.guardar_referencias_pendientes('referencias_pendientes.txt')
+        if args.desensamblar:
+            ensamblador.guardar_desensamblado(args.desensamblar)
+        if args.listado:
+            with open(args.entrada, 'r') as f:
+                ensamblador.guardar_listado(args.listado, f.read().splitlines())
+        if args.mapa is not None:
+            ensamblador.guardar_mapa(args.mapa or os.path.splitext(args.entrada)[0] + '.mapa')
+
+    if args.relajar:
+        cortos, cercanos = ensamblador.saltos_relajados
+        print(f"Relajación de saltos: {cortos} cortos (rel8), {cercanos} cercanos (rel32)")
+
+    if args.optimizar:
+        optimizador = ensamblador.optimizador
+        print(f"Optimización de mirilla: {optimizador.bytes_ahorrados()} bytes ahorrados")
+        for regla, (veces, bytes_) in optimizador.ahorro.items():
+            print(f"  {regla}: {veces} veces, {bytes_} bytes")
+
+    if args.estadisticas_cache:
+        est = ensamblador.estadisticas_cache()
+        print(f"Cache de codificación: {est['aciertos']} aciertos, {est['fallos']} fallos "
+              f"({est['tasa_aciertos']:.1%}), {est['entradas']}/{est['capacidad']} entradas"
+              + ("" if est['activo'] or not est['capacidad'] else ", suspendido por pocos aciertos"))
+
 def main():
-     ensamblador = EnsambladorIA32()
-     ensamblador.ensamblar('prueba1.asm')  # Carga y procesa el archivo asm
-     ensamblador.resolver_referencias_pendientes()  # Arregla saltos y llamadas pendientes
-     ensamblador.generar_hex('codigo_hex.txt')  # Genera archivo con código máquina
-     ensamblador.generar_reportes()  # Genera archivos de tabla de símbolos y referencias
+     parser = argparse.ArgumentParser(description="Ensamblador IA-32 de una pasada")
+     parser.add_argument('entrada', nargs='?', default='prueba1.asm', help="archivo .asm a ensamblar")
+     parser.add_argument('--flujo', action='store_true',
+                         help="modo flujo: escribe el código a medida que se termina, sin cargar todo el archivo")
+     parser.add_argument('--paralelo', type=int, nargs='?', const=0, metavar='N',
+                         help="ensambla por bloques en N procesos (por defecto, uno por CPU) y los enlaza al final")
+     parser.add_argument('--incremental', metavar='DIR',
+                         help="reutiliza los bloques sin cambios guardados en el cache en disco DIR")
+     parser.add_argument('--incremental-max', type=int, default=TAMANO_CACHE_DISCO // 2**20, metavar='MB',
+                         help=f"tamaño máximo del cache incremental (por defecto {TAMANO_CACHE_DISCO // 2**20} MB)")
+     parser.add_argument('--formato', choices=['hex', *FORMATOS_SALIDA], default='hex',
+                         help="hex: texto en codigo_hex.txt (por defecto); bin: binario plano; ihex: Intel HEX; "
+                              "elf: ejecutable ELF32; obj: objeto ELF32 reubicable")
+     parser.add_argument('-o', '--salida', metavar='ARCHIVO',
+                         help="archivo de salida para --formato (por defecto, el nombre de la entrada con su extensión); "
+                              "con --lote, directorio de salida")
+     parser.add_argument('--lote', nargs='+', metavar='ARCHIVO',
+                         help="ensambla muchos archivos a la vez en --paralelo N procesos (por defecto, uno por "
+                              "CPU), cada uno con su salida en --formato junto a la entrada")
+     parser.add_argument('--relajar', action='store_true',
+                         help="elige la forma corta (rel8) o cercana (rel32) de cada jmp/jcc según la distancia")
+     parser.add_argument('-O', '--optimizar', action='store_true',
+                         help="optimización de mirilla: mov reg, 0 -> xor y add reg, 1 -> inc si las banderas "
+                              "no se usan después, y borra los jmp a la instrucción siguiente")
+     parser.add_argument('--desensamblar', nargs='?', const='-', metavar='ARCHIVO',
+                         help="escribe el código desensamblado (con etiquetas, ensamblable de nuevo) en ARCHIVO "
+                              "(o en pantalla)")
+     parser.add_argument('--listado', nargs='?', const='-', metavar='ARCHIVO',
+                         help="escribe el listado (línea, dirección, bytes y texto fuente) en ARCHIVO (o en pantalla)")
+     parser.add_argument('--mapa', nargs='?', const='', metavar='ARCHIVO',
+                         help="guarda el mapa de fuente binario dirección -> línea en ARCHIVO "
+                              "(por defecto, el nombre de la entrada con extensión .mapa)")
+     parser.add_argument('--consultar-mapa', nargs=2, metavar=('MAPA', 'DIRECCION'),
+                         help="no ensambla: muestra la línea fuente de DIRECCION según el mapa MAPA")
+     parser.add_argument('--verificar', type=int, metavar='N',
+                         help="no ensambla la entrada: genera N instrucciones al azar, las ensambla, las "
+                              "desensambla y compara (termina con código 1 si hay diferencias)")
+     parser.add_argument('--cache', type=int, default=TAMANO_CACHE, metavar='N',
+                         help=f"líneas distintas sin etiquetas en el cache de codificación; las que usan "
+                              f"etiquetas nunca se guardan (0 lo desactiva, por defecto {TAMANO_CACHE})")
+     parser.add_argument('--estadisticas-cache', action='store_true',
+                         help="muestra aciertos y fallos del cache de codificación al terminar")
+     parser.add_argument('--estadisticas', nargs='?', const='-', metavar='ARCHIVO',
+                         help="mide tiempos por fase y por mnemónico, líneas/s, bytes y referencias; "
+                              "las escribe como JSON en ARCHIVO (o en pantalla)")
+     parser.add_argument('--profile', nargs='?', const='ensamblador.pstats', metavar='ARCHIVO',
+                         help="ejecuta bajo cProfile y guarda las estadísticas pstats en ARCHIVO "
+                              "(por defecto ensamblador.pstats)")
+     args = parser.parse_args()
+     if args.flujo and args.formato != 'hex':
+         parser.error("--flujo solo escribe el formato hex")
+     if args.flujo and args.optimizar:
+         parser.error("--flujo no se combina con -O")
+     if args.flujo and (args.desensamblar or args.listado or args.mapa is not None):
+         parser.error("--flujo no se combina con --desensamblar, --listado ni --mapa")
+
+     if args.consultar_mapa:
+         nombre_mapa, texto = args.consultar_mapa
+         try:
+             direccion = int(texto, 0)
+         except ValueError:
+             parser.error(f"dirección inválida: {texto}")
+         linea = cargar_mapa_fuente(nombre_mapa).linea(direccion)
+         print(f"0x{direccion:04X}: " + (f"línea {linea}" if linea is not None else "fuera del programa"))
+         sys.exit(0 if linea is not None else 1)
+
+     if args.verificar is not None:
+         inicio = time.perf_counter()
+         verificadas, diferencias = verificar_ida_y_vuelta(args.verificar)
+         segundos = time.perf_counter() - inicio
+         for diferencia in diferencias:
+             print(diferencia)
+         print(f"Ida y vuelta: {verificadas} instrucciones en {segundos:.2f} s "
+               f"({verificadas / segundos * 60 / 1e6:.1f} millones por minuto), {len(diferencias)} diferencias")
+         sys.exit(1 if diferencias else 0)
+     if args.incremental and (args.flujo or args.paralelo is not None):
+         parser.error("--incremental no se combina con --flujo ni --paralelo")
+
+     if args.lote:
+         if args.flujo or args.incremental or args.desensamblar or args.listado or args.mapa is not None:
+             parser.error("--lote no se combina con --flujo, --incremental, --desensamblar, --listado ni --mapa")
+         if args.salida:
+             os.makedirs(args.salida, exist_ok=True)
+         resultado = asyncio.run(ensamblar_lote(
+             args.lote, args.formato, args.salida, trabajadores=args.paralelo or None,
+             relajar=args.relajar, optimizar=args.optimizar, tamano_cache=args.cache))
+         for ruta, error in resultado.errores:
+             print(f"{ruta}: {error}")
+         latencias = sorted(resultado.latencias)
+         print(f"Lote: {resultado.archivos} archivos en {resultado.segundos:.2f} s "
+               f"({resultado.archivos / resultado.segundos:.1f} archivos/s), {len(resultado.errores)} con errores")
+         print("Latencia por archivo: " + ', '.join(
+             f"{nombre} {percentil(latencias, fraccion) * 1000:.1f} ms"
+             for nombre, fraccion in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99), ('máx', 1.0))))
+         sys.exit(1 if resultado.errores else 0)
+
+     ensamblador = EnsambladorIA32(tamano_cache=args.cache, relajar=args.relajar,
+                                   estadisticas=args.estadisticas is not None, optimizar=args.optimizar)
+     if args.profile:
+         perfil = cProfile.Profile()
+         perfil.runcall(ejecutar, args, ensamblador)
+         perfil.dump_stats(args.profile)
+         print(f"Perfil guardado en {args.profile} (ver con python -m pstats {args.profile})")
+     else:
+         ejecutar(args, ensamblador)
+
+     if args.estadisticas is not None:
+         ensamblador.guardar_estadisticas(args.estadisticas)
 
      #Prueba adicional
     # ensamblador = EnsambladorIA32()
@@ -0,0 +1,289 @@
+import os
+import struct
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ensamblador import EnsambladorIA32
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Referencias hacia adelante y hacia atrás, llamadas, memoria con etiqueta, macros y
+# constantes, datos con etiquetas y .bss: todo lo que cruza de un bloque a otro
+PROGRAMA = """\
+TAM equ 8
+%macro sumar 2
+    add %1, %2
+%endmacro
+_start:
+    mov eax, 0
+    mov ecx, TAM
+bucle:
+    sumar eax, ecx
+    mov ebx, [tabla+ecx*4]
+    add ebx, 1
+    cmp ebx, 0
+    je saltar
+    call rutina
+saltar:
+    dec ecx
+    jne bucle
+    jmp fin
+fin:
+    mov edx, tabla
+    mov [contador], eax
+    ret
+rutina:
+    push ebx
+    mov ebx, 0
+    pop ebx
+    ret
+section .data
+tabla:
+    dd 1, 2, 3, 4, 5, 6, 7, 8, 9
+punteros:
+    dd rutina, fin+2, tabla
+section .bss
+contador:
+    resd 1
+"""
+
+
+def ensamblar_en(modo, ruta, directorio, **opciones):
+    # Ensambla ruta con el modo dado y devuelve el ensamblador ya resuelto
+    ensamblador = EnsambladorIA32(**opciones)
+    if modo == 'serie':
+        ensamblador.ensamblar(ruta)
+    elif modo == 'paralelo':
+        ensamblador.ensamblar_paralelo(ruta, trabajadores=2, lineas_por_bloque=4)
+    else:
+        ensamblador.ensamblar_incremental(ruta, os.path.join(directorio, 'cache'), lineas_por_bloque=4)
+    ensamblador.resolver_referencias_pendientes()
+    return ensamblador
+
+
+def saltos(ensamblador):
+    # {dirección de la instrucción: destino} de jmp, jcc y call, cortos y cercanos
+    imagen, base = ensamblador.imagen, ensamblador.base_imagen
+    inicios = list(ensamblador.inicios)
+    destinos = {}
+    for inicio, fin in zip(inicios, inicios[1:] + [ensamblador.contador_posicion]):
+        instruccion = imagen[inicio - base:fin - base]
+        if instruccion[0] == 0xEB or 0x70 <= instruccion[0] <= 0x7F:
+            destinos[inicio] = fin + struct.unpack('<b', instruccion[1:2])[0]
+        elif instruccion[0] in (0xE8, 0xE9):
+            destinos[inicio] = fin + struct.unpack('<i', instruccion[1:5])[0]
+        elif instruccion[0] == 0x0F and 0x80 <= instruccion[1] <= 0x8F:
+            destinos[inicio] = fin + struct.unpack('<i', instruccion[2:6])[0]
+    return destinos
+
+
+@pytest.mark.parametrize('opciones', [{}, {'relajar': True}, {'optimizar': True},
+                                      {'relajar': True, 'optimizar': True}])
+@pytest.mark.parametrize('programa', ['ejemplo', 'prueba1.asm', 'prueba2.asm'])
+def test_serie_paralelo_e_incremental_dan_los_mismos_bytes(tmp_path, programa, opciones):
+    if programa == 'ejemplo':
+        ruta = tmp_path / 'ejemplo.asm'
+        ruta.write_text(PROGRAMA)
+    else:
+        ruta = os.path.join(RAIZ, programa)
+    serie = ensamblar_en('serie', ruta, tmp_path, **opciones)
+    for modo in ('paralelo', 'incremental', 'incremental'):
+        otro = ensamblar_en(modo, ruta, tmp_path, **opciones)
+        assert bytes(otro.imagen) == bytes(serie.imagen), modo
+        assert otro.tabla_simbolos == serie.tabla_simbolos, modo
+        assert list(otro.inicios) == list(serie.inicios), modo
+        assert sorted(otro.reubicaciones) == sorted(serie.reubicaciones), modo
+    # La segunda pasada incremental toma todos los bloques del cache en disco
+    assert otro.bloques_ensamblados == 0 and otro.bloques_reutilizados > 0
+
+
+@pytest.mark.parametrize('relleno, largo_salto', [(127, 2), (128, 5)])
+def test_relajacion_hacia_adelante_en_el_borde_de_rel8(relleno, largo_salto):
+    # El desplazamiento es el relleno: destino - (jmp + 2)
+    ensamblador = EnsambladorIA32(relajar=True)
+    resultado = ensamblador.ensamblar_codigo(['    jmp destino', f'    times {relleno} nop', 'destino:', '    ret'])
+    assert len(resultado.codigo) == largo_salto + relleno + 1
+    assert resultado.codigo[0] == (0xEB if largo_salto == 2 else 0xE9)
+    assert saltos(ensamblador) == {0x1000: resultado.simbolos['destino']}
+    assert resultado.simbolos['destino'] == 0x1000 + largo_salto + relleno
+
+
+@pytest.mark.parametrize('relleno, largo_salto', [(126, 2), (127, 5)])
+def test_relajacion_hacia_atras_en_el_borde_de_rel8(relleno, largo_salto):
+    # El desplazamiento corto es -(relleno + 2): cabe en rel8 hasta -128
+    ensamblador = EnsambladorIA32(relajar=True)
+    resultado = ensamblador.ensamblar_codigo(['destino:', f'    times {relleno} nop', '    jmp destino'])
+    assert len(resultado.codigo) == relleno + largo_salto
+    assert saltos(ensamblador) == {0x1000 + relleno: 0x1000}
+
+
+@pytest.mark.parametrize('relleno, largo_salto', [(127, 2), (128, 6)])
+def test_relajacion_de_jcc_en_el_borde_de_rel8(relleno, largo_salto):
+    ensamblador = EnsambladorIA32(relajar=True)
+    resultado = ensamblador.ensamblar_codigo(['    jne destino', f'    times {relleno} nop', 'destino:', '    ret'])
+    assert len(resultado.codigo) == largo_salto + relleno + 1
+    assert saltos(ensamblador) == {0x1000: resultado.simbolos['destino']}
+
+
+def test_sin_relajar_los_saltos_son_cercanos():
+    ensamblador = EnsambladorIA32()
+    resultado = ensamblador.ensamblar_codigo(['    jmp destino', '    nop', 'destino:', '    ret'])
+    assert resultado.codigo[:5] == bytes((0xE9, 1, 0, 0, 0))
+    assert saltos(ensamblador) == {0x1000: resultado.simbolos['destino']}
+
+
+@pytest.mark.parametrize('relajar', [False, True])
+def test_mirilla_ahorra_bytes_y_conserva_las_direcciones(relajar):
+    normal = EnsambladorIA32(relajar=relajar)
+    sin_optimizar = normal.ensamblar_codigo(PROGRAMA)
+    optimizado = EnsambladorIA32(relajar=relajar, optimizar=True)
+    resultado = optimizado.ensamblar_codigo(PROGRAMA)
+
+    ahorrados = optimizado.optimizador.bytes_ahorrados()
+    assert ahorrados > 0
+    assert normal.secciones['.text'][1] - optimizado.secciones['.text'][1] == ahorrados
+    assert resultado.simbolos.keys() == sin_optimizar.simbolos.keys()
+
+    # Cada salto y llamada sigue llegando a la misma etiqueta, salvo jmp fin, que
+    # saltaba a la instrucción siguiente y se borró
+    etiquetas = {direccion: nombre for nombre, direccion in resultado.simbolos.items()}
+    etiquetas_normal = {direccion: nombre for nombre, direccion in sin_optimizar.simbolos.items()}
+    destinos_normal = [etiquetas_normal[destino] for destino in saltos(normal).values()]
+    destinos_normal.remove('fin')
+    assert sorted(etiquetas[destino] for destino in saltos(optimizado).values()) == sorted(destinos_normal)
+
+    # Los punteros de .data apuntan a las direcciones nuevas
+    punteros = resultado.simbolos['punteros'] - resultado.origen
+    assert struct.unpack_from('<3I', resultado.codigo, punteros) == (
+        resultado.simbolos['rutina'], resultado.simbolos['fin'] + 2, resultado.simbolos['tabla'])
+    # Y los campos absolutos de .text también (mov edx, tabla)
+    for campo in resultado.reubicaciones:
+        valor = struct.unpack_from('<I', resultado.codigo, campo - resultado.origen)[0]
+        assert resultado.origen <= valor < resultado.origen + len(resultado.codigo) + resultado.tamano_bss
+
+
+def test_mirilla_no_toca_instrucciones_con_banderas_vivas():
+    ensamblador = EnsambladorIA32(optimizar=True)
+    resultado = ensamblador.ensamblar_codigo(
+        ['    mov eax, 0', '    add ebx, 1', '    jae fin', '    mov ecx, 0', '    je fin', 'fin:', '    ret'])
+    # add ebx, 1 no pasa a inc porque jae lee CF, ni mov ecx, 0 a xor porque je lee ZF;
+    # mov eax, 0 sí pasa a xor, porque add escribe las banderas antes del salto
+    instrucciones = [resultado.codigo[inicio - 0x1000:fin - 0x1000] for inicio, fin
+                     in zip(ensamblador.inicios, list(ensamblador.inicios[1:]) + [ensamblador.contador_posicion])]
+    assert instrucciones[0] == bytes((0x31, 0xC0))
+    assert instrucciones[1] == bytes((0x83, 0xC3, 0x01))
+    assert instrucciones[3] == bytes((0xB9, 0, 0, 0, 0))
+    assert ensamblador.optimizador.bytes_ahorrados() == 3
+
+
+def leer_elf(elf):
+    # Cabecera ELF32 y {nombre: (tipo, desplazamiento, tamaño)} de las secciones
+    assert elf[:4] == b'\x7fELF'
+    assert elf[4:7] == bytes((1, 1, 1))  # ELF32, little endian, versión 1
+    (tipo, maquina, _, entrada, desplazamiento_ph, desplazamiento_sh, _, _, _, num_ph,
+     tamano_sh, num_sh, indice_nombres) = struct.unpack_from('<HHIIIIIHHHHHH', elf, 16)
+    assert maquina == 3 and tamano_sh == 40
+    cabeceras = [struct.unpack_from('<10I', elf, desplazamiento_sh + i * 40) for i in range(num_sh)]
+    nombres = cabeceras[indice_nombres]
+    secciones = {}
+    for cabecera in cabeceras[1:]:
+        inicio = nombres[4] + cabecera[0]
+        nombre = elf[inicio:elf.index(b'\0', inicio)].decode()
+        secciones[nombre] = (cabecera[1], cabecera[4], cabecera[5])
+    return tipo, entrada, desplazamiento_ph, num_ph, secciones
+
+
+def test_elf_ejecutable():
+    ensamblador = EnsambladorIA32()
+    resultado = ensamblador.ensamblar_codigo(PROGRAMA)
+    elf = ensamblador.construir_elf()
+    tipo, entrada, desplazamiento_ph, num_ph, secciones = leer_elf(elf)
+    assert tipo == 2 and num_ph == 1
+    assert entrada == resultado.simbolos['_start']
+    # Un PT_LOAD con la imagen en base_imagen y .bss sin ocupar lugar en el archivo
+    (tipo_ph, desplazamiento, virtual, _, en_archivo, en_memoria,
+     _, _) = struct.unpack_from('<8I', elf, desplazamiento_ph)
+    assert tipo_ph == 1 and virtual == resultado.origen
+    assert elf[desplazamiento:desplazamiento + en_archivo] == resultado.codigo
+    assert en_memoria == en_archivo + resultado.tamano_bss
+    assert {'.text', '.data', '.bss', '.symtab', '.strtab', '.shstrtab'} <= secciones.keys()
+    assert secciones['.bss'][0] == 8  # SHT_NOBITS
+
+
+def test_elf_reubicable():
+    ensamblador = EnsambladorIA32()
+    ensamblador.ensamblar_codigo(PROGRAMA)
+    elf = ensamblador.construir_elf(reubicable=True)
+    tipo, entrada, _, num_ph, secciones = leer_elf(elf)
+    assert tipo == 1 and entrada == 0 and num_ph == 0
+    # Una reubicación R_386_32 por campo absoluto: [tabla+ecx*4], mov edx, tabla y
+    # mov [contador], eax en .text; los tres punteros en .data
+    _, desplazamiento, tamano = secciones['.rel.text']
+    assert tamano == 8 * 3
+    _, desplazamiento, tamano = secciones['.rel.data']
+    assert tamano == 8 * 3
+    for i in range(3):
+        assert struct.unpack_from('<2I', elf, desplazamiento + 8 * i)[1] & 0xFF == 1  # R_386_32
+
+
+def leer_intel_hex(texto):
+    # Verifica las sumas de cada registro y devuelve {dirección: byte}
+    memoria = {}
+    alta = 0
+    registros = texto.split()
+    assert registros[-1] == ':00000001FF'
+    for registro in registros[:-1]:
+        assert registro[0] == ':'
+        datos = bytes.fromhex(registro[1:])
+        assert sum(datos) & 0xFF == 0
+        largo, direccion, tipo = datos[0], int.from_bytes(datos[1:3], 'big'), datos[3]
+        assert len(datos) == largo + 5
+        if tipo == 4:
+            alta = int.from_bytes(datos[4:6], 'big') << 16
+        else:
+            assert tipo == 0 and largo <= 16
+            for i, byte in enumerate(datos[4:-1]):
+                memoria[alta + direccion + i] = byte
+    return memoria
+
+
+@pytest.mark.parametrize('origen', [0x1000, 0xFFF0])
+def test_intel_hex(origen):
+    ensamblador = EnsambladorIA32()
+    resultado = ensamblador.ensamblar_codigo(PROGRAMA, origen=origen)
+    texto = ensamblador.construir_intel_hex()
+    assert texto.endswith('\n')
+    memoria = leer_intel_hex(texto)
+    assert bytes(memoria[origen + i] for i in range(len(resultado.codigo))) == resultado.codigo
+    assert len(memoria) == len(resultado.codigo)
+    # Al cruzar los 64 KiB hay un registro de dirección lineal extendida
+    assert (':020000040001F9' in texto) == (origen + len(resultado.codigo) > 0x10000)
+
+
+@pytest.mark.parametrize('fuente, mensaje', [
+    (['A equ B', 'B equ A'], r"Constante B definida en términos de sí misma \(línea 2\)"),
+    (['A equ A+1'], r"Constante A definida en términos de sí misma \(línea 1\)"),
+    (['%rep 99999999999', 'nop', '%endrep'], r"Cuenta de repetición demasiado grande: 99999999999 \(máximo 16777216\)"),
+    (['times 1<<30 nop'], r"Cuenta de repetición demasiado grande"),
+    (['X equ 1<<64', 'mov eax, X'], r"Valor fuera de rango en 1<<64: más de 64 bits \(línea 1\)"),
+    (['X equ 1<<40', 'Y equ X*X*X'], r"más de 64 bits \(línea 2\)"),
+    (['section .data', 'a:', '    dd a+x'], r"Desplazamiento inválido en dd: a\+x \(solo etiqueta\+número\) \(línea 3\)"),
+    (['section .data', '    db a'], r"Valor inválido en db: a \(solo dd admite etiquetas\) \(línea 2\)"),
+])
+def test_errores_del_preprocesador_y_los_datos(fuente, mensaje):
+    with pytest.raises(ValueError, match=mensaje):
+        EnsambladorIA32().ensamblar_codigo(fuente)
+
+
+@pytest.mark.parametrize('linea, excepcion, mensaje', [
+    ('foo eax, 1', NotImplementedError, r"Instrucción foo no soportada aún \(línea 2\)"),
+    ('push ebx, ecx', NotImplementedError, r"push con operandos ebx, ecx no soportado \(línea 2\)"),
+    ('mov eax, 0x1ffffffff', ValueError, r"Inmediato fuera de rango de 32 bits: 8589934591 \(línea 2\)"),
+    ('mov eax, 12z', ValueError, r"Inmediato inválido: 12z \(línea 2\)"),
+])
+def test_errores_de_instruccion_con_linea(linea, excepcion, mensaje):
+    with pytest.raises(excepcion, match=mensaje):
+        EnsambladorIA32().ensamblar_codigo(['    nop', '    ' + linea])